@@ -5,23 +5,36 @@
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
 import asyncio
+import collections
 import datetime
 import logging
+import threading
 from logging import handlers
 
 
 class AppLogger(object):
-    """ """
+    """
+    Log messages for the user interface, in a bounded ring with a
+    sequence number for each message. Can be called from any thread.
+    Clients are notified once per event loop tick, also for a burst
+    of messages. A short lock is used for the ring, the sequence number
+    and the notification flag.
+    """
 
     def __init__(self, logger="DefaultLogger"):
         """ """
         self.logger_name = logger
         self.logger = logging.getLogger(logger)
         self.logging_event = None
-        self.client_messages = []
         self.event_loop = None
         # Config.
         self.max_client_messages = 80
+        # Ring of (sequence number, message), oldest removed when full.
+        self.client_messages = collections.deque(maxlen=self.max_client_messages)
+        self.sequence_number = 0
+        # Only held while changing the ring or the flag, never while waiting.
+        self.ring_lock = threading.Lock()
+        self.notify_scheduled = False
 
     async def startup(self):
         """ """
@@ -51,42 +64,45 @@ class AppLogger(object):
         # self.write_log("debug", message)
 
     def write_log(self, msg_type, message):
-        """ """
-        # Run the rest in the main asyncio event loop.
-        datetime_local = datetime.datetime.now()
-        asyncio.run_coroutine_threadsafe(
-            self.write_log_async(msg_type, datetime_local, message),
-            self.event_loop,
-        )
+        """Added to the ring directly, the event loop is only called if
+        a notification is not already scheduled. The flag is checked and
+        set under the lock, to schedule exactly one call for a burst."""
+        if not message:
+            return
+        if msg_type not in ["info", "warning", "error"]:
+            return
+        time_str = datetime.datetime.now().strftime("%H:%M:%S")
+        if msg_type in ["warning", "error"]:
+            row = time_str + " - " + msg_type.capitalize() + ": " + message
+        else:
+            row = time_str + " - " + message
+        with self.ring_lock:
+            self.sequence_number += 1
+            self.client_messages.append((self.sequence_number, row))
+            if self.notify_scheduled or (self.event_loop is None):
+                return
+            self.notify_scheduled = True
+        try:
+            self.event_loop.call_soon_threadsafe(self.notify_clients)
+        except RuntimeError:
+            # Event loop closed.
+            with self.ring_lock:
+                self.notify_scheduled = False
 
-    async def write_log_async(self, msg_type, datetime_local, message):
-        """ """
+    def notify_clients(self):
+        """Called in the event loop. Messages added after the flag is
+        cleared will schedule a new call."""
         try:
-            time_str = datetime_local.strftime("%H:%M:%S")
-            # datetime_str = datetime_local.strftime("%Y-%m-%d %H:%M:%S%z")
-            if message:
-                if msg_type in ["info", "warning", "error"]:
-                    if msg_type in ["warning", "error"]:
-                        self.client_messages.append(
-                            time_str
-                            + " - "
-                            + msg_type.capitalize()
-                            + ": "
-                            + message
-                        )
-                    else:
-                        self.client_messages.append(time_str + " - " + message)
-                    # Log list too large. Remove oldest item.
-                    if len(self.client_messages) > self.max_client_messages:
-                        del self.client_messages[0]
-                    # Create a new event and release all from the old event.
-                    old_logging_event = self.logging_event
-                    self.logging_event = asyncio.Event()
-                    if old_logging_event:
-                        old_logging_event.set()
+            with self.ring_lock:
+                self.notify_scheduled = False
+            # Create a new event and release all from the old event.
+            old_logging_event = self.logging_event
+            self.logging_event = asyncio.Event()
+            if old_logging_event:
+                old_logging_event.set()
         except Exception as e:
             # Can't log this, must use print.
-            print("Exception: Logging: write_log_async: ", e)
+            print("Exception: Logging: notify_clients: ", e)
 
     async def get_logging_event(self):
         """ """
@@ -100,5 +116,18 @@ class AppLogger(object):
             self.error(message)
 
     async def get_client_messages(self):
-        """ """
-        return self.client_messages[::-1]
+        """Newest first."""
+        with self.ring_lock:
+            rows = list(self.client_messages)
+        return [row for _sequence_number, row in reversed(rows)]
+
+    def get_client_messages_since(self, sequence_number=0):
+        """Messages newer than sequence_number, newest first, and the last
+        sequence number to be used in the next call."""
+        with self.ring_lock:
+            rows = [item for item in self.client_messages if item[0] > sequence_number]
+            last_sequence_number = self.sequence_number
+        return {
+            "sequence_number": last_sequence_number,
+            "log_rows": [row for _sequence_number, row in reversed(rows)],
+        }
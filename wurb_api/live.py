@@ -4,9 +4,11 @@
 # Copyright (c) 2023-present Arnold Andreasson
 # License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
 
+import asyncio
 import logging
 import fastapi
 import fastapi.templating
+import websockets.exceptions
 import wurb_core
 
 logger = logging.getLogger(wurb_core.used_logger)
@@ -38,12 +40,84 @@ async def load_live_page(request: fastapi.Request):
 # @app.get("/set-audio-feedback/")
 async def set_audio_feedback(volume: str, pitch: str):
     try:
-        global wurb_rec_manager
         # Logging debug.
         message = "API called: set-audio-feedback."
-        wurb_rec_manager.wurb_logging.debug(message=message)
-        await wurb_rec_manager.wurb_settings.set_audio_feedback(volume, pitch)
+        logger.debug(message)
+        await wurb_core.wurb_settings.set_audio_feedback(volume, pitch)
     except Exception as e:
         # Logging error.
         message = "Called: set_audio_feedback: " + str(e)
-        wurb_rec_manager.wurb_logging.error(message)
+        wurb_core.wurb_logger.error(message)
+
+
+async def stream_hub_to_websocket(websocket, stream_hub, first_json=None):
+    """Sends messages from a StreamHub until the client disconnects. Bytes
+    are sent as binary messages and strings as text messages. Other hubs
+    can be used if subscribe() returns an object with an async get()."""
+    await websocket.accept()
+    if first_json:
+        await websocket.send_json(first_json)
+    client_queue = stream_hub.subscribe()
+    # Used to detect when the client disconnects.
+    receive_task = asyncio.create_task(websocket.receive())
+    try:
+        while True:
+            get_task = asyncio.create_task(client_queue.get())
+            done, _pending = await asyncio.wait(
+                [get_task, receive_task], return_when=asyncio.FIRST_COMPLETED
+            )
+            if receive_task in done:
+                get_task.cancel()
+                if receive_task.result().get("type") == "websocket.disconnect":
+                    break
+                # Messages from the client are not used.
+                receive_task = asyncio.create_task(websocket.receive())
+                continue
+            message = get_task.result()
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(message)
+    finally:
+        receive_task.cancel()
+        stream_hub.unsubscribe(client_queue)
+
+
+@live_router.websocket("/live/audio-stream")
+async def audio_stream_websocket(websocket: fastapi.WebSocket):
+    """Audio feedback as int16 mono binary messages. The first message is
+    JSON with the format and sampling frequency."""
+    try:
+        logger.debug("API Websocket initiated: audio-stream.")
+        audiofeedback = wurb_core.wurb_audiofeedback
+        await stream_hub_to_websocket(
+            websocket,
+            audiofeedback.audio_hub,
+            first_json=audiofeedback.get_stream_format(),
+        )
+    except (fastapi.WebSocketDisconnect, websockets.exceptions.ConnectionClosed):
+        pass
+    except Exception as e:
+        # Logging error.
+        message = "Called: audio_stream_websocket: " + str(e)
+        logger.error(message)
+
+
+@live_router.websocket("/live/spectrogram-stream")
+async def spectrogram_stream_websocket(websocket: fastapi.WebSocket):
+    """Spectrogram columns as uint8 binary messages, one byte per row. The
+    first message is JSON with the number of rows and the frequency range."""
+    try:
+        logger.debug("API Websocket initiated: spectrogram-stream.")
+        live_spectrogram = wurb_core.wurb_live_spectrogram
+        await stream_hub_to_websocket(
+            websocket,
+            live_spectrogram.spectrogram_hub,
+            first_json=live_spectrogram.get_stream_format(),
+        )
+    except (fastapi.WebSocketDisconnect, websockets.exceptions.ConnectionClosed):
+        pass
+    except Exception as e:
+        # Logging error.
+        message = "Called: spectrogram_stream_websocket: " + str(e)
+        logger.error(message)
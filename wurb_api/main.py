@@ -39,12 +39,20 @@ templates = fastapi.templating.Jinja2Templates(directory="wurb_app/templates")
 async def startup_event():
     """ """
     logger.debug("API called: startup.")
+    await wurb_core.wurb_audiofeedback.startup()
+    await wurb_core.wurb_live_spectrogram.startup()
+    await wurb_core.wurb_status_hub.startup()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """ """
     logger.debug("API called: shutdown.")
+    await wurb_core.wurb_audiofeedback.shutdown()
+    await wurb_core.wurb_live_spectrogram.shutdown()
+    await wurb_core.wurb_status_hub.shutdown()
+    # Latency summary, if tracing is enabled.
+    wurb_core.tracing.log_latency()
 
 
 # Include modules.
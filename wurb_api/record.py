@@ -15,6 +15,7 @@ from typing import Optional
 import websockets.exceptions
 
 import wurb_core
+from wurb_api.live import stream_hub_to_websocket
 
 logger = logging.getLogger(wurb_core.used_logger)
 templates = fastapi.templating.Jinja2Templates(directory="wurb_app/templates")
@@ -79,8 +80,12 @@ class DetectorSettings(BaseModel):
     detectionLimitKhz: Optional[float] = None
     detectionSensitivityDbfs: Optional[float] = None
     detectionAlgorithm: Optional[str] = None
+    detectionBandsKhz: Optional[str] = None
+    detectionSnrDb: Optional[float] = None
     recLengthS: Optional[str] = None
     rec_type: Optional[str] = None
+    recFormat: Optional[str] = None
+    recSegmentMb: Optional[float] = None
     feedbackOnOff: Optional[str] = None
     feedbackVolume: Optional[float] = None
     feedbackPitch: Optional[float] = None
@@ -135,20 +140,61 @@ async def get_status():
         
         # Logging debug.
         logger.debug("API called: get-status.")
-        status_dict = await wurb_rec_manager.get_status_dict()
-        location_status = wurb_core.wurb_settings.get_location_status()
-        return {
-            "rec_status": status_dict.get("rec_status", ""),
-            "location_status": location_status,
-            "device_name": status_dict.get("device_name", ""),
-            "detector_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-        }
+        return wurb_core.wurb_status_hub.get_status_dict()
     except Exception as e:
         # Logging error.
         message = "Called: get_status: " + str(e)
         logger.error(message)
 
 
+@record_router.get(
+    "/record/get-metrics/",
+    tags=["Recorder"],
+    description="Counters and gauges for each stage in the audio pipeline.",
+)
+async def get_metrics():
+    try:
+        # Logging debug.
+        logger.debug("API called: get-metrics.")
+        return wurb_core.metrics.get_metrics()
+    except Exception as e:
+        # Logging error.
+        message = "Called: get_metrics: " + str(e)
+        logger.error(message)
+
+
+@record_router.get(
+    "/record/get-log-messages/",
+    tags=["Recorder"],
+    description="Log messages newer than the sequence number, newest first.",
+)
+async def get_log_messages(since: int = 0):
+    try:
+        # Logging debug.
+        logger.debug("API called: get-log-messages.")
+        return wurb_core.wurb_logger.get_client_messages_since(since)
+    except Exception as e:
+        # Logging error.
+        message = "Called: get_log_messages: " + str(e)
+        logger.error(message)
+
+
+@record_router.get(
+    "/record/get-latency/",
+    tags=["Recorder"],
+    description="Latency percentiles for each stage, if tracing is enabled.",
+)
+async def get_latency():
+    try:
+        # Logging debug.
+        logger.debug("API called: get-latency.")
+        return wurb_core.tracing.get_latency()
+    except Exception as e:
+        # Logging error.
+        message = "Called: get_latency: " + str(e)
+        logger.error(message)
+
+
 @record_router.post(
     "/record/save-location/", tags=["Recorder"], description="Record..."
 )
@@ -341,89 +387,20 @@ async def rec_manual_trigger():
         logger.error(message)
 
 
-
-# @record_router.get(
-#     "/record/ws", tags=["Recorder"], description="Record..."
-# )
-# # @app.websocket("/ws")
-# async def websocket_endpoint(websocket: fastapi.WebSocket):
-#     try:
-        
-#         # Logging debug.
-#         logger.debug("API Websocket initiated.")
-#         #
-#         wurb_settings = wurb_core.wurb_settings
-#         wurb_logging = logger
-#         #
-#         await websocket.accept()
-#         #
-#         # Get event notification objects.
-#         rec_manager_notification = await wurb_rec_manager.get_notification_event()
-#         location_changed_notification = await wurb_settings.get_location_event()
-#         latlong_changed_notification = await wurb_settings.get_latlong_event()
-#         settings_changed_notification = await wurb_settings.get_settings_event()
-#         logging_changed_notification = await wurb_logging.get_logging_event()
-#         # Update client.
-#         ws_json = {}
-#         status_dict = await wurb_rec_manager.get_status_dict()
-#         location_status = wurb_settings.get_location_status()
-#         ws_json["status"] = {
-#             "rec_status": status_dict.get("rec_status", ""),
-#             "location_status": location_status,
-#             "device_name": status_dict.get("device_name", ""),
-#             "detector_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-#         }
-#         ws_json["location"] = await wurb_settings.get_location()
-#         ws_json["latlong"] = await wurb_settings.get_location()
-#         ws_json["settings"] = await wurb_settings.get_settings()
-#         ws_json["log_rows"] = await wurb_logging.get_client_messages()
-#         # Send update to client.
-#         await websocket.send_json(ws_json)
-#         # Loop.
-#         while True:
-#             # Wait for next event to happen.
-#             events = [
-#                 asyncio.sleep(1.0),  # Update detector time field each second.
-#                 rec_manager_notification.wait(),
-#                 location_changed_notification.wait(),
-#                 latlong_changed_notification.wait(),
-#                 settings_changed_notification.wait(),
-#                 logging_changed_notification.wait(),
-#             ]
-#             await asyncio.wait(events, return_when=asyncio.FIRST_COMPLETED)
-
-#             # Prepare message to client.
-#             ws_json = {}
-#             status_dict = await wurb_rec_manager.get_status_dict()
-#             location_status = wurb_settings.get_location_status()
-#             ws_json["status"] = {
-#                 "rec_status": status_dict.get("rec_status", ""),
-#                 "location_status": location_status,
-#                 "device_name": status_dict.get("device_name", ""),
-#                 "detector_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-#             }
-#             rec_manager_notification = await wurb_rec_manager.get_notification_event()
-#             if location_changed_notification.is_set():
-#                 location_changed_notification = await wurb_settings.get_location_event()
-#                 ws_json["location"] = await wurb_settings.get_location()
-#             if latlong_changed_notification.is_set():
-#                 latlong_changed_notification = await wurb_settings.get_latlong_event()
-#                 ws_json["latlong"] = await wurb_settings.get_location()
-#             if settings_changed_notification.is_set():
-#                 settings_changed_notification = await wurb_settings.get_settings_event()
-#                 ws_json["settings"] = await wurb_settings.get_settings()
-#             if logging_changed_notification.is_set():
-#                 logging_changed_notification = await wurb_logging.get_logging_event()
-#                 ws_json["log_rows"] = await wurb_logging.get_client_messages()
-#             # Send to client.
-#             await websocket.send_json(ws_json)
-
-#     except websockets.exceptions.ConnectionClosed as e:
-#         pass
-#     except Exception as e:
-#         # Logging error.
-#         message = "Called: websocket_endpoint: " + str(e)
-#         logger.error(message)
+@record_router.websocket("/record/ws")
+async def websocket_endpoint(websocket: fastapi.WebSocket):
+    """Status, location, settings and log rows. Only changed sections
+    are sent, all sections in the first message."""
+    try:
+        # Logging debug.
+        logger.debug("API Websocket initiated.")
+        await stream_hub_to_websocket(websocket, wurb_core.wurb_status_hub)
+    except (fastapi.WebSocketDisconnect, websockets.exceptions.ConnectionClosed):
+        pass
+    except Exception as e:
+        # Logging error.
+        message = "Called: websocket_endpoint: " + str(e)
+        logger.error(message)
 
 
 # # Example:
@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import asyncio
+import json
+import logging
+import time
+
+# CloudedBats.
+import wurb_core
+
+
+class StatusClient:
+    """Sections changed since the last message. A slow client gets one
+    message with the latest content instead of a queue of old messages."""
+
+    def __init__(self, status_hub):
+        """ """
+        self.status_hub = status_hub
+        self.pending_sections = set()
+        self.pending_event = asyncio.Event()
+
+    def add_sections(self, sections):
+        """ """
+        self.pending_sections.update(sections)
+        self.pending_event.set()
+
+    async def get(self):
+        """Waits for changes. Same interface as asyncio.Queue.get()."""
+        while not self.pending_sections:
+            self.pending_event.clear()
+            await self.pending_event.wait()
+        sections = self.pending_sections
+        self.pending_sections = set()
+        return self.status_hub.get_message(sections)
+
+
+class WurbStatusHub:
+    """
+    Status, location, settings and log rows pushed to all clients.
+    One broadcast task waits for the notification events, rebuilds and
+    serializes only the sections with changes, and marks them for all
+    clients. Messages are coalesced to max_messages_per_s, and a message
+    with the same sections is only joined once for all clients.
+    The task is only running when there are clients.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        self.sections = ["status", "location", "latlong", "settings", "logRows"]
+        self.max_messages_per_s = 4.0
+        # Detector time in the status section.
+        self.status_interval_s = 1.0
+        self.clients = []
+        self.broadcast_task = None
+        self.clear()
+
+    def clear(self):
+        """ """
+        # Serialized once, JSON for each section.
+        self.section_json = {}
+        self.message_cache = {}
+        # Events from the last check, one for each source.
+        self.events = {}
+
+    async def startup(self):
+        """ """
+        self.max_messages_per_s = float(
+            wurb_core.config.get("status_stream.max_messages_per_s", default=4.0)
+        )
+
+    async def shutdown(self):
+        """ """
+        self.stop_broadcast()
+
+    def subscribe(self):
+        """Returns a client with an async get() method."""
+        client = StatusClient(self)
+        self.clients.append(client)
+        wurb_core.metrics.set_gauge("status_stream", "clients", len(self.clients))
+        if self.broadcast_task is None:
+            self.broadcast_task = asyncio.create_task(self.run_broadcast())
+        elif self.section_json:
+            # The sections are up to date while the task is running.
+            client.add_sections(self.section_json.keys())
+        return client
+
+    def unsubscribe(self, client):
+        """ """
+        if client in self.clients:
+            self.clients.remove(client)
+        wurb_core.metrics.set_gauge("status_stream", "clients", len(self.clients))
+        if not self.clients:
+            self.stop_broadcast()
+
+    def stop_broadcast(self):
+        """ """
+        if self.broadcast_task:
+            self.broadcast_task.cancel()
+            self.broadcast_task = None
+        self.clear()
+
+    def get_message(self, sections):
+        """Sections are joined from the serialized parts, not serialized again."""
+        key = tuple(name for name in self.sections if name in sections)
+        message = self.message_cache.get(key, None)
+        if message is None:
+            parts = [
+                json.dumps(name) + ":" + self.section_json[name]
+                for name in key
+                if name in self.section_json
+            ]
+            message = "{" + ",".join(parts) + "}"
+            self.message_cache[key] = message
+        return message
+
+    def get_status_dict(self):
+        """Also used by the get-status API."""
+        recorder = wurb_core.wurb_recorder
+        # Avoid too long device names in the user interface.
+        device_name = str(recorder.device_name)
+        device_name = device_name.replace("USB Ultrasound Microphone", "")
+        if len(device_name) > 25:
+            device_name = device_name[:24] + "..."
+        return {
+            "rec_status": recorder.rec_status,
+            "location_status": wurb_core.wurb_settings.get_location_status(),
+            "device_name": device_name,
+            "detector_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    async def get_section(self, name):
+        """Content for each section, as used in record_client.js."""
+        wurb_settings = wurb_core.wurb_settings
+        if name == "status":
+            status_dict = self.get_status_dict()
+            return {
+                "recStatus": status_dict["rec_status"],
+                "locationStatus": status_dict["location_status"],
+                "deviceName": status_dict["device_name"],
+                "detectorTime": status_dict["detector_time"],
+            }
+        if name in ["location", "latlong"]:
+            return await wurb_settings.get_location()
+        if name == "settings":
+            return await wurb_settings.get_settings()
+        if name == "logRows":
+            return await wurb_core.wurb_logger.get_client_messages()
+        return None
+
+    async def get_events(self):
+        """Current notification event for each source, and the sections
+        to update when set. Events are replaced by the sources on change."""
+        wurb_settings = wurb_core.wurb_settings
+        return {
+            "recorder": (
+                await wurb_core.wurb_recorder.get_notification_event(),
+                ["status"],
+            ),
+            "devices": (
+                await wurb_core.wurb_ultrasond_device.get_notification_event(),
+                ["status"],
+            ),
+            "location": (
+                await wurb_settings.get_location_event(),
+                ["location", "status"],
+            ),
+            "latlong": (
+                await wurb_settings.get_latlong_event(),
+                ["latlong", "status"],
+            ),
+            "settings": (await wurb_settings.get_settings_event(), ["settings"]),
+            "logging": (await wurb_core.wurb_logger.get_logging_event(), ["logRows"]),
+        }
+
+    async def check_events(self):
+        """Returns the sections to update. Only sources with a set event
+        get a new event, so changes between checks are not lost."""
+        changed = set()
+        current_events = await self.get_events()
+        for source, (event, sections) in current_events.items():
+            old_event = self.events.get(source, None)
+            if old_event is None:
+                self.events[source] = event
+            elif old_event.is_set():
+                changed.update(sections)
+                self.events[source] = event
+        return changed
+
+    async def wait_for_events(self, timeout):
+        """ """
+        waiters = [asyncio.create_task(event.wait()) for event in self.events.values()]
+        try:
+            await asyncio.wait(
+                waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def update_sections(self, sections):
+        """Serialized once. Returns the sections where the content differs."""
+        changed = []
+        for name in sections:
+            section_json = json.dumps(await self.get_section(name))
+            if section_json != self.section_json.get(name, None):
+                self.section_json[name] = section_json
+                changed.append(name)
+        return changed
+
+    async def run_broadcast(self):
+        """ """
+        metrics = wurb_core.metrics
+        changed = []
+        last_status_time = 0.0
+        while True:
+            try:
+                if not self.events:
+                    # First pass, all sections.
+                    await self.check_events()
+                    changed = await self.update_sections(self.sections)
+                    last_status_time = time.time()
+                if changed:
+                    self.message_cache = {}
+                    for client in self.clients:
+                        client.add_sections(changed)
+                    metrics.count("status_stream", "broadcasts")
+                    metrics.count("status_stream", "messages_out", len(self.clients))
+                # Coalesce, changes during the sleep are sent together.
+                await asyncio.sleep(1.0 / self.max_messages_per_s)
+                next_status_time = last_status_time + self.status_interval_s
+                await self.wait_for_events(max(0.0, next_status_time - time.time()))
+                sections = await self.check_events()
+                if time.time() >= next_status_time:
+                    sections.add("status")
+                    last_status_time = time.time()
+                changed = await self.update_sections(sections)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                # Logging error.
+                message = "StatusHub: run_broadcast: " + str(e)
+                self.logger.error(message)
+                changed = []
+                await asyncio.sleep(1.0)
@@ -4,11 +4,185 @@ async function setAudioFeedback() {
     try {
         let volume = byId("feedbackVolumeSliderId").value;
         let pitch = byId("feedbackPitchSliderId").value;
-        let urlString = "/live/set-audio-feedback/?volume=${volume}&pitch=${pitch}";
+        let urlString = `/live/set-audio-feedback/?volume=${volume}&pitch=${pitch}`;
         await fetch(urlString);
     } catch (err) {
-        alert("ERROR setAudioFeedback: ${err}");
+        alert(`ERROR setAudioFeedback: ${err}`);
         console.log(err);
     };
 };
 
+// Audio feedback streamed over WebSocket. The first message is JSON with
+// the format, then int16 mono buffers as binary messages.
+var liveAudioWebsocket = null;
+var liveAudioContext = null;
+var liveAudioSamplingFreq = 16000;
+var liveAudioNextTime = 0;
+// Seconds. Added before the first buffer, and max delay before skipping.
+const liveAudioStartLatency = 0.3;
+const liveAudioMaxLatency = 1.5;
+
+function liveAudioToggleListen() {
+    if (liveAudioWebsocket) {
+        liveAudioStop();
+    } else {
+        liveAudioStart();
+    };
+};
+
+function liveAudioStart() {
+    try {
+        // Must be created from a user action in most browsers.
+        liveAudioContext = new AudioContext();
+        liveAudioNextTime = 0;
+        let protocol = (window.location.protocol === "https:") ? "wss:" : "ws:";
+        let wsUrl = `${protocol}//${window.location.host}/live/audio-stream`;
+        liveAudioWebsocket = new WebSocket(wsUrl);
+        liveAudioWebsocket.binaryType = "arraybuffer";
+        liveAudioWebsocket.onmessage = function (event) {
+            if (typeof event.data === "string") {
+                let streamFormat = JSON.parse(event.data);
+                liveAudioSamplingFreq = streamFormat.sampling_freq_hz;
+            } else {
+                liveAudioPlayBuffer(event.data);
+            };
+        };
+        liveAudioWebsocket.onclose = function () {
+            liveAudioStop();
+        };
+        byId("liveAudioListenId").textContent = "Stop listening";
+    } catch (err) {
+        alert(`ERROR liveAudioStart: ${err}`);
+        console.log(err);
+    };
+};
+
+function liveAudioStop() {
+    if (liveAudioWebsocket) {
+        let websocket = liveAudioWebsocket;
+        liveAudioWebsocket = null;
+        websocket.close();
+    };
+    if (liveAudioContext) {
+        liveAudioContext.close();
+        liveAudioContext = null;
+    };
+    byId("liveAudioListenId").textContent = "Listen in browser";
+};
+
+function liveAudioPlayBuffer(arrayBuffer) {
+    let samples = new Int16Array(arrayBuffer);
+    if ((liveAudioContext === null) || (samples.length === 0)) {
+        return;
+    };
+    let audioBuffer = liveAudioContext.createBuffer(1, samples.length, liveAudioSamplingFreq);
+    let channelData = audioBuffer.getChannelData(0);
+    for (let i = 0; i < samples.length; i++) {
+        channelData[i] = samples[i] / 32768.0;
+    };
+    // Buffers are scheduled back to back. Restart if too late or too early.
+    let now = liveAudioContext.currentTime;
+    if ((liveAudioNextTime < now) || (liveAudioNextTime > now + liveAudioMaxLatency)) {
+        liveAudioNextTime = now + liveAudioStartLatency;
+    };
+    let source = liveAudioContext.createBufferSource();
+    source.buffer = audioBuffer;
+    source.connect(liveAudioContext.destination);
+    source.start(liveAudioNextTime);
+    liveAudioNextTime += audioBuffer.duration;
+};
+
+// Live spectrogram streamed over WebSocket. The first message is JSON with
+// the number of rows and the frequency range, then uint8 columns as binary
+// messages. Each column has one byte per row, low frequencies first.
+var liveSpectrogramWebsocket = null;
+var liveSpectrogramRows = 128;
+var liveSpectrogramPalette = null;
+
+function liveSpectrogramToggleView() {
+    if (liveSpectrogramWebsocket) {
+        liveSpectrogramStop();
+    } else {
+        liveSpectrogramStart();
+    };
+};
+
+function liveSpectrogramStart() {
+    try {
+        liveSpectrogramPalette = liveSpectrogramCreatePalette();
+        let protocol = (window.location.protocol === "https:") ? "wss:" : "ws:";
+        let wsUrl = `${protocol}//${window.location.host}/live/spectrogram-stream`;
+        liveSpectrogramWebsocket = new WebSocket(wsUrl);
+        liveSpectrogramWebsocket.binaryType = "arraybuffer";
+        liveSpectrogramWebsocket.onmessage = function (event) {
+            if (typeof event.data === "string") {
+                liveSpectrogramSetFormat(JSON.parse(event.data));
+            } else {
+                liveSpectrogramDrawColumns(new Uint8Array(event.data));
+            };
+        };
+        liveSpectrogramWebsocket.onclose = function () {
+            liveSpectrogramStop();
+        };
+        byId("liveSpectrogramViewId").textContent = "Stop live";
+    } catch (err) {
+        alert(`ERROR liveSpectrogramStart: ${err}`);
+        console.log(err);
+    };
+};
+
+function liveSpectrogramStop() {
+    if (liveSpectrogramWebsocket) {
+        let websocket = liveSpectrogramWebsocket;
+        liveSpectrogramWebsocket = null;
+        websocket.close();
+    };
+    byId("liveSpectrogramViewId").textContent = "Show live";
+};
+
+function liveSpectrogramSetFormat(streamFormat) {
+    liveSpectrogramRows = streamFormat.rows;
+    let canvas = byId("liveSpectrogramCanvasId");
+    canvas.height = liveSpectrogramRows;
+    let minKhz = (streamFormat.min_freq_hz / 1000).toFixed(0);
+    let maxKhz = (streamFormat.max_freq_hz / 1000).toFixed(0);
+    byId("liveSpectrogramInfoId").textContent = `${minKhz} - ${maxKhz} kHz`;
+};
+
+function liveSpectrogramCreatePalette() {
+    // RGBA for each uint8 value, from black over blue and red to yellow.
+    let palette = new Uint8ClampedArray(256 * 4);
+    for (let i = 0; i < 256; i++) {
+        let value = i / 255;
+        palette[i * 4] = Math.min(255, value * 2 * 255);
+        palette[i * 4 + 1] = Math.max(0, (value - 0.5) * 2 * 255);
+        palette[i * 4 + 2] = Math.max(0, Math.sin(value * Math.PI) * 255);
+        palette[i * 4 + 3] = 255;
+    };
+    return palette;
+};
+
+function liveSpectrogramDrawColumns(columns) {
+    let canvas = byId("liveSpectrogramCanvasId");
+    let context = canvas.getContext("2d");
+    let rows = liveSpectrogramRows;
+    let numberOfColumns = Math.floor(columns.length / rows);
+    if (numberOfColumns === 0) {
+        return;
+    };
+    // Scroll left, then draw the new columns at the right edge.
+    context.drawImage(canvas, -numberOfColumns, 0);
+    let image = context.createImageData(numberOfColumns, rows);
+    for (let column = 0; column < numberOfColumns; column++) {
+        for (let row = 0; row < rows; row++) {
+            let value = columns[column * rows + row];
+            // High frequencies at the top.
+            let pixel = ((rows - 1 - row) * numberOfColumns + column) * 4;
+            image.data[pixel] = liveSpectrogramPalette[value * 4];
+            image.data[pixel + 1] = liveSpectrogramPalette[value * 4 + 1];
+            image.data[pixel + 2] = liveSpectrogramPalette[value * 4 + 2];
+            image.data[pixel + 3] = 255;
+        };
+    };
+    context.putImageData(image, canvas.width - numberOfColumns, 0);
+};
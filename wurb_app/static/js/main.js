@@ -58,6 +58,7 @@ function fetchModuleRecord() {
         .then(function (html) {
             byId("heroBodyRecordId").innerHTML = html;
             byId("moduleRecordId").classList.remove("is-inverted");
+            startStatusWebsocket();
         })
         .catch(function (err) {
             console.warn("Something went wrong.", err);
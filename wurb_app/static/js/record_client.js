@@ -235,6 +235,17 @@ async function raspberryPiControl(command) {
 };
 
 let waitTextNr = 0
+let statusWebsocketStarted = false
+
+// Status pushed from the detector. Started when the record page is loaded.
+function startStatusWebsocket() {
+    if (statusWebsocketStarted) {
+        return;
+    };
+    statusWebsocketStarted = true;
+    let protocol = (window.location.protocol === "https:") ? "wss:" : "ws:";
+    startWebsocket(`${protocol}//${window.location.host}/record/ws`);
+};
 
 function startWebsocket(wsUrl) {
     // let ws = new WebSocket("ws://localhost:8000/ws");
@@ -0,0 +1,3 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Cloudedbats WURB-2023.
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+CPU time and allocated memory per captured second, for 1 to 4 consumers.
+The old fan-out, concatenate and one copy per queue, is kept for comparison.
+A replay stream is used instead of a sound card.
+Usage: python3 -m wurb_benchmarks.bench_capture_fanout
+"""
+
+import asyncio
+import time
+import tracemalloc
+import numpy as np
+
+# CloudedBats.
+import wurb_utils
+
+
+class ReplayStream(object):
+    """Returns the same period until the number of reads is reached."""
+
+    def __init__(self, capture, frames, channels, number_of_reads):
+        """ """
+        self.capture = capture
+        self.data = np.zeros(frames * channels, dtype=np.int16).tobytes()
+        self.number_of_reads = number_of_reads
+
+    def read(self, frames, exception_on_overflow=False):
+        """ """
+        self.number_of_reads -= 1
+        if self.number_of_reads <= 0:
+            self.capture.capture_active = False
+        return self.data
+
+    def close(self):
+        """ """
+
+
+class ReplayAudio(object):
+    """Replaces pyaudio.PyAudio for the capture."""
+
+    def __init__(self, number_of_reads):
+        """ """
+        self.capture = None
+        self.number_of_reads = number_of_reads
+
+    def get_format_from_width(self, width):
+        """ """
+        return width
+
+    def open(self, channels, frames_per_buffer, **kwargs):
+        """ """
+        return ReplayStream(
+            self.capture, frames_per_buffer, channels, self.number_of_reads
+        )
+
+
+def fanout_copy_per_queue(in_buffer_int16, in_data_int16, buffer_size, queues):
+    """The fan-out used before the shared ring. For comparison."""
+    in_buffer_int16 = np.concatenate((in_buffer_int16, in_data_int16))
+    while len(in_buffer_int16) >= buffer_size:
+        data_int16 = in_buffer_int16[0:buffer_size]
+        in_buffer_int16 = in_buffer_int16[buffer_size:]
+        for data_queue in queues:
+            data_dict = {"status": "data", "data": data_int16.copy()}
+            data_queue.append(data_dict)
+    return in_buffer_int16
+
+
+def run_copy_per_queue(sampling_freq_hz, frames, seconds, consumers):
+    """Returns CPU ms and allocated kB per captured second."""
+    buffer_size = int(sampling_freq_hz / 2)
+    period = np.frombuffer(np.zeros(frames, dtype=np.int16).tobytes(), np.int16)
+    number_of_reads = int(sampling_freq_hz * seconds / frames)
+    queues = [[] for _ in range(consumers)]
+    in_buffer_int16 = np.array([], dtype=np.int16)
+    tracemalloc.start()
+    start_time = time.process_time()
+    for _ in range(number_of_reads):
+        in_buffer_int16 = fanout_copy_per_queue(
+            in_buffer_int16, period, buffer_size, queues
+        )
+        for data_queue in queues:
+            data_queue.clear()  # Consumers done.
+    cpu_s = time.process_time() - start_time
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_s * 1000.0 / seconds, peak / 1024.0
+
+
+async def run_shared_ring(sampling_freq_hz, frames, seconds, consumers):
+    """Returns CPU ms and allocated kB per captured second."""
+    number_of_reads = int(sampling_freq_hz * seconds / frames)
+    audio = ReplayAudio(number_of_reads)
+    capture = wurb_utils.SoundCapture(audio)
+    audio.capture = capture
+    capture.setup(
+        device_index=None,
+        channels="MONO",
+        sampling_freq_hz=sampling_freq_hz,
+        frames=frames,
+        buffer_size=int(sampling_freq_hz / 2),
+    )
+    queues = [asyncio.Queue(maxsize=100) for _ in range(consumers)]
+    for data_queue in queues:
+        capture.add_out_queue(data_queue)
+
+    async def consumer(data_queue):
+        while True:
+            data_dict = await data_queue.get()
+            wurb_utils.release_buffer(data_dict)
+
+    tasks = [asyncio.create_task(consumer(data_queue)) for data_queue in queues]
+    capture.main_loop = asyncio.get_running_loop()
+    tracemalloc.start()
+    start_time = time.process_time()
+    await capture.main_loop.run_in_executor(None, capture.run_capture)
+    await asyncio.sleep(0.1)
+    cpu_s = time.process_time() - start_time
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    return cpu_s * 1000.0 / seconds, peak / 1024.0
+
+
+if __name__ == "__main__":
+    """ """
+    sampling_freq_hz = 384000
+    frames = 9600
+    seconds = 20
+    print("Per captured second at", sampling_freq_hz, "Hz.")
+    print("Consumers  Copy ms  Copy kB  Ring ms  Ring kB")
+    for consumers in [1, 2, 3, 4]:
+        copy_ms, copy_kb = run_copy_per_queue(
+            sampling_freq_hz, frames, seconds, consumers
+        )
+        ring_ms, ring_kb = asyncio.run(
+            run_shared_ring(sampling_freq_hz, frames, seconds, consumers)
+        )
+        print(
+            "{:>9}  {:>7.2f}  {:>7.0f}  {:>7.2f}  {:>7.0f}".format(
+                consumers, copy_ms, copy_kb, ring_ms, ring_kb
+            )
+        )
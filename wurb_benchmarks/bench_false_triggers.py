@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+Replay WAV files through the detection algorithms and count triggers.
+Use a folder with recordings known to contain no bat calls, for example
+insect noise or rain. All triggers are then false triggers.
+Usage: python3 -m wurb_benchmarks.bench_false_triggers <wav-dir> [dBFS] [SNR dB]
+"""
+
+import sys
+import pathlib
+
+# CloudedBats.
+import wurb_core
+import wurb_utils
+
+
+def create_detectors(sampling_freq_hz, threshold_dbfs, snr_db):
+    """ """
+    detector_simple = wurb_core.SoundDetectionSimple()
+    detector_simple.setup(sampling_freq_hz, 17.0, threshold_dbfs)
+    detector_noise_floor = wurb_core.SoundDetectionNoiseFloor()
+    detector_noise_floor.setup(sampling_freq_hz, 17.0, threshold_dbfs, snr_db)
+    detector_band_energy = wurb_core.SoundDetectionBandEnergy()
+    detector_band_energy.setup(sampling_freq_hz, 17.0, threshold_dbfs)
+    return {
+        "detection-simple": detector_simple,
+        "detection-noise-floor": detector_noise_floor,
+        "detection-band-energy": detector_band_energy,
+    }
+
+
+def run_replay(wav_dir, threshold_dbfs=-50.0, snr_db=12.0):
+    """Each file is replayed as 0.5 sec buffers, as from the microphone."""
+    result = {}
+    sound_replay = wurb_utils.SoundReplay()
+    for file_path in sorted(pathlib.Path(wav_dir).glob("*.wav")):
+        sampling_freq_hz, data_int16 = sound_replay.read_wave_file(file_path)
+        buffer_size = int(sampling_freq_hz / 2)
+        detectors = create_detectors(sampling_freq_hz, threshold_dbfs, snr_db)
+        for name, detector in detectors.items():
+            counters = result.setdefault(
+                name, {"files": 0, "files_triggered": 0, "buffers": 0, "triggers": 0}
+            )
+            file_triggered = False
+            for index, start in enumerate(range(0, len(data_int16), buffer_size)):
+                buffer_int16 = data_int16[start : start + buffer_size]
+                buffer_time = index * 0.5
+                sound_detected, _freq_hz, _dbfs = detector.detect_sound(
+                    buffer_int16, buffer_time
+                )
+                counters["buffers"] += 1
+                if sound_detected:
+                    counters["triggers"] += 1
+                    file_triggered = True
+            counters["files"] += 1
+            if file_triggered:
+                counters["files_triggered"] += 1
+    for counters in result.values():
+        buffers = max(1, counters["buffers"])
+        counters["false_trigger_rate"] = round(counters["triggers"] / buffers, 4)
+    return result
+
+
+if __name__ == "__main__":
+    """ """
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    wav_dir = sys.argv[1]
+    threshold_dbfs = float(sys.argv[2]) if len(sys.argv) > 2 else -50.0
+    snr_db = float(sys.argv[3]) if len(sys.argv) > 3 else 12.0
+    print("False triggers per 0.5 sec buffer. Dir: " + wav_dir)
+    print("Algorithm               Files  Triggered  Buffers  Triggers  Rate")
+    for name, row in run_replay(wav_dir, threshold_dbfs, snr_db).items():
+        print(
+            "{name:<22}  {files:>5}  {files_triggered:>9}  {buffers:>7}  "
+            "{triggers:>8}  {false_trigger_rate:>6}".format(name=name, **row)
+        )
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+File size and encoding time for WAV and FLAC, with a bit-exact check
+of the FLAC round trip. Files from a directory can be used, else a
+synthetic recording with calls in noise.
+Usage: python3 -m wurb_benchmarks.bench_file_formats [wav-dir]
+"""
+
+import io
+import sys
+import time
+import wave
+import pathlib
+import numpy as np
+import soundfile
+
+# CloudedBats.
+import wurb_utils
+from wurb_benchmarks import bench_sound_detection
+
+
+def encode_wav(data_int16, sampling_freq_hz):
+    """ """
+    buffer = io.BytesIO()
+    wave_file = wave.open(buffer, "wb")
+    wave_file.setnchannels(1)
+    wave_file.setsampwidth(2)
+    wave_file.setframerate(sampling_freq_hz)
+    wave_file.writeframes(data_int16)
+    wave_file.close()
+    return buffer.getvalue()
+
+
+def encode_flac(data_int16, sampling_freq_hz):
+    """Same settings as used by WaveFileWriter."""
+    buffer = io.BytesIO()
+    with soundfile.SoundFile(
+        buffer,
+        mode="w",
+        samplerate=sampling_freq_hz,
+        channels=1,
+        subtype="PCM_16",
+        format="FLAC",
+    ) as sound_file:
+        sound_file.write(data_int16)
+    return buffer.getvalue()
+
+
+def check_round_trip(flac_bytes, data_int16):
+    """ """
+    decoded, _sampling_freq_hz = soundfile.read(io.BytesIO(flac_bytes), dtype="int16")
+    return np.array_equal(decoded, data_int16)
+
+
+def run_benchmark(recordings):
+    """Recordings is a list of (name, sampling_freq_hz, data_int16)."""
+    results = []
+    for name, sampling_freq_hz, data_int16 in recordings:
+        start_time = time.process_time()
+        wav_bytes = encode_wav(data_int16, sampling_freq_hz)
+        wav_ms = (time.process_time() - start_time) * 1000.0
+        start_time = time.process_time()
+        flac_bytes = encode_flac(data_int16, sampling_freq_hz)
+        flac_ms = (time.process_time() - start_time) * 1000.0
+        if not check_round_trip(flac_bytes, data_int16):
+            raise ValueError("FLAC round trip not bit-exact: " + name)
+        results.append(
+            {
+                "name": name,
+                "length_s": round(len(data_int16) / sampling_freq_hz, 1),
+                "wav_kb": len(wav_bytes) // 1024,
+                "flac_kb": len(flac_bytes) // 1024,
+                "ratio": round(len(wav_bytes) / len(flac_bytes), 2),
+                "wav_ms": round(wav_ms, 1),
+                "flac_ms": round(flac_ms, 1),
+            }
+        )
+    return results
+
+
+def synthetic_recordings(sampling_freq_list=[192000, 384000, 500000]):
+    """6 sec, as the default rec length."""
+    recordings = []
+    for sampling_freq_hz in sampling_freq_list:
+        buffers = [
+            bench_sound_detection.create_test_buffer(sampling_freq_hz, seed=index)
+            for index in range(12)
+        ]
+        recordings.append(("synthetic", sampling_freq_hz, np.concatenate(buffers)))
+    return recordings
+
+
+if __name__ == "__main__":
+    """ """
+    if len(sys.argv) > 1:
+        recordings = []
+        sound_replay = wurb_utils.SoundReplay()
+        for file_path in sorted(pathlib.Path(sys.argv[1]).glob("*.wav")):
+            sampling_freq_hz, data_int16 = sound_replay.read_wave_file(file_path)
+            if "_TE" in file_path.name:
+                # Stored at 1/10 rate.
+                sampling_freq_hz = int(sampling_freq_hz / 10)
+            data_int16 = np.ascontiguousarray(data_int16)
+            recordings.append((file_path.name, sampling_freq_hz, data_int16))
+    else:
+        recordings = synthetic_recordings()
+    print("Name  Length s  WAV kB  FLAC kB  Ratio  WAV ms  FLAC ms")
+    for row in run_benchmark(recordings):
+        print(
+            "{name}  {length_s}  {wav_kb}  {flac_kb}  {ratio}  "
+            "{wav_ms}  {flac_ms}".format(**row)
+        )
+    print("FLAC round trip is bit-exact for all recordings.")
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+Throughput for each stage in the record chain, with synthetic sound
+from SoundReplay. For each stage and sampling frequency the result is
+samples per second and real-time factor, where 1.0 means just in time.
+The headroom is the part of one CPU core left when all stages run.
+Usage: python3 -m wurb_benchmarks.bench_pipeline [--output result.json]
+"""
+
+import json
+import argparse
+import time
+import asyncio
+import pathlib
+import tempfile
+import numpy as np
+
+# CloudedBats.
+import wurb_core
+import wurb_utils
+from wurb_core.record import sound_detection
+from wurb_benchmarks import check_continuous_segments
+
+
+def create_buffers(sampling_freq_hz, seconds):
+    """0.5 sec buffers, with calls during the first 2 sec of each 10 sec."""
+    buffer_size = int(sampling_freq_hz / 2)
+    rng = np.random.default_rng(0)
+    return [
+        wurb_utils.sound_replay.create_synthetic_buffer(
+            sampling_freq_hz, buffer_size, index, rng
+        )
+        for index in range(int(seconds * 2))
+    ]
+
+
+async def bench_capture_chunking(sampling_freq_hz, buffers):
+    """Periods from the sound card copied into the shared buffer ring."""
+    capture = wurb_utils.SoundCapture(audio=None)
+    capture.setup(
+        device_index=None,
+        channels="MONO",
+        sampling_freq_hz=sampling_freq_hz,
+        frames=9600,
+        buffer_size=len(buffers[0]),
+    )
+    capture.main_loop = asyncio.get_running_loop()
+    capture.capture_active = True
+    samples = np.concatenate(buffers)
+    periods = samples[: len(samples) // 9600 * 9600].reshape(-1, 9600)
+    start_time = time.perf_counter()
+    for period in periods:
+        capture.write_to_ring(period)
+        # Let the event loop run buffer_to_queues().
+        await asyncio.sleep(0)
+    return time.perf_counter() - start_time
+
+
+def bench_detection(sampling_freq_hz, buffers):
+    """SoundDetectionSimple.check_for_sound, one call per buffer."""
+    detector = sound_detection.SoundDetectionSimple()
+    detector.setup(sampling_freq_hz, filter_min_khz=17.0, threshold_dbfs=-50.0)
+    start_time = time.perf_counter()
+    for index, buffer in enumerate(buffers):
+        detector.check_for_sound((index * 0.5, buffer))
+    return time.perf_counter() - start_time
+
+
+async def bench_process_worker(sampling_freq_hz, buffers):
+    """sound_process_worker without detection and files, mainly the ring
+    buffer logic. Manual mode, never triggered."""
+    wurb_core.wurb_settings.settings["recMode"] = "mode-manual"
+    wurb_core.manual_trigger_activated = False
+    recorder = wurb_core.WurbRecorder(logger=wurb_core.used_logger)
+    recorder.sampling_freq_hz = sampling_freq_hz
+    recorder.from_source_queue = asyncio.Queue(maxsize=len(buffers) + 1)
+    recorder.to_target_queue = asyncio.Queue()
+    adc_time = time.time()
+    for buffer in buffers:
+        item = {"adc_time": adc_time, "detector_time": adc_time, "data": buffer}
+        recorder.from_source_queue.put_nowait(item)
+        adc_time += 0.5
+    recorder.from_source_queue.put_nowait(None)  # Terminate.
+    start_time = time.perf_counter()
+    await recorder.sound_process_worker()
+    return time.perf_counter() - start_time
+
+
+def bench_file_writer(sampling_freq_hz, buffers, rec_format):
+    """WaveFileWriter create, write and close, 6 sec files."""
+    wurb_core.wurb_settings.settings["recFormat"] = rec_format
+    start_time = time.perf_counter()
+    for index in range(0, len(buffers), 12):
+        writer = wurb_core.WaveFileWriter()
+        writer.create(time.time() + index, None, None, sampling_freq_hz)
+        for buffer in buffers[index : index + 12]:
+            writer.write(buffer)
+        writer.close()
+    return time.perf_counter() - start_time
+
+
+def bench_pitchshifting(sampling_freq_hz, buffers, channels, mode="pitch-shifting"):
+    """Audio feedback, mono or stereo buffers of the same length."""
+    pitchshifting = wurb_utils.create_sound_feedback(mode)
+    pitchshifting.setup(
+        channels=channels,
+        sampling_freq_in=sampling_freq_hz,
+        sampling_freq_out=48000,
+        pitch_factor=30,
+        volume_percent=50,
+        filter_low_khz=15.0,
+        filter_high_khz=90.0,
+        overlap_factor=1.5,
+        in_queue_length=10,
+    )
+    pitchshifting.create_buffers()
+    if channels == "STEREO":
+        # Interleaved, same signal in both channels.
+        buffers = [np.repeat(buffer, 2) for buffer in buffers]
+    start_time = time.perf_counter()
+    for buffer in buffers:
+        if channels == "STEREO":
+            pitchshifting.calc_pithshifting_stereo(buffer)
+        else:
+            pitchshifting.calc_pithshifting_mono(buffer)
+    return time.perf_counter() - start_time
+
+
+async def run_benchmark(
+    sampling_freq_list=[192000, 250000, 384000, 500000], seconds=20
+):
+    """ """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wurb_core.wurb_settings = check_continuous_segments.ReplaySettings(
+            tmp_dir, rec_length_s=6, segment_mb=0
+        )
+        wurb_core.wurb_rpi = check_continuous_segments.ReplayTargetDir(
+            pathlib.Path(tmp_dir, "recordings")
+        )
+        await wurb_core.wurb_logger.startup()
+        for sampling_freq_hz in sampling_freq_list:
+            buffers = create_buffers(sampling_freq_hz, seconds)
+            samples = sum([len(buffer) for buffer in buffers])
+            stage_times = {
+                "capture_chunking": await bench_capture_chunking(
+                    sampling_freq_hz, buffers
+                ),
+                "detection_simple": bench_detection(sampling_freq_hz, buffers),
+                "process_worker": await bench_process_worker(sampling_freq_hz, buffers),
+                "file_writer_wav": bench_file_writer(sampling_freq_hz, buffers, "WAV"),
+                "file_writer_flac": bench_file_writer(
+                    sampling_freq_hz, buffers, "FLAC"
+                ),
+                "pitchshifting_mono": bench_pitchshifting(
+                    sampling_freq_hz, buffers, "MONO"
+                ),
+                "pitchshifting_stereo": bench_pitchshifting(
+                    sampling_freq_hz, buffers, "STEREO"
+                ),
+                "heterodyne_mono": bench_pitchshifting(
+                    sampling_freq_hz, buffers, "MONO", mode="heterodyne"
+                ),
+                "frequency_division_mono": bench_pitchshifting(
+                    sampling_freq_hz, buffers, "MONO", mode="frequency-division"
+                ),
+            }
+            stages = {}
+            load = 0.0
+            for stage, seconds_used in stage_times.items():
+                stages[stage] = {
+                    "samples_per_s": round(samples / seconds_used),
+                    "realtime_factor": round(seconds / seconds_used, 2),
+                }
+                # Alternatives to WAV and mono pitch shifting are not added.
+                if stage not in [
+                    "file_writer_flac",
+                    "pitchshifting_stereo",
+                    "heterodyne_mono",
+                    "frequency_division_mono",
+                ]:
+                    load += seconds_used / seconds
+            results.append(
+                {
+                    "sampling_freq_hz": sampling_freq_hz,
+                    "seconds": seconds,
+                    "stages": stages,
+                    "cpu_load": round(load, 3),
+                    "headroom": round(1.0 - load, 3),
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    """ """
+    parser = argparse.ArgumentParser(description="Record chain throughput.")
+    parser.add_argument("--output", help="Save the results to this JSON file.")
+    args = parser.parse_args()
+    wurb_core.config.config = {}
+    wurb_core.config.config_default = {}
+    results = asyncio.run(run_benchmark())
+    for result in results:
+        print("Sampling freq. Hz:", result["sampling_freq_hz"])
+        print("  Stage                     Samples/s  Real-time factor")
+        for stage, values in result["stages"].items():
+            print(
+                "  {:<24}  {:>10}  {:>16}".format(
+                    stage, values["samples_per_s"], values["realtime_factor"]
+                )
+            )
+        print(
+            "  CPU load, WAV and mono feedback:",
+            result["cpu_load"],
+            " Headroom:",
+            result["headroom"],
+        )
+    if args.output:
+        result_dict = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "wurb_version": wurb_core.__version__,
+            "results": results,
+        }
+        pathlib.Path(args.output).write_text(json.dumps(result_dict, indent=2))
+        print("Saved to:", args.output)
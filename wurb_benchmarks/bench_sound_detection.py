@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+Per-buffer CPU time for sound detection, before and after batched STFT.
+The band energy detector is included for comparison.
+Usage: python3 -m wurb_benchmarks.bench_sound_detection
+"""
+
+import time
+import numpy as np
+import scipy.signal
+
+# CloudedBats.
+import wurb_core
+
+
+def create_test_buffer(sampling_freq_hz, seed=0, with_calls=True, noise_level=0.002):
+    """0.5 sec buffer with noise and a few FM sweeps from 60 to 40 kHz."""
+    rng = np.random.default_rng(seed)
+    buffer_size = int(sampling_freq_hz / 2)
+    signal = rng.normal(0.0, noise_level, buffer_size)
+    call_length = int(sampling_freq_hz * 0.020)
+    call_time = np.arange(call_length) / sampling_freq_hz
+    call = scipy.signal.chirp(call_time, f0=60000, t1=call_time[-1], f1=40000)
+    call *= scipy.signal.windows.hann(call_length) * 0.1
+    if with_calls:
+        for start in range(
+            int(buffer_size * 0.1), buffer_size - call_length, buffer_size // 5
+        ):
+            signal[start : start + call_length] += call
+    return np.array(signal * 32767, dtype=np.int16)
+
+
+def check_for_sound_loop(detector, data_int16):
+    """The per-window loop used before the batched version. For comparison."""
+    work_buffer = data_int16
+    sound_detected = False
+    sound_detected_counter = 0
+    peak_frequency_hz = None
+    peak_dbfs_at_max = None
+    while len(work_buffer) >= detector.window_size:
+        data_frame = work_buffer[: detector.window_size]
+        work_buffer = work_buffer[detector.jump_size :]
+        signal = data_frame / 32768.0 * detector.window_function
+        spectrum = np.fft.rfft(signal)
+        spectrum[detector.freq_bins_hz < detector.filter_min_hz] = 0.000000001
+        dbfs_spectrum = 20 * np.log10(
+            np.abs(spectrum) / detector.window_function_dbfs_max
+        )
+        bin_peak_index = dbfs_spectrum.argmax()
+        peak_db = dbfs_spectrum[bin_peak_index]
+        if peak_db > detector.threshold_dbfs:
+            sound_detected_counter += 1
+            if sound_detected_counter >= detector.sound_detected_counter_min:
+                sound_detected = True
+                if (peak_dbfs_at_max is None) or (peak_db > peak_dbfs_at_max):
+                    peak_dbfs_at_max = peak_db
+                    peak_frequency_hz = (
+                        bin_peak_index * detector.sampling_freq / detector.window_size
+                    )
+    return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+
+
+def cpu_time_per_buffer(function, data_int16, repeat):
+    """Median process time in ms. The median is less sensitive to other load."""
+    function(data_int16)  # Warm up.
+    times = []
+    for _ in range(repeat):
+        start_time = time.process_time()
+        function(data_int16)
+        times.append(time.process_time() - start_time)
+    return float(np.median(times)) * 1000.0
+
+
+def run_benchmark(sampling_freq_list=[192000, 384000, 500000], repeat=20):
+    """ """
+    results = []
+    for sampling_freq_hz in sampling_freq_list:
+        detector = wurb_core.SoundDetectionSimple()
+        detector.setup(sampling_freq_hz, filter_min_khz=17.0, threshold_dbfs=-50.0)
+        data_int16 = create_test_buffer(sampling_freq_hz)
+        # Both versions must agree before timing is of any interest.
+        result_loop = check_for_sound_loop(detector, data_int16)
+        result_batch = detector.detect_sound(data_int16)
+        if result_loop[0] != result_batch[0]:
+            raise ValueError("Detection results differ at " + str(sampling_freq_hz))
+        loop_ms = cpu_time_per_buffer(
+            lambda data: check_for_sound_loop(detector, data), data_int16, repeat
+        )
+        batch_ms = cpu_time_per_buffer(detector.detect_sound, data_int16, repeat)
+        # No FFT, for comparison.
+        band_detector = wurb_core.SoundDetectionBandEnergy()
+        band_detector.setup(sampling_freq_hz, filter_min_khz=17.0, threshold_dbfs=-50.0)
+        # Calls in a quiet background, the gate is open around the calls.
+        calls_int16 = create_test_buffer(sampling_freq_hz, noise_level=0.0002)
+        band_ms = cpu_time_per_buffer(band_detector.detect_sound, calls_int16, repeat)
+        quiet_int16 = create_test_buffer(
+            sampling_freq_hz, with_calls=False, noise_level=0.0002
+        )
+        band_quiet_ms = cpu_time_per_buffer(
+            band_detector.detect_sound, quiet_int16, repeat
+        )
+        # Same buffer as for the FFT. The noise opens the gate in all blocks.
+        band_dense_ms = cpu_time_per_buffer(
+            band_detector.detect_sound, data_int16, repeat
+        )
+        results.append(
+            {
+                "sampling_freq_hz": sampling_freq_hz,
+                "windows_per_buffer": len(detector.get_frames(data_int16)),
+                "loop_ms": round(loop_ms, 3),
+                "batch_ms": round(batch_ms, 3),
+                "speedup": round(loop_ms / batch_ms, 2),
+                "band_energy_ms": round(band_ms, 3),
+                "band_energy_quiet_ms": round(band_quiet_ms, 3),
+                "band_energy_dense_ms": round(band_dense_ms, 3),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    """ """
+    print("CPU time per 0.5 sec buffer, SoundDetectionSimple.")
+    print("Band energy: Calls in a quiet background.")
+    print("Band energy, quiet: Only the first stage used.")
+    print("Band energy, dense: Same buffer as for the FFT, the gate always open.")
+    print(
+        "Freq. Hz  Windows  Loop ms  Batch ms  Speedup  Band ms  Band quiet ms  "
+        "Band dense ms"
+    )
+    for row in run_benchmark():
+        print(
+            "{sampling_freq_hz:>8}  {windows_per_buffer:>7}  {loop_ms:>7}  "
+            "{batch_ms:>8}  {speedup:>7}  {band_energy_ms:>7}  "
+            "{band_energy_quiet_ms:>13}  {band_energy_dense_ms:>13}".format(**row)
+        )
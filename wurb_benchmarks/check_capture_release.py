@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+Captures more buffers than there are slots in the capture buffer ring,
+through the recorder in continuous mode. Checks that the recorder releases
+the shared capture buffers, and that each sample is written once.
+Usage: python3 -m wurb_benchmarks.check_capture_release
+"""
+
+import asyncio
+import pathlib
+import tempfile
+import numpy as np
+
+# CloudedBats.
+import wurb_core
+import wurb_utils
+from wurb_benchmarks import check_continuous_segments
+
+
+async def capture_to_recorder(sampling_freq_hz, buffers, ring_slots, frames=9600):
+    """Periods are written to the capture ring as from a sound card."""
+    capture = wurb_utils.SoundCapture(audio=None)
+    capture.setup(
+        device_index=None,
+        channels="MONO",
+        sampling_freq_hz=sampling_freq_hz,
+        frames=frames,
+        buffer_size=len(buffers[0]),
+        ring_slots=ring_slots,
+    )
+    capture.main_loop = asyncio.get_running_loop()
+    capture.capture_active = True
+    recorder = wurb_core.WurbRecorder(logger=wurb_core.used_logger)
+    recorder.sampling_freq_hz = sampling_freq_hz
+    recorder.from_source_queue = asyncio.Queue(maxsize=100)
+    recorder.to_target_queue = asyncio.Queue(maxsize=1000)
+    capture.add_out_queue(recorder.from_source_queue)
+    process_task = asyncio.create_task(recorder.sound_process_worker())
+    target_task = asyncio.create_task(recorder.sound_target_worker())
+    samples = np.concatenate(buffers)
+    # Faster than real time. The stream starts in the past to keep the
+    # difference from the clock within the recorder limit.
+    capture.stream_start_s -= len(samples) / sampling_freq_hz / 2
+    for start in range(0, len(samples), frames):
+        capture.write_to_ring(samples[start : start + frames])
+        # Let the event loop run buffer_to_queues() and the recorder.
+        await asyncio.sleep(0)
+        while (
+            recorder.writer_pool.get_pending_buffers()
+            + recorder.to_target_queue.qsize()
+            + recorder.from_source_queue.qsize()
+        ) > 4:
+            await asyncio.sleep(0.01)
+    await recorder.from_source_queue.join()
+    free_slots = capture.buffer_ring.get_free_slots()
+    await recorder.from_source_queue.put(None)  # Terminate.
+    await process_task
+    await target_task
+    return free_slots
+
+
+async def run_check(sampling_freq_hz=192000, ring_slots=8):
+    """ """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target_dir_path = pathlib.Path(tmp_dir, "recordings")
+        wurb_core.wurb_settings = check_continuous_segments.ReplaySettings(
+            tmp_dir, rec_length_s=3, segment_mb=0
+        )
+        wurb_core.wurb_rpi = check_continuous_segments.ReplayTargetDir(target_dir_path)
+        await wurb_core.wurb_logger.startup()
+        wurb_utils.pipeline_metrics.clear()
+        buffers = check_continuous_segments.create_capture(
+            sampling_freq_hz, number_of_buffers=3 * ring_slots
+        )
+        free_slots = await capture_to_recorder(sampling_freq_hz, buffers, ring_slots)
+        is_continuous, _segment_lengths = check_continuous_segments.check_segments(
+            target_dir_path, buffers
+        )
+    counters = wurb_utils.pipeline_metrics.get_metrics()["stages"]["capture"]
+    dropped = counters["counters"].get("dropped_no_buffer", 0)
+    return is_continuous, dropped, free_slots == ring_slots
+
+
+if __name__ == "__main__":
+    """ """
+    wurb_core.config.config = {}
+    wurb_core.config.config_default = {}
+    is_continuous, dropped, is_released = asyncio.run(run_check())
+    print(
+        "Continuous:",
+        is_continuous,
+        " Dropped capture buffers:",
+        dropped,
+        " All slots released:",
+        is_released,
+    )
+    if not (is_continuous and (dropped == 0) and is_released):
+        raise SystemExit("Capture release check failed.")
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+Replays a synthetic capture through the recorder in continuous mode and
+checks that the segment files, read in order, contain each sample once.
+Usage: python3 -m wurb_benchmarks.check_continuous_segments
+"""
+
+import asyncio
+import pathlib
+import tempfile
+import time
+import wave
+import numpy as np
+
+# CloudedBats.
+import wurb_core
+
+
+class ReplaySettings(object):
+    """Settings used by the recorder during the check."""
+
+    def __init__(self, settings_dir_path, rec_length_s, segment_mb):
+        """ """
+        self.settings_dir_path = settings_dir_path
+        self.settings_file_name = "wurb_settings.txt"
+        pathlib.Path(settings_dir_path, self.settings_file_name).write_text("")
+        self.settings = {
+            "recMode": "mode-on",
+            "detectionAlgorithm": "detection-none",
+            "recLengthS": str(rec_length_s),
+            "recSegmentMb": str(segment_mb),
+            "recType": "FS",
+            "recFormat": "WAV",
+            "filenamePrefix": "check",
+        }
+
+    def get_setting(self, key):
+        """ """
+        return self.settings.get(key, "")
+
+    def get_valid_location(self):
+        """ """
+        return 0.0, 0.0
+
+
+class ReplayTargetDir(object):
+    """ """
+
+    def __init__(self, target_dir_path):
+        """ """
+        self.target_dir_path = target_dir_path
+
+    def get_wavefile_target_dir_path(self):
+        """ """
+        return self.target_dir_path
+
+
+def create_capture(sampling_freq_hz, number_of_buffers):
+    """A counter as signal, each sample is unique within 65536 samples."""
+    buffer_size = int(sampling_freq_hz / 2)
+    counter = np.arange(buffer_size * number_of_buffers, dtype=np.int64)
+    data = np.array(counter % 65536 - 32768, dtype=np.int16)
+    return [
+        data[index * buffer_size : (index + 1) * buffer_size]
+        for index in range(number_of_buffers)
+    ]
+
+
+async def replay(sampling_freq_hz, buffers, target_dir_path):
+    """Buffers are sent as from a capture source, as fast as the writer
+    accepts them."""
+    recorder = wurb_core.WurbRecorder(logger=wurb_core.used_logger)
+    recorder.sampling_freq_hz = sampling_freq_hz
+    recorder.from_source_queue = asyncio.Queue(maxsize=100)
+    recorder.to_target_queue = asyncio.Queue(maxsize=1000)
+    process_task = asyncio.create_task(recorder.sound_process_worker())
+    target_task = asyncio.create_task(recorder.sound_target_worker())
+    adc_time = time.time()
+    for data in buffers:
+        while (
+            recorder.writer_pool.get_pending_buffers()
+            + recorder.to_target_queue.qsize()
+            + recorder.from_source_queue.qsize()
+        ) > 4:
+            await asyncio.sleep(0.01)
+        item = {"adc_time": adc_time, "detector_time": adc_time, "data": data}
+        await recorder.from_source_queue.put(item)
+        adc_time += len(data) / sampling_freq_hz
+    await recorder.from_source_queue.put(None)  # Terminate.
+    await process_task
+    await target_task
+    return recorder.dropped_buffers_counter
+
+
+def check_segments(target_dir_path, buffers):
+    """Filenames contain the start time, sorted they are in order."""
+    file_list = sorted(pathlib.Path(target_dir_path).glob("*.wav"))
+    segments = []
+    for file_path in file_list:
+        with wave.open(str(file_path), "rb") as wave_file:
+            data = wave_file.readframes(wave_file.getnframes())
+        segments.append(np.frombuffer(data, dtype=np.int16))
+    expected = np.concatenate(buffers)
+    result = np.concatenate(segments)
+    is_continuous = (len(result) == len(expected)) and np.array_equal(result, expected)
+    return is_continuous, [len(segment) for segment in segments]
+
+
+async def run_check(sampling_freq_hz=384000, rec_length_s=3, segment_mb=0):
+    """ """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target_dir_path = pathlib.Path(tmp_dir, "recordings")
+        wurb_core.wurb_settings = ReplaySettings(tmp_dir, rec_length_s, segment_mb)
+        wurb_core.wurb_rpi = ReplayTargetDir(target_dir_path)
+        await wurb_core.wurb_logger.startup()
+        # Segment boundaries within buffers if 1.3 MB is used.
+        buffers = create_capture(sampling_freq_hz, number_of_buffers=21)
+        dropped = await replay(sampling_freq_hz, buffers, target_dir_path)
+        is_continuous, segment_lengths = check_segments(target_dir_path, buffers)
+    return is_continuous, dropped, segment_lengths
+
+
+if __name__ == "__main__":
+    """ """
+    wurb_core.config.config = {}
+    wurb_core.config.config_default = {}
+    all_ok = True
+    for segment_mb in [0, 1.3]:
+        is_continuous, dropped, segment_lengths = asyncio.run(
+            run_check(segment_mb=segment_mb)
+        )
+        all_ok = all_ok and is_continuous and (dropped == 0)
+        print(
+            "Segment MB:",
+            segment_mb,
+            " Continuous:",
+            is_continuous,
+            " Skipped buffers:",
+            dropped,
+            " Segments:",
+            segment_lengths,
+        )
+    if not all_ok:
+        raise SystemExit("Continuity check failed.")
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+"""
+Checks that pinned slots in the recorder ring buffer are not overwritten,
+and that they are released when the target queue is flushed.
+Usage: python3 -m wurb_benchmarks.check_ring_buffer_pins
+"""
+
+import asyncio
+import tempfile
+import numpy as np
+
+# CloudedBats.
+import wurb_core
+from wurb_benchmarks import check_continuous_segments
+
+
+def check_pinned_slots():
+    """Pinned slots are skipped by add_buffer() until released."""
+    ring_buffer = wurb_core.SoundRingBuffer()
+    ring_buffer.setup(buffer_size=4, number_of_buffers=6)
+    for index in range(6):
+        ring_buffer.add_buffer(index, np.full(4, index, dtype=np.int16))
+    _adc_time, slices, release = ring_buffer.take_last(3)
+    added = [
+        ring_buffer.add_buffer(index, np.full(4, index, dtype=np.int16))
+        for index in range(6, 10)
+    ]
+    is_ok = added == [6, 7, 8, None]
+    is_ok = is_ok and np.array_equal(slices[0], np.repeat([3, 4, 5], 4))
+    release()
+    release()  # Only the first call is used.
+    is_ok = is_ok and (ring_buffer.pins.sum() == 0)
+    is_ok = is_ok and (ring_buffer.add_buffer(9, np.zeros(4, np.int16)) == 9)
+    return is_ok
+
+
+def check_clear():
+    """Pins are cleared, and old release functions are not used after."""
+    ring_buffer = wurb_core.SoundRingBuffer()
+    ring_buffer.setup(buffer_size=4, number_of_buffers=4)
+    for index in range(4):
+        ring_buffer.add_buffer(index, np.zeros(4, np.int16))
+    _adc_time, _slices, release = ring_buffer.take_last(4)
+    is_ok = ring_buffer.add_buffer(4, np.zeros(4, np.int16)) is None
+    ring_buffer.clear()
+    is_ok = is_ok and (ring_buffer.add_buffer(0, np.zeros(4, np.int16)) == 0)
+    release()
+    is_ok = is_ok and (ring_buffer.pins.min() == 0)
+    return is_ok
+
+
+async def check_flush(sampling_freq_hz=48000):
+    """Items waiting in the target queue are pinned. A flush from the source
+    must release them, and the ring must accept new buffers."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wurb_core.wurb_settings = check_continuous_segments.ReplaySettings(
+            tmp_dir, rec_length_s=2, segment_mb=0
+        )
+        await wurb_core.wurb_logger.startup()
+        recorder = wurb_core.WurbRecorder(logger=wurb_core.used_logger)
+        recorder.sampling_freq_hz = sampling_freq_hz
+        recorder.from_source_queue = asyncio.Queue(maxsize=100)
+        recorder.to_target_queue = asyncio.Queue(maxsize=1000)
+        # No target worker, items stay in the target queue.
+        process_task = asyncio.create_task(recorder.sound_process_worker())
+        data = np.zeros(int(sampling_freq_hz / 2), dtype=np.int16)
+        number_of_buffers = 0
+        while number_of_buffers < 6:
+            await recorder.from_source_queue.put(
+                {"adc_time": 0.0, "detector_time": 0.0, "data": data}
+            )
+            number_of_buffers += 1
+        await recorder.from_source_queue.join()
+        ring_buffer = recorder.ring_buffer
+        is_pinned = ring_buffer.pins.sum() > 0
+        await recorder.from_source_queue.put(False)  # Flush.
+        await recorder.from_source_queue.join()
+        is_released = ring_buffer.pins.sum() == 0
+        # Only the flush marker is left.
+        is_flushed = recorder.to_target_queue.qsize() == 1
+        await recorder.from_source_queue.put(None)  # Terminate.
+        await process_task
+    return is_pinned and is_released and is_flushed
+
+
+if __name__ == "__main__":
+    """ """
+    wurb_core.config.config = {}
+    wurb_core.config.config_default = {}
+    results = {
+        "Pinned slots": check_pinned_slots(),
+        "Clear": check_clear(),
+        "Flush": asyncio.run(check_flush()),
+    }
+    for name, is_ok in results.items():
+        print(name + ":", "OK" if is_ok else "FAILED")
+    if not all(results.values()):
+        raise SystemExit("Ring buffer pin check failed.")
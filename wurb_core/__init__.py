@@ -16,22 +16,33 @@ from wurb_core.annotations.record_manager import RecordManager
 from wurb_core.record.gps_reader import GpsReader
 from wurb_core.record.gps_reader import ReadGpsSerialNmea
 from wurb_api.app_logger import AppLogger
+from wurb_api.status_hub import WurbStatusHub
 from wurb_core.record.rec_manager import WurbRecManager
 from wurb_core.record.sound_recorder import UltrasoundDevices
 from wurb_core.record.sound_recorder import WurbRecorder
 from wurb_core.record.sound_recorder import WaveFileWriter
+from wurb_core.record.sound_ring_buffer import SoundRingBuffer
+from wurb_core.record.sound_file_writer import SoundFileWriterPool
 from wurb_core.record.rpi_control import WurbRaspberryPi
 from wurb_core.record.rec_scheduler import WurbScheduler
 from wurb_core.record.sound_detection import SoundDetectionBase
 from wurb_core.record.sound_detection import SoundDetection
 from wurb_core.record.sound_detection import SoundDetectionNone
 from wurb_core.record.sound_detection import SoundDetectionSimple
+from wurb_core.record.sound_detection import SoundDetectionNoiseFloor
+from wurb_core.record.sound_detection import SoundDetectionBandEnergy
+from wurb_core.record.sound_detection_process import SoundDetectionProcess
+from wurb_core.record.audio_feedback import WurbAudioFeedback
+from wurb_core.record.live_spectrogram import WurbLiveSpectrogram
 
 
 # To be used similar to singleton objects.
 logger = wurb_utils.Logger(logger=used_logger)
 config = wurb_utils.Configuration(logger=used_logger)
+metrics = wurb_utils.pipeline_metrics
+tracing = wurb_utils.pipeline_tracing
 wurb_logger = AppLogger(logger=used_logger)
+wurb_status_hub = WurbStatusHub(logger=used_logger)
 
 gps = GpsReader(logger=used_logger)
 app_manager = AppManager(logger=used_logger)
@@ -52,8 +63,12 @@ wurb_ultrasond_device = UltrasoundDevices(logger=used_logger)
 wurb_recorder = WurbRecorder(logger=used_logger)
 wurb_wave_file_writer = WaveFileWriter(logger=used_logger)
 wurb_scheduler = WurbScheduler(logger=used_logger)
+wurb_audiofeedback = WurbAudioFeedback(logger=used_logger)
+wurb_live_spectrogram = WurbLiveSpectrogram(logger=used_logger)
 ###wurb_settings = WurbSettings(logger=used_logger)
 wurb_sound_detection_base = SoundDetectionBase(logger=used_logger)
 wurb_sound_detection = SoundDetection(logger=used_logger)
 wurb_sound_detection_none = SoundDetectionNone(logger=used_logger)
 wurb_sound_detection_simple = SoundDetectionSimple(logger=used_logger)
+wurb_sound_detection_noise_floor = SoundDetectionNoiseFloor(logger=used_logger)
+wurb_sound_detection_band_energy = SoundDetectionBandEnergy(logger=used_logger)
@@ -56,8 +56,12 @@ class WurbSettings(object):
             "detectionLimitKhz": "17.0",
             "detectionSensitivityDbfs": "-50",
             "detectionAlgorithm": "detection-simple",
+            "detectionBandsKhz": "",
+            "detectionSnrDb": "12",
             "recLengthS": "6",
             "recType": "FS",
+            "recFormat": "WAV",
+            "recSegmentMb": "0",
             "feedbackOnOff": "feedback-off",
             "feedbackVolume": "50",
             "feedbackPitch": "30",
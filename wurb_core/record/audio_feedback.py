@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import asyncio
+import json
+import logging
+
+# CloudedBats.
+import wurb_core
+import wurb_utils
+
+
+class WurbAudioFeedback:
+    """
+    Audio feedback streamed to browsers. The sound source adds data
+    through is_active() and add_data(), and the pitch shifted (or
+    heterodyne/frequency divided) int16 buffers are published once to
+    the audio hub, where each WebSocket client has its own queue.
+    Feedback is only calculated when there are clients.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        self.audio_hub = wurb_utils.StreamHub(
+            "live_audio", client_queue_length=4, logger=logger
+        )
+        self.audio_hub.on_first_client = self.start_feedback
+        self.audio_hub.on_no_clients = self.stop_feedback
+        self.clear()
+
+    def clear(self):
+        """ """
+        self.sampling_freq_hz = None
+        self.sampling_freq_out_hz = 16000
+        self.feedback = None
+        self.feedback_task = None
+        self.stream_task = None
+        self.out_queue = None
+
+    async def startup(self):
+        """ """
+        config = wurb_core.config
+        self.sampling_freq_out_hz = int(
+            config.get("live_audio.sampling_freq_hz", default=16000)
+        )
+        self.audio_hub.client_queue_length = int(
+            config.get("live_audio.client_queue_length", default=4)
+        )
+
+    async def shutdown(self):
+        """ """
+        self.stop_feedback()
+
+    async def set_sampling_freq(self, sampling_freq):
+        """Called when the microphone is started."""
+        if sampling_freq != self.sampling_freq_hz:
+            self.sampling_freq_hz = sampling_freq
+            self.restart_feedback()
+
+    async def set_volume(self, volume):
+        """Changed while running, no restart needed."""
+        if self.feedback is not None:
+            self.feedback.volume = float(volume) / 100.0
+
+    async def set_pitch(self, pitch):
+        """Filters and buffers depend on the pitch, restart if changed."""
+        if self.feedback is not None:
+            if int(float(pitch)) != self.feedback.pitch_div_factor:
+                self.restart_feedback()
+
+    def is_active(self):
+        """Used by the sound source."""
+        return self.feedback is not None
+
+    def add_data(self, data_int16):
+        """Used by the sound source, called in the event loop thread."""
+        if self.feedback is None:
+            return
+        data_queue = self.feedback.get_queue()
+        if not data_queue.full():
+            data_queue.put_nowait({"status": "data", "data": data_int16})
+        else:
+            wurb_utils.pipeline_metrics.count("live_audio", "dropped_in")
+
+    def get_stream_format(self):
+        """Sent as JSON before the binary audio messages."""
+        return {
+            "format": "int16",
+            "channels": 1,
+            "sampling_freq_hz": self.sampling_freq_out_hz,
+        }
+
+    def get_feedback_setting(self, key, config_key, default):
+        """From the user settings, or from the config if not set."""
+        value = wurb_core.wurb_settings.get_setting(key)
+        if value in [None, ""]:
+            value = wurb_core.config.get(config_key, default=default)
+        return value
+
+    def start_feedback(self):
+        """Called when the first client is added."""
+        if self.feedback is not None:
+            return
+        if not self.sampling_freq_hz:
+            # Started by set_sampling_freq() later.
+            return
+        try:
+            config = wurb_core.config
+            mode = config.get("sound_pitch_shifting.mode", default="pitch-shifting")
+            feedback = wurb_utils.create_sound_feedback(mode, logger=self.logger_name)
+            feedback.setup(
+                channels="MONO",
+                sampling_freq_in=self.sampling_freq_hz,
+                sampling_freq_out=self.sampling_freq_out_hz,
+                pitch_factor=self.get_feedback_setting(
+                    "feedbackPitch", "sound_pitch_shifting.pitch_factor", 30
+                ),
+                volume_percent=self.get_feedback_setting(
+                    "feedbackVolume", "sound_pitch_shifting.volume_percent", 50
+                ),
+                filter_low_khz=self.get_feedback_setting(
+                    "feedbackFilterLowKhz", "sound_pitch_shifting.filter_low_khz", 15
+                ),
+                filter_high_khz=self.get_feedback_setting(
+                    "feedbackFilterHighKhz", "sound_pitch_shifting.filter_high_khz", 90
+                ),
+                overlap_factor=config.get(
+                    "sound_pitch_shifting.overlap_factor", default=1.5
+                ),
+                in_queue_length=config.get(
+                    "sound_pitch_shifting.in_queue_length", default=10
+                ),
+            )
+            if mode == "heterodyne":
+                feedback.set_heterodyne_khz(
+                    config.get("sound_pitch_shifting.heterodyne_khz", default=40.0)
+                )
+            self.out_queue = asyncio.Queue(maxsize=10)
+            feedback.add_out_queue(self.out_queue)
+            self.feedback = feedback
+            self.feedback_task = asyncio.create_task(feedback.start())
+            self.stream_task = asyncio.create_task(self.stream_worker())
+            # Clients already connected may need the new format.
+            self.audio_hub.publish(json.dumps(self.get_stream_format()))
+        except Exception as e:
+            # Logging error.
+            message = "AudioFeedback: start_feedback: " + str(e)
+            wurb_core.wurb_logger.error(message)
+
+    def stop_feedback(self):
+        """Called when the last client is removed."""
+        self.feedback = None
+        for task in [self.feedback_task, self.stream_task]:
+            if task:
+                task.cancel()
+        self.feedback_task = None
+        self.stream_task = None
+        self.out_queue = None
+
+    def restart_feedback(self):
+        """For new settings, if running."""
+        if self.feedback is not None:
+            self.stop_feedback()
+        if self.audio_hub.has_clients():
+            self.start_feedback()
+
+    async def stream_worker(self):
+        """Converted to bytes once for all clients."""
+        out_queue = self.out_queue
+        while True:
+            try:
+                data_dict = await out_queue.get()
+                if "data" in data_dict:
+                    self.audio_hub.publish(data_dict["data"].tobytes())
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                # Logging error.
+                message = "AudioFeedback: stream_worker: " + str(e)
+                self.logger.debug(message)
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import json
+import logging
+import numpy as np
+
+# CloudedBats.
+import wurb_core
+import wurb_utils
+
+
+class WurbLiveSpectrogram:
+    """
+    Scrolling spectrogram streamed to browsers. The squared magnitudes
+    from the FFT in the detector are reused, as the detector's
+    spectrogram_target. For detectors without FFT, or when detection is
+    not running in this process, the FFT is calculated here instead.
+    Frames are reduced to rows and columns by max, converted to dB and
+    quantized to uint8. Each column is encoded once and published to the
+    spectrogram hub, where each WebSocket client has its own queue.
+    Nothing is calculated when there are no clients.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        self.spectrogram_hub = wurb_utils.StreamHub(
+            "live_spectrogram", client_queue_length=10, logger=logger
+        )
+        self.spectrogram_hub.on_no_clients = self.clear
+        # Config.
+        self.columns_per_s = 25
+        self.max_rows = 128
+        self.min_dbfs = -100.0
+        self.max_dbfs = 0.0
+        self.fallback_min_khz = 15.0
+        self.frame_key = None
+        self.stream_format = {}
+        self.fallback_detector = None
+        self.clear()
+
+    def clear(self):
+        """Partial columns are removed, frame parameters are kept."""
+        self.pending = None
+        self.pending_length = 0
+        self.frames_added = False
+
+    async def startup(self):
+        """ """
+        config = wurb_core.config
+        self.columns_per_s = float(
+            config.get("live_spectrogram.columns_per_s", default=25)
+        )
+        self.max_rows = int(config.get("live_spectrogram.rows", default=128))
+        self.min_dbfs = float(config.get("live_spectrogram.min_dbfs", default=-100))
+        self.max_dbfs = float(config.get("live_spectrogram.max_dbfs", default=0.0))
+        self.fallback_min_khz = float(
+            config.get("live_spectrogram.min_freq_khz", default=15.0)
+        )
+        self.spectrogram_hub.client_queue_length = int(
+            config.get("live_spectrogram.client_queue_length", default=10)
+        )
+        self.frame_key = None
+
+    async def shutdown(self):
+        """ """
+        self.clear()
+
+    def is_active(self):
+        """Used by the detector, frames are only added when True."""
+        return self.spectrogram_hub.has_clients()
+
+    def get_stream_format(self):
+        """Sent as JSON before the binary columns."""
+        return self.stream_format
+
+    def setup_frames(self, sampling_freq, window_size, jump_size, min_bin, power_max):
+        """Called when the frames differ from the last ones, for example
+        after a new sampling frequency or detection limit."""
+        self.frame_key = (sampling_freq, window_size, jump_size, min_bin, power_max)
+        number_of_bins = window_size // 2 + 1 - min_bin
+        rows = max(1, min(self.max_rows, number_of_bins))
+        # First bin for each row, used in np.maximum.reduceat.
+        self.row_starts = np.linspace(0, number_of_bins, rows, endpoint=False)
+        self.row_starts = self.row_starts.astype(np.intp)
+        frames_per_s = sampling_freq / jump_size
+        self.frames_per_column = max(1, int(round(frames_per_s / self.columns_per_s)))
+        # Power to uint8, in one multiply-add after log10.
+        db_range = max(self.max_dbfs - self.min_dbfs, 1.0)
+        self.db_scale = 255.0 / db_range
+        self.db_offset = -10.0 * np.log10(power_max) - self.min_dbfs
+        self.clear()
+        self.stream_format = {
+            "format": "uint8",
+            "rows": rows,
+            "columns_per_s": round(frames_per_s / self.frames_per_column, 3),
+            "min_freq_hz": round(min_bin * sampling_freq / window_size, 1),
+            "max_freq_hz": round(sampling_freq / 2, 1),
+            "min_dbfs": self.min_dbfs,
+            "max_dbfs": self.max_dbfs,
+        }
+        # Clients already connected must use the new format.
+        self.spectrogram_hub.publish(json.dumps(self.stream_format))
+
+    def add_frame_powers(self, detector, powers):
+        """Called by the detector for each block of frames, with squared
+        magnitudes for bins above the detection limit. Shape: (frames, bins)."""
+        try:
+            frame_key = (
+                detector.sampling_freq,
+                detector.window_size,
+                detector.jump_size,
+                detector.filter_min_bin,
+                detector.window_function_power_max,
+            )
+            if frame_key != self.frame_key:
+                self.setup_frames(*frame_key)
+            self.frames_added = True
+            row_powers = np.maximum.reduceat(powers, self.row_starts, axis=1)
+            self.add_row_powers(row_powers)
+        except Exception as e:
+            # Logging error.
+            message = "LiveSpectrogram: add_frame_powers: " + str(e)
+            self.logger.debug(message)
+
+    def add_row_powers(self, row_powers):
+        """Complete columns are published, the rest is kept for later."""
+        length = len(row_powers)
+        needed = self.pending_length + length
+        if (self.pending is None) or (len(self.pending) < needed):
+            pending = np.empty((needed * 2, row_powers.shape[1]), dtype=np.float32)
+            if self.pending is not None:
+                pending[: self.pending_length] = self.pending[: self.pending_length]
+            self.pending = pending
+        self.pending[self.pending_length : needed] = row_powers
+        self.pending_length = needed
+        number_of_columns = needed // self.frames_per_column
+        if number_of_columns == 0:
+            return
+        used = number_of_columns * self.frames_per_column
+        columns = self.pending[:used].reshape(
+            number_of_columns, self.frames_per_column, -1
+        )
+        self.publish_columns(columns.max(axis=1))
+        # Move the partial column first.
+        left = needed - used
+        self.pending[:left] = self.pending[used:needed]
+        self.pending_length = left
+
+    def publish_columns(self, column_powers):
+        """Encoded once for all clients. Low frequencies first in each column."""
+        db = 10.0 * np.log10(np.maximum(column_powers, 1e-24))
+        db += self.db_offset
+        db *= self.db_scale
+        np.clip(db, 0.0, 255.0, out=db)
+        self.spectrogram_hub.publish(db.astype(np.uint8).tobytes())
+        wurb_utils.pipeline_metrics.count(
+            "live_spectrogram", "columns", len(column_powers)
+        )
+
+    def add_buffer(self, data_int16, rec_time=None):
+        """Called once per buffer by the process worker. The FFT is only
+        calculated here if the detector did not add frames for the buffer."""
+        if not self.is_active():
+            self.frames_added = False
+            return
+        if self.frames_added:
+            self.frames_added = False
+            return
+        try:
+            detector = self.get_fallback_detector()
+            work_buffer = detector.get_work_buffer(rec_time, data_int16)
+            frames = detector.get_frames(work_buffer)
+            detector.save_leftover(work_buffer, len(frames))
+            for _start, _end, powers in detector.iter_frame_powers(frames):
+                self.add_frame_powers(detector, powers)
+            self.frames_added = False
+        except Exception as e:
+            # Logging error.
+            message = "LiveSpectrogram: add_buffer: " + str(e)
+            self.logger.debug(message)
+
+    def get_fallback_detector(self):
+        """Same FFT as in the detector, only used for its frames."""
+        sampling_freq = wurb_core.wurb_recorder.sampling_freq_hz
+        detector = self.fallback_detector
+        if (detector is None) or (detector.sampling_freq != float(sampling_freq)):
+            detector = wurb_core.SoundDetectionSimple(logger=self.logger_name)
+            detector.setup(sampling_freq, self.fallback_min_khz, threshold_dbfs=0.0)
+            self.fallback_detector = detector
+        return detector
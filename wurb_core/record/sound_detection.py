@@ -6,27 +6,46 @@
 
 import logging
 import numpy as np
+import scipy.fft
 import scipy.signal
 
+# CloudedBats.
+import wurb_core
+
 
 class SoundDetection(object):
-    """ """
+    """Registry for detection algorithms. Algorithms are registered by the
+    name used in the setting "detectionAlgorithm"."""
 
     def __init__(self, logger="DefaultLogger"):
         """ """
         self.logger_name = logger
         self.logger = logging.getLogger(logger)
+        self.detection_classes = {}
+        # Used if the algorithm in settings is not registered.
+        self.default_algorithm = "detection-simple"
+        # Algorithms included.
+        self.register_detection("detection-none", SoundDetectionNone)
+        self.register_detection("detection-simple", SoundDetectionSimple)
+        self.register_detection("detection-noise-floor", SoundDetectionNoiseFloor)
+        self.register_detection("detection-band-energy", SoundDetectionBandEnergy)
+
+    def register_detection(self, algorithm, detection_class):
+        """The class must be a subclass of SoundDetectionBase."""
+        self.detection_classes[algorithm] = detection_class
+
+    def get_algorithms(self):
+        """ """
+        return list(self.detection_classes.keys())
 
     def get_detection(self):
         """ Select detection algorithm. """
         algorithm = wurb_core.wurb_settings.get_setting("detectionAlgorithm")
-        if algorithm == "detection-none":
-            detection_object = SoundDetectionNone(wurb_core)
-        elif algorithm == "detection-simple":
-            detection_object = SoundDetectionSimple(wurb_core)
-        else:
+        detection_class = self.detection_classes.get(algorithm, None)
+        if detection_class is None:
             # Use the most common as default.
-            detection_object = SoundDetectionSimple(wurb_core)
+            detection_class = self.detection_classes[self.default_algorithm]
+        detection_object = detection_class(logger=self.logger_name)
         #
         detection_object.config()
         return detection_object
@@ -39,6 +58,15 @@ class SoundDetectionBase:
         """ """
         self.logger_name = logger
         self.logger = logging.getLogger(logger)
+        self.sampling_freq = None
+        # Max diff between expected and actual buffer time. Unit: sec.
+        self.max_buffer_time_gap_s = 0.25
+        # Consecutive hits at the end of the last buffer.
+        self.sound_detected_counter = 0
+        # Expected time for the next buffer.
+        self.next_buffer_time = None
+        # Gets the FFT frames, for example the live spectrogram.
+        self.spectrogram_target = None
 
     def config(self, _time_and_data):
         """ Abstract. """
@@ -49,6 +77,38 @@ class SoundDetectionBase:
         # Returns "is sound", "freq. at peak", "dBFS at peak".
         return True, None, None  # Should be overridden.
 
+    def detect_sound(self, data_int16, rec_time=None):
+        """Detection part of check_for_sound, without manual triggering.
+        Used when detection runs in a separate process."""
+        return True, None, None  # Should be overridden.
+
+    def reset(self):
+        """Clear state kept between buffers."""
+        self.sound_detected_counter = 0
+        self.next_buffer_time = None
+
+    def check_buffer_time(self, rec_time, buffer_length):
+        """Returns False if the buffer does not follow the last one in time,
+        for example when buffers are lost. The counter is then cleared."""
+        is_continuous = True
+        if (rec_time is not None) and (self.next_buffer_time is not None):
+            if abs(rec_time - self.next_buffer_time) > self.max_buffer_time_gap_s:
+                is_continuous = False
+                self.sound_detected_counter = 0
+        if rec_time is not None:
+            self.next_buffer_time = rec_time + buffer_length / self.sampling_freq
+        return is_continuous
+
+    def calc_consecutive_counter(self, above_threshold):
+        """Number of consecutive hits above threshold, ending at each position.
+        The counter from the last buffer is continued by the first run."""
+        indexes = np.arange(len(above_threshold))
+        last_below = np.maximum.accumulate(np.where(above_threshold, -1, indexes))
+        counter = indexes - last_below
+        counter[last_below < 0] += self.sound_detected_counter
+        self.sound_detected_counter = int(counter[-1])
+        return counter
+
     def manual_triggering_check(self, sound_detected):
         """ """
         rec_mode = wurb_core.wurb_settings.get_setting("recMode")
@@ -99,18 +159,24 @@ class SoundDetectionSimple(SoundDetectionBase):
         super(SoundDetectionSimple, self).__init__(logger)
         # Config.
         self.sound_detected_counter_min = 3
+        # State kept between buffers.
+        self.reset()
 
     def config(self):
         """ """
         sampling_freq = wurb_core.wurb_recorder.sampling_freq_hz
         filter_min_khz = wurb_core.wurb_settings.get_setting("detectionLimitKhz")
         threshold_dbfs = wurb_core.wurb_settings.get_setting("detectionSensitivityDbfs")
+        self.setup(sampling_freq, filter_min_khz, threshold_dbfs)
 
+    def setup(self, sampling_freq, filter_min_khz, threshold_dbfs):
+        """ """
         self.sampling_freq = float(sampling_freq)
         self.filter_min_hz = float(filter_min_khz) * 1000.0
         self.threshold_dbfs = float(threshold_dbfs)
         self.window_size = 2048
         self.jump_size = 1000
+        self.frames_per_block = 32
 
         # self.window_function = scipy.signal.blackmanharris(self.window_size)
         self.window_function = scipy.signal.windows.hann(self.window_size)
@@ -119,6 +185,19 @@ class SoundDetectionSimple(SoundDetectionBase):
         self.freq_bins_hz = np.arange((self.window_size / 2) + 1) / (
             self.window_size / self.sampling_freq
         )
+        # High pass filter. Bins below this index are excluded from the peak search.
+        self.filter_min_bin = int(
+            np.count_nonzero(self.freq_bins_hz < self.filter_min_hz)
+        )
+        # Scaling and window function combined, applied to all frames at once.
+        # Float32 is enough for peak detection and halves the FFT work.
+        self.frame_weights = np.array(self.window_function / 32768.0, dtype=np.float32)
+        # Threshold converted once from dBFS to squared magnitude. Used in the
+        # hot path to avoid sqrt and log10 for windows without sound.
+        self.window_function_power_max = self.window_function_dbfs_max**2
+        self.threshold_power = self.window_function_power_max * 10 ** (
+            self.threshold_dbfs / 10.0
+        )
 
         # print(
         #     "DEBUG: Detection: Freq: ",
@@ -128,70 +207,115 @@ class SoundDetectionSimple(SoundDetectionBase):
         #     " Sens: ",
         #     self.threshold_dbfs,
         # )
+        self.reset()
+
+    def reset(self):
+        """Clear state kept between buffers."""
+        super(SoundDetectionSimple, self).reset()
+        # Samples not yet used as start of a window.
+        self.leftover_int16 = None
+
+    def get_frames(self, data_int16):
+        """Frames of window size, one for each jump. Strided view, no copy."""
+        if len(data_int16) < self.window_size:
+            return np.empty((0, self.window_size), dtype=data_int16.dtype)
+        frames = np.lib.stride_tricks.sliding_window_view(data_int16, self.window_size)
+        return frames[:: self.jump_size]
+
+    def iter_frame_powers(self, frames):
+        """Yields start index, end index and squared magnitude for blocks of
+        frames. Frames are handled in blocks small enough to stay in the
+        CPU cache. Only bins above the detection limit are included."""
+        for start in range(0, len(frames), self.frames_per_block):
+            end = start + self.frames_per_block
+            # Transform to intervall -1 to 1 and apply window function.
+            signals = frames[start:end] * self.frame_weights
+            # From time domain to frequency domain. All frames in one call.
+            spectrum = scipy.fft.rfft(signals, axis=1)
+            # High pass filter. Only bins above the limit are used.
+            spectrum = spectrum[:, self.filter_min_bin :]
+            # Squared magnitude, |X|^2. No sqrt needed for peak search and threshold.
+            powers = np.square(spectrum.real)
+            powers += np.square(spectrum.imag)
+            target = self.spectrogram_target
+            if (target is not None) and target.is_active():
+                target.add_frame_powers(self, powers)
+            yield start, min(end, len(frames)), powers
+
+    def calc_frame_peaks(self, frames):
+        """Returns squared magnitude and bin index at peak for each frame."""
+        peak_powers = np.empty(len(frames), dtype=np.float32)
+        bin_peak_indexes = np.empty(len(frames), dtype=np.intp)
+        for start, end, powers in self.iter_frame_powers(frames):
+            block_peak_indexes = powers.argmax(axis=1)
+            peak_powers[start:end] = np.take_along_axis(
+                powers, block_peak_indexes[:, np.newaxis], axis=1
+            )[:, 0]
+            bin_peak_indexes[start:end] = block_peak_indexes + self.filter_min_bin
+        return peak_powers, bin_peak_indexes
+
+    def power_to_dbfs(self, power):
+        """Squared magnitude to dBFS. log10 does not like zero."""
+        return 10 * np.log10(max(float(power), 1e-24) / self.window_function_power_max)
+
+    def get_work_buffer(self, rec_time, data_int16):
+        """Join with samples left from the last buffer, if continuous in time."""
+        leftover_int16 = self.leftover_int16
+        if not self.check_buffer_time(rec_time, len(data_int16)):
+            # Buffers lost, or restarted. Don't join unrelated sound.
+            leftover_int16 = None
+        if (leftover_int16 is None) or (len(leftover_int16) == 0):
+            return data_int16
+        return np.concatenate((leftover_int16, data_int16))
+
+    def save_leftover(self, work_buffer, number_of_frames):
+        """Keep samples from the next window start for the next buffer."""
+        next_start = number_of_frames * self.jump_size
+        # Copy, the caller may reuse the buffer.
+        self.leftover_int16 = work_buffer[next_start:].copy()
+
+    def detect_sound(self, data_int16, rec_time=None):
+        """Detection part of check_for_sound, without manual triggering."""
+        sound_detected = False
+        peak_frequency_hz = None
+        peak_dbfs_at_max = None
+        work_buffer = self.get_work_buffer(rec_time, data_int16)
+        frames = self.get_frames(work_buffer)
+        self.save_leftover(work_buffer, len(frames))
+        if (len(frames) == 0) or (self.window_function_dbfs_max <= 0.0):
+            return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+        peak_powers, bin_peak_indexes = self.calc_frame_peaks(frames)
+        # Treshold. Peaks are only valid when the counter has reached its min value.
+        above_threshold = peak_powers > self.threshold_power
+        sound_detected_counter = self.calc_consecutive_counter(above_threshold)
+        valid = above_threshold & (
+            sound_detected_counter >= self.sound_detected_counter_min
+        )
+        if valid.any():
+            sound_detected = True
+            frame_index = np.where(valid, peak_powers, -1.0).argmax()
+            # dBFS only calculated for the strongest valid window.
+            peak_dbfs_at_max = float(self.power_to_dbfs(peak_powers[frame_index]))
+            peak_frequency_hz = float(
+                bin_peak_indexes[frame_index] * self.sampling_freq / self.window_size
+            )
+        return sound_detected, peak_frequency_hz, peak_dbfs_at_max
 
     def check_for_sound(self, time_and_data):
         """ """
-        _rec_time, raw_data = time_and_data
+        rec_time, raw_data = time_and_data
         # data_int16 = np.fromstring(raw_data, dtype=np.int16) # To ndarray.
         data_int16 = raw_data
-        # self.work_buffer = np.concatenate([self._work_buffer, data_int16])
-        self.work_buffer = data_int16
         #
         sound_detected = False
-        sound_detected_counter = 0
         peak_frequency_hz = None
         peak_dbfs_at_max = None
         try:
-            while len(self.work_buffer) >= self.window_size:
-                # Get frame of window size.
-                data_frame = self.work_buffer[: self.window_size]
-                # Cut the first jumped size.
-                self.work_buffer = self.work_buffer[self.jump_size :]
-                # Transform to intervall -1 to 1 and apply window function.
-                signal = data_frame / 32768.0 * self.window_function
-                # From time domain to frequency domain.
-                spectrum = np.fft.rfft(signal)
-                # High pass filter. Unit Hz. Cut below 15 kHz.
-                # log10 does not like zero.
-                spectrum[self.freq_bins_hz < self.filter_min_hz] = 0.000000001
-                # Convert spectrum to dBFS (bin values related to maximal possible value).
-                if self.window_function_dbfs_max > 0.0:
-                    dbfs_spectrum = 20 * np.log10(
-                        np.abs(spectrum) / self.window_function_dbfs_max
-                    )
-                    # Find peak and dBFS value for the peak.
-                    bin_peak_index = dbfs_spectrum.argmax()
-                    peak_db = dbfs_spectrum[bin_peak_index]
-                else:
-                    peak_db = -500.0
-                # Treshold.
-                if peak_db > self.threshold_dbfs:
-                    sound_detected_counter += 1
-                    if sound_detected_counter >= self.sound_detected_counter_min:
-                        sound_detected = True
-                        if (peak_dbfs_at_max is None) or (peak_db > peak_dbfs_at_max):
-                            peak_dbfs_at_max = peak_db
-                            peak_frequency_hz = (
-                                bin_peak_index * self.sampling_freq / self.window_size
-                            )
-                            # print(
-                            #     "DEBUG: Peak freq hz: "
-                            #     + str(peak_frequency_hz)
-                            #     + "   dBFS: "
-                            #     + str(peak_db)
-                            # )
-            # # Log if sound was detected.
-            # if sound_detected:
-            #     # Logging.
-            #     message = (
-            #         "Sound peak: "
-            #         + str(round(peak_frequency_hz / 1000.0, 1))
-            #         + " kHz / "
-            #         + str(round(peak_dbfs_at_max, 1))
-            #         + " dBFS."
-            #     )
-            #     wurb_core.wurb_logger.info(message)
-            #
+            (
+                sound_detected,
+                peak_frequency_hz,
+                peak_dbfs_at_max,
+            ) = self.detect_sound(data_int16, rec_time)
         except Exception as e:
             print("DEBUG: xception in check_for_sound: ", e)
 
@@ -199,3 +323,320 @@ class SoundDetectionSimple(SoundDetectionBase):
         sound_detected = self.manual_triggering_check(sound_detected)
 
         return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+
+
+class SoundDetectionNoiseFloor(SoundDetectionSimple):
+    """Detection relative to a running noise floor, for sites with insects
+    or rain close to the threshold. The spectrum is divided in bands and the
+    noise floor for each band follows the median level over time.
+    A window is a hit if any band is above the noise floor by the SNR limit,
+    and the peak is above the dBFS threshold."""
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        super(SoundDetectionNoiseFloor, self).__init__(logger)
+        # Config.
+        self.bins_per_band = 16
+        self.noise_floor_time_s = 10.0  # Time constant. Unit: sec.
+
+    def config(self):
+        """ """
+        super(SoundDetectionNoiseFloor, self).config()
+        snr_db = wurb_core.wurb_settings.get_setting("detectionSnrDb")
+        self.setup_snr(snr_db)
+
+    def setup(self, sampling_freq, filter_min_khz, threshold_dbfs, snr_db=12.0):
+        """ """
+        super(SoundDetectionNoiseFloor, self).setup(
+            sampling_freq, filter_min_khz, threshold_dbfs
+        )
+        self.setup_snr(snr_db)
+
+    def setup_snr(self, snr_db):
+        """ """
+        try:
+            self.snr_db = float(snr_db)
+        except ValueError:
+            self.snr_db = 12.0
+
+    def reset(self):
+        """Clear state kept between buffers."""
+        super(SoundDetectionNoiseFloor, self).reset()
+        # Noise floor in dB for each band.
+        self.noise_floor_db = None
+
+    def calc_frame_bands(self, frames):
+        """Returns peak power, bin index at peak and power per band for each frame."""
+        number_of_bins = (self.window_size // 2) + 1 - self.filter_min_bin
+        number_of_bands = max(1, number_of_bins // self.bins_per_band)
+        used_bins = number_of_bands * self.bins_per_band
+        peak_powers = np.empty(len(frames), dtype=np.float32)
+        bin_peak_indexes = np.empty(len(frames), dtype=np.intp)
+        band_powers = np.empty((len(frames), number_of_bands), dtype=np.float32)
+        for start, end, powers in self.iter_frame_powers(frames):
+            block_peak_indexes = powers.argmax(axis=1)
+            peak_powers[start:end] = np.take_along_axis(
+                powers, block_peak_indexes[:, np.newaxis], axis=1
+            )[:, 0]
+            bin_peak_indexes[start:end] = block_peak_indexes + self.filter_min_bin
+            # Bins above the last complete band are not used for the floor.
+            band_powers[start:end] = (
+                powers[:, :used_bins]
+                .reshape(end - start, number_of_bands, self.bins_per_band)
+                .sum(axis=2)
+            )
+        return peak_powers, bin_peak_indexes, band_powers
+
+    def update_noise_floor(self, band_db, buffer_length):
+        """Exponential moving median. The median over the buffer is used as
+        input to a moving average, calls in a few windows have no effect."""
+        buffer_median_db = np.median(band_db, axis=0)
+        if (self.noise_floor_db is None) or (
+            len(self.noise_floor_db) != len(buffer_median_db)
+        ):
+            self.noise_floor_db = buffer_median_db
+            return
+        buffer_time_s = buffer_length / self.sampling_freq
+        alpha = min(1.0, buffer_time_s / self.noise_floor_time_s)
+        self.noise_floor_db += alpha * (buffer_median_db - self.noise_floor_db)
+
+    def detect_sound(self, data_int16, rec_time=None):
+        """Detection part of check_for_sound, without manual triggering."""
+        sound_detected = False
+        peak_frequency_hz = None
+        peak_dbfs_at_max = None
+        work_buffer = self.get_work_buffer(rec_time, data_int16)
+        frames = self.get_frames(work_buffer)
+        self.save_leftover(work_buffer, len(frames))
+        if (len(frames) == 0) or (self.window_function_dbfs_max <= 0.0):
+            return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+        peak_powers, bin_peak_indexes, band_powers = self.calc_frame_bands(frames)
+        # Small arrays, frames x bands. log10 does not like zero.
+        band_db = 10 * np.log10(band_powers + 1e-20)
+        if self.noise_floor_db is None:
+            self.update_noise_floor(band_db, len(data_int16))
+        max_snr_db = (band_db - self.noise_floor_db).max(axis=1)
+        # Treshold. Both SNR and the absolute level must be exceeded.
+        above_threshold = (max_snr_db > self.snr_db) & (
+            peak_powers > self.threshold_power
+        )
+        sound_detected_counter = self.calc_consecutive_counter(above_threshold)
+        valid = above_threshold & (
+            sound_detected_counter >= self.sound_detected_counter_min
+        )
+        self.update_noise_floor(band_db, len(data_int16))
+        if valid.any():
+            sound_detected = True
+            frame_index = np.where(valid, peak_powers, -1.0).argmax()
+            # dBFS only calculated for the strongest valid window.
+            peak_dbfs_at_max = float(self.power_to_dbfs(peak_powers[frame_index]))
+            peak_frequency_hz = float(
+                bin_peak_indexes[frame_index] * self.sampling_freq / self.window_size
+            )
+        return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+
+
+class SoundDetectionBandEnergy(SoundDetectionBase):
+    """Detection without FFT, in two cascaded stages.
+    First a cheap vectorized difference filter is used as a gate for each
+    block. Only blocks where the gate is open, and settle_blocks around
+    them, are filtered by a bank of IIR band pass filters, and the energy
+    in each band is summed in blocks. Cheaper than the FFT when sound is
+    sparse in time, as for bat calls, but about the same cost when the
+    gate is open for all blocks, for example in loud insect noise.
+    Peak frequency is reported as the center of the strongest band."""
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        super(SoundDetectionBandEnergy, self).__init__(logger)
+        # Config.
+        self.sound_detected_counter_min = 2
+        self.block_length_s = 0.002  # Unit: sec.
+        self.filter_order = 2
+        # Blocks filtered before and after open blocks, for filter settling.
+        self.settle_blocks = 1
+        # State kept between buffers.
+        self.reset()
+
+    def config(self):
+        """ """
+        sampling_freq = wurb_core.wurb_recorder.sampling_freq_hz
+        filter_min_khz = wurb_core.wurb_settings.get_setting("detectionLimitKhz")
+        threshold_dbfs = wurb_core.wurb_settings.get_setting("detectionSensitivityDbfs")
+        bands_khz = wurb_core.wurb_settings.get_setting("detectionBandsKhz")
+        self.setup(sampling_freq, filter_min_khz, threshold_dbfs, bands_khz)
+
+    def setup(self, sampling_freq, filter_min_khz, threshold_dbfs, bands_khz=""):
+        """Bands as a string, for example "20-50,50-120". If empty, one band
+        from the detection limit up to half the sampling frequency is used."""
+        self.sampling_freq = float(sampling_freq)
+        self.filter_min_hz = float(filter_min_khz) * 1000.0
+        self.threshold_dbfs = float(threshold_dbfs)
+        self.block_size = max(1, int(self.sampling_freq * self.block_length_s))
+        # Filter bank. One SOS filter for each band.
+        self.band_list = self.parse_bands(bands_khz)
+        self.sos_list = []
+        self.band_center_hz_list = []
+        for low_hz, high_hz in self.band_list:
+            if high_hz >= (self.sampling_freq / 2) * 0.98:
+                sos = scipy.signal.butter(
+                    self.filter_order,
+                    low_hz,
+                    btype="highpass",
+                    fs=self.sampling_freq,
+                    output="sos",
+                )
+                high_hz = self.sampling_freq / 2
+            else:
+                sos = scipy.signal.butter(
+                    self.filter_order,
+                    [low_hz, high_hz],
+                    btype="bandpass",
+                    fs=self.sampling_freq,
+                    output="sos",
+                )
+            self.sos_list.append(sos)
+            self.band_center_hz_list.append((low_hz + high_hz) / 2)
+        # Energy for a full scale sine during one block, int16 units. 0 dBFS.
+        self.block_energy_max = self.block_size * (32768.0**2) / 2
+        self.threshold_energy = self.block_energy_max * 10 ** (
+            self.threshold_dbfs / 10.0
+        )
+        # Gate. The difference filter has the gain 2*sin(pi*f/fs), lowest
+        # at the lowest band limit. Half of that is used as margin for the
+        # transition bands of the IIR filters.
+        min_band_hz = min([low_hz for low_hz, _high_hz in self.band_list])
+        min_gain = 2 * np.sin(np.pi * min_band_hz / self.sampling_freq)
+        self.gate_threshold_energy = self.threshold_energy * (min_gain**2) * 0.5
+        self.reset()
+
+    def parse_bands(self, bands_khz):
+        """Returns a list of (low_hz, high_hz). Invalid bands are skipped."""
+        nyquist_hz = self.sampling_freq / 2
+        band_list = []
+        for band_str in str(bands_khz).split(","):
+            try:
+                low_str, high_str = band_str.split("-")
+                low_hz = float(low_str) * 1000.0
+                high_hz = min(float(high_str) * 1000.0, nyquist_hz)
+                if 0.0 < low_hz < high_hz:
+                    band_list.append((low_hz, high_hz))
+            except ValueError:
+                pass
+        if len(band_list) == 0:
+            band_list.append((self.filter_min_hz, nyquist_hz))
+        return band_list
+
+    def reset(self):
+        """Clear state kept between buffers."""
+        super(SoundDetectionBandEnergy, self).reset()
+        # Filter states at the end of the last buffer, one for each band.
+        # Only kept if the last block was filtered.
+        self.zi_list = None
+
+    def calc_gate(self, data_int16):
+        """First stage. True for each complete block where the sound may
+        contain energy above threshold in any band. Blocks start at the
+        beginning of the buffer, samples after the last block are not used."""
+        number_of_blocks = len(data_int16) // self.block_size
+        end = number_of_blocks * self.block_size
+        samples = data_int16[:end].astype(np.float32)
+        diff = np.empty_like(samples)
+        diff[0] = 0.0
+        np.subtract(samples[1:], samples[:-1], out=diff[1:])
+        blocks = diff.reshape(number_of_blocks, self.block_size)
+        energies = np.einsum("ij,ij->i", blocks, blocks)
+        return energies > self.gate_threshold_energy
+
+    def calc_band_energies(self, data_int16, selected):
+        """Returns energy per band and block, zero for blocks not selected.
+        Shape: (bands, blocks). Each run of selected blocks is filtered from
+        zero filter states, or from the last buffer if continued."""
+        number_of_blocks = len(selected)
+        band_energies = np.zeros((len(self.sos_list), number_of_blocks))
+        last_zi_list = self.zi_list
+        self.zi_list = None
+        edges = np.flatnonzero(np.diff(selected.astype(np.int8), prepend=0, append=0))
+        for first, last in zip(edges[0::2], edges[1::2]):
+            segment = data_int16[first * self.block_size : last * self.block_size]
+            zi_list = []
+            for index, sos in enumerate(self.sos_list):
+                if (first == 0) and (last_zi_list is not None):
+                    zi = last_zi_list[index]
+                else:
+                    zi = np.zeros((sos.shape[0], 2))
+                filtered, zi = scipy.signal.sosfilt(sos, segment, zi=zi)
+                blocks = filtered.reshape(last - first, self.block_size)
+                band_energies[index, first:last] = np.einsum("ij,ij->i", blocks, blocks)
+                zi_list.append(zi)
+            if (last == number_of_blocks) and (
+                len(data_int16) == number_of_blocks * self.block_size
+            ):
+                self.zi_list = zi_list
+        return band_energies
+
+    def detect_sound(self, data_int16, rec_time=None):
+        """Detection part of check_for_sound, without manual triggering."""
+        sound_detected = False
+        peak_frequency_hz = None
+        peak_dbfs_at_max = None
+        if not self.check_buffer_time(rec_time, len(data_int16)):
+            # Buffers lost, or restarted. Start with new filter states.
+            self.zi_list = None
+        if len(data_int16) < self.block_size:
+            return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+        gate = self.calc_gate(data_int16)
+        if not gate.any():
+            # Nothing to detect. Filters will start from zero next time.
+            self.sound_detected_counter = 0
+            self.zi_list = None
+            return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+        # Blocks around open blocks are also filtered.
+        selected = gate.copy()
+        for shift in range(1, self.settle_blocks + 1):
+            selected[:-shift] |= gate[shift:]
+            selected[shift:] |= gate[:-shift]
+        band_energies = self.calc_band_energies(data_int16, selected)
+        peak_bands = band_energies.argmax(axis=0)
+        peak_energies = band_energies.max(axis=0)
+        # Treshold. Blocks are only valid when the counter has reached its min value.
+        above_threshold = peak_energies > self.threshold_energy
+        sound_detected_counter = self.calc_consecutive_counter(above_threshold)
+        valid = above_threshold & (
+            sound_detected_counter >= self.sound_detected_counter_min
+        )
+        if valid.any():
+            sound_detected = True
+            block_index = np.where(valid, peak_energies, -1.0).argmax()
+            peak_dbfs_at_max = float(
+                10 * np.log10(peak_energies[block_index] / self.block_energy_max)
+            )
+            peak_frequency_hz = float(self.band_center_hz_list[peak_bands[block_index]])
+        return sound_detected, peak_frequency_hz, peak_dbfs_at_max
+
+    def check_for_sound(self, time_and_data):
+        """ """
+        rec_time, data_int16 = time_and_data
+        #
+        sound_detected = False
+        peak_frequency_hz = None
+        peak_dbfs_at_max = None
+        try:
+            (
+                sound_detected,
+                peak_frequency_hz,
+                peak_dbfs_at_max,
+            ) = self.detect_sound(data_int16, rec_time)
+        except Exception as e:
+            # Logging error.
+            message = "Detection: check_for_sound: " + str(e)
+            self.logger.error(message)
+
+        # Check if running in manual triggering mode.
+        sound_detected = self.manual_triggering_check(sound_detected)
+
+        return sound_detected, peak_frequency_hz, peak_dbfs_at_max
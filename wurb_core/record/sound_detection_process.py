@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.shared_memory
+import numpy as np
+
+# CloudedBats.
+import wurb_core
+
+
+def detection_process_main(detector, shm_name, buffer_size, task_conn, result_conn):
+    """Runs in the detection process. Buffers are read from the shared memory
+    buffer, only lengths and results are sent through the pipes. Exceptions
+    are sent as text with the result, and logged by the main process."""
+    shm = multiprocessing.shared_memory.SharedMemory(name=shm_name)
+    try:
+        shared_buffer = np.ndarray((buffer_size,), dtype=np.int16, buffer=shm.buf)
+        while True:
+            message = task_conn.recv()
+            if message is None:
+                # Terminate.
+                break
+            if message[0] == "reset":
+                detector.reset()
+                continue
+            _command, sequence, length, rec_time = message
+            error = None
+            try:
+                result = detector.detect_sound(shared_buffer[:length], rec_time)
+            except Exception as e:
+                error = str(e)
+                result = (False, None, None)
+            result_conn.send((sequence, result, error))
+        del shared_buffer
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        shm.close()
+
+
+class SoundDetectionProcess(object):
+    """Runs a configured detection object in a separate process, to keep
+    FFT work off the asyncio event loop and to use a second CPU core.
+    One buffer at a time is copied to shared memory, the result is received
+    by the event loop through a pipe reader. The event loop is free while
+    the process is working, but the caller waits for each result since the
+    recorder acts on the result before the next buffer.
+    If the process dies it is restarted, and after max_restarts the
+    detection runs in this process instead."""
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        self.clear()
+        self.detector = None
+        self.buffer_size = None
+        self.restart_counter = 0
+        # Config.
+        self.max_restarts = 3
+
+    def clear(self):
+        """ """
+        self.process = None
+        self.shm = None
+        self.shared_buffer = None
+        self.task_conn = None
+        self.result_conn = None
+        self.pending_future = None
+        self.pipe_closed = False
+        self.sequence = 0
+        self.main_loop = None
+
+    def is_running(self):
+        """ """
+        return self.process is not None
+
+    def is_alive(self):
+        """False if the process has terminated or the pipes are closed."""
+        if not self.is_running():
+            return False
+        return (not self.pipe_closed) and self.process.is_alive()
+
+    async def start(self, detector, buffer_size):
+        """The detector object must be configured. It is pickled to the new
+        process, where detect_sound() is called. Manual triggering is
+        checked here, since it depends on settings in this process."""
+        if self.is_running():
+            await self.stop()
+        self.detector = detector
+        self.buffer_size = int(buffer_size)
+        self.restart_counter = 0
+        self.start_process()
+
+    def start_process(self):
+        """ """
+        self.main_loop = asyncio.get_running_loop()
+        # Shared memory, used for one buffer at a time.
+        self.shm = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=self.buffer_size * 2
+        )
+        self.shared_buffer = np.ndarray(
+            (self.buffer_size,), dtype=np.int16, buffer=self.shm.buf
+        )
+        # Spawn, to avoid forking threads from the event loop process.
+        context = multiprocessing.get_context("spawn")
+        task_recv, self.task_conn = context.Pipe(duplex=False)
+        self.result_conn, result_send = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=detection_process_main,
+            args=(
+                self.detector,
+                self.shm.name,
+                self.buffer_size,
+                task_recv,
+                result_send,
+            ),
+            name="WurbDetection",
+            daemon=True,
+        )
+        self.process.start()
+        task_recv.close()
+        result_send.close()
+        self.main_loop.add_reader(self.result_conn.fileno(), self.read_results)
+        self.logger.debug("Detection process started.")
+
+    async def stop(self):
+        """ """
+        if not self.is_running():
+            return
+        try:
+            if not self.pipe_closed:
+                self.main_loop.remove_reader(self.result_conn.fileno())
+            try:
+                self.task_conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            await self.main_loop.run_in_executor(None, self.process.join, 2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+            if (self.pending_future is not None) and (not self.pending_future.done()):
+                self.pending_future.cancel()
+            self.task_conn.close()
+            self.result_conn.close()
+            self.shared_buffer = None
+            self.shm.close()
+            self.shm.unlink()
+        except Exception as e:
+            # Logging error.
+            message = "Detection process: stop: " + str(e)
+            wurb_core.wurb_logger.error(message)
+        finally:
+            self.clear()
+            self.logger.debug("Detection process stopped.")
+
+    async def restart(self):
+        """Called when the process has died. Detection continues in this
+        process if it dies too many times."""
+        await self.stop()
+        self.restart_counter += 1
+        wurb_core.metrics.count("detection", "process_restarts")
+        if self.restart_counter > self.max_restarts:
+            message = "Detection process failed, detection moved to the main process."
+            wurb_core.wurb_logger.warning(message)
+            return
+        message = "Detection process terminated, restarted."
+        wurb_core.wurb_logger.warning(message)
+        try:
+            self.start_process()
+        except Exception as e:
+            # Logging error.
+            message = "Detection process: restart: " + str(e)
+            wurb_core.wurb_logger.error(message)
+            await self.stop()
+
+    def reset(self):
+        """Clear detector state kept between buffers."""
+        if self.is_running():
+            try:
+                self.task_conn.send(("reset",))
+            except (BrokenPipeError, OSError):
+                self.pipe_closed = True
+
+    def read_results(self):
+        """Called by the event loop when results are available."""
+        try:
+            while self.result_conn.poll():
+                sequence, result, error = self.result_conn.recv()
+                if error is not None:
+                    # Logging error.
+                    message = "Detection process: detect_sound: " + error
+                    wurb_core.wurb_logger.error(message)
+                future = self.pending_future
+                if (future is not None) and (sequence == self.sequence):
+                    self.pending_future = None
+                    if not future.done():
+                        future.set_result(result)
+        except (EOFError, OSError):
+            # Process terminated. A waiting caller gets None.
+            self.pipe_closed = True
+            self.main_loop.remove_reader(self.result_conn.fileno())
+            future = self.pending_future
+            self.pending_future = None
+            if (future is not None) and (not future.done()):
+                future.set_result(None)
+
+    async def check_for_sound(self, time_and_data):
+        """Same contract as the detection objects, but must be awaited."""
+        rec_time, data_int16 = time_and_data
+        if self.is_running() and (not self.is_alive()):
+            await self.restart()
+        if (not self.is_running()) or (len(data_int16) > self.buffer_size):
+            # Not possible to use the process. Run here instead.
+            return self.detector.check_for_sound(time_and_data)
+        length = len(data_int16)
+        self.shared_buffer[:length] = data_int16
+        self.sequence += 1
+        future = self.main_loop.create_future()
+        self.pending_future = future
+        try:
+            self.task_conn.send(("detect", self.sequence, length, rec_time))
+            result = await future
+        except (BrokenPipeError, OSError):
+            self.pipe_closed = True
+            self.pending_future = None
+            result = None
+        if result is None:
+            # The process died, this buffer is checked here.
+            wurb_core.metrics.count("detection", "process_failures")
+            return self.detector.check_for_sound(time_and_data)
+        sound_detected, peak_frequency_hz, peak_dbfs = result
+        # Check if running in manual triggering mode.
+        sound_detected = self.detector.manual_triggering_check(sound_detected)
+        return sound_detected, peak_frequency_hz, peak_dbfs
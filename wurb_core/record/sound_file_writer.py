@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import time
+import asyncio
+import logging
+import concurrent.futures
+
+# CloudedBats.
+import wurb_core
+
+
+class SoundFileWriterPool(object):
+    """Runs file creation, writes and close on a bounded thread pool,
+    to keep slow SD cards and USB sticks from blocking the event loop.
+    Each file has its own queue, writes to one file are done in order."""
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        self.executor = None
+        self.file_tasks = set()
+        self.file_queues = set()
+        self.pending_files = 0
+        # Config.
+        self.max_workers = 2
+        self.max_pending_files = 1
+
+    def startup(self):
+        """ """
+        if self.executor is None:
+            self.max_workers = int(
+                wurb_core.config.get("sound_writer.max_workers", default=2)
+            )
+            self.max_pending_files = int(
+                wurb_core.config.get("sound_writer.max_pending_files", default=1)
+            )
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="WurbWriter"
+            )
+
+    async def shutdown(self):
+        """Waits for all files to be closed."""
+        try:
+            if self.file_tasks:
+                await asyncio.gather(*self.file_tasks, return_exceptions=True)
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+        except Exception as e:
+            # Logging error.
+            message = "Writer pool: shutdown: " + str(e)
+            wurb_core.wurb_logger.error(message)
+        finally:
+            self.executor = None
+
+    def is_backpressure(self):
+        """True if the writer is too slow to accept a new file."""
+        return self.pending_files >= self.max_pending_files
+
+    def get_pending_buffers(self):
+        """Number of buffers waiting to be written."""
+        return sum([file_queue.qsize() for file_queue in self.file_queues])
+
+    def open_file(self, start_time, max_peak_freq_hz, max_peak_dbfs, sampling_freq_hz):
+        """Returns the queue for the new file. Data arrays are put to the
+        queue and None closes the file. Arrays must not be changed until
+        written, they are not copied. A tuple with an array and a function
+        can also be used, the function is called when the array is written
+        or dropped."""
+        self.startup()
+        file_queue = asyncio.Queue()
+        create_args = (start_time, max_peak_freq_hz, max_peak_dbfs, sampling_freq_hz)
+        self.pending_files += 1
+        wurb_core.metrics.set_gauge("writer", "pending_files", self.pending_files)
+        self.file_queues.add(file_queue)
+        task = asyncio.create_task(self.file_worker(file_queue, create_args))
+        self.file_tasks.add(task)
+        task.add_done_callback(self.file_tasks.discard)
+        return file_queue
+
+    async def file_worker(self, file_queue, create_args):
+        """ """
+        loop = asyncio.get_running_loop()
+        tracing = wurb_core.tracing
+        start_time, sampling_freq_hz = create_args[0], create_args[3]
+        samples_written = 0
+        file_closed = False
+        wave_file_writer = wurb_core.WaveFileWriter(logger=self.logger_name)
+        try:
+            await loop.run_in_executor(
+                self.executor, wave_file_writer.create, *create_args
+            )
+            while True:
+                data = await file_queue.get()
+                if data is None:
+                    file_closed = True
+                    break
+                release = None
+                if isinstance(data, tuple):
+                    data, release = data
+                try:
+                    if len(data) > 0:
+                        trace_start = tracing.start()
+                        await loop.run_in_executor(
+                            self.executor, wave_file_writer.write, data
+                        )
+                        tracing.stop("file_write", trace_start)
+                        samples_written += len(data)
+                        wurb_core.metrics.count("writer", "buffers_written")
+                finally:
+                    if release:
+                        release()
+        except Exception as e:
+            # Logging error.
+            message = "Writer pool: file_worker: " + str(e)
+            wurb_core.wurb_logger.error(message)
+        finally:
+            try:
+                trace_start = tracing.start()
+                await loop.run_in_executor(self.executor, wave_file_writer.close)
+                tracing.stop("file_close", trace_start)
+                # From ADC time of the last sample.
+                if sampling_freq_hz:
+                    end_adc_time = start_time + samples_written / sampling_freq_hz
+                    tracing.add("adc_to_file_close", time.time() - end_adc_time)
+            except Exception as e:
+                # Logging error.
+                message = "Writer pool: close: " + str(e)
+                wurb_core.wurb_logger.error(message)
+            # Not written after errors, but must be released until closed.
+            while not file_closed:
+                data = await file_queue.get()
+                if data is None:
+                    file_closed = True
+                elif isinstance(data, tuple):
+                    data[1]()
+            self.file_queues.discard(file_queue)
+            self.pending_files -= 1
+            wurb_core.metrics.count("writer", "files_closed")
+            wurb_core.metrics.set_gauge("writer", "pending_files", self.pending_files)
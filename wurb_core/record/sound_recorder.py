@@ -11,7 +11,12 @@ import time
 import wave
 import pathlib
 import psutil
-from collections import deque
+
+try:
+    import soundfile
+except ImportError:
+    # FLAC not available, WAV is used.
+    soundfile = None
 
 # CloudedBats.
 import wurb_core
@@ -67,6 +72,13 @@ class UltrasoundDevices(object):
                 if self.pettersson_m500.is_m500_available():
                     device_name = self.pettersson_m500.get_device_name()
                     sampling_freq_hz = self.pettersson_m500.get_sampling_freq_hz()
+            # Check if replay of files or synthetic sound is specified.
+            if not device_name:
+                replay_source = os.getenv("WURB_REC_REPLAY", "")
+                if replay_source:
+                    sound_replay = wurb_utils.SoundReplay(source=replay_source)
+                    device_name = sound_replay.get_device_name()
+                    sampling_freq_hz = sound_replay.get_sampling_freq_hz()
             # Check if another ALSA mic. is specified in advanced settings.
             if not device_name:
                 settings_device_name_part = os.getenv("WURB_REC_INPUT_DEVICE", "")
@@ -171,6 +183,15 @@ class WurbRecorder():
         self.max_adc_time_diff_s = 10  # Unit: sec.
         self.rec_length_s = 6  # Unit: sec.
         self.rec_timeout_before_restart_s = 30  # Unit: sec.
+        # Pre-trigger/post-trigger window.
+        self.ring_buffer = wurb_core.SoundRingBuffer(logger=self.logger_name)
+        # Files are written in threads.
+        self.writer_pool = wurb_core.SoundFileWriterPool(logger=self.logger_name)
+        self.dropped_files_counter = 0
+        # Continuous mode, samples in the open segment.
+        self.segment_length = None
+        self.segment_samples = None
+        self.dropped_buffers_counter = 0
 
     async def get_notification_event(self):
         """ """
@@ -222,6 +243,42 @@ class WurbRecorder():
         self.rec_start_time = None
         loop = asyncio.get_event_loop()
         self.restart_activated = False
+        # Audio feedback is calculated for the current sampling frequency.
+        await wurb_core.wurb_audiofeedback.set_sampling_freq(
+            sampling_freq=self.sampling_freq_hz
+        )
+
+        # Replay of files or synthetic sound. For tests without microphone.
+        replay_source = os.getenv("WURB_REC_REPLAY", "")
+        if replay_source:
+            sound_replay = wurb_utils.SoundReplay(
+                data_queue=self.from_source_queue,
+                source=replay_source,
+                pacing=os.getenv("WURB_REC_REPLAY_PACING", "realtime"),
+                direct_target=wurb_core.wurb_audiofeedback,
+                logger=self.logger_name,
+            )
+            if self.device_name == sound_replay.get_device_name():
+                # Logging.
+                await self.set_rec_status("Microphone is on (replay).")
+                try:
+                    buffer_size = int(self.sampling_freq_hz / 2)  # 0.5 sec.
+                    await sound_replay.initiate_capture(
+                        card_index=None,
+                        sampling_freq=self.sampling_freq_hz,
+                        buffer_size=buffer_size,
+                    )
+                    await sound_replay.start_capture_in_executor()
+                except asyncio.CancelledError:
+                    await sound_replay.stop_capture()
+                except Exception as e:
+                    # Logging error.
+                    message = "Recorder: sound_source_worker: " + str(e)
+                    wurb_core.wurb_logger.error(message)
+                finally:
+                    await sound_replay.stop_capture()
+                    await self.set_rec_status("Recording finished.")
+                return
 
         # Pettersson M500, not compatible with ALSA.
         pettersson_m500 = wurb_core.PetterssonM500(
@@ -253,7 +310,7 @@ class WurbRecorder():
         # Standard ASLA microphones.
         recorder_alsa = wurb_core.AlsaSoundCapture(
             data_queue=self.from_source_queue,
-            direct_target=self.wurb_audiofeedback,
+            direct_target=wurb_core.wurb_audiofeedback,
         )
         # Logging.
         await self.set_rec_status("Microphone is on.")
@@ -278,15 +335,29 @@ class WurbRecorder():
 
     async def sound_process_worker(self):
         """ """
-
+        detection_process = None
         try:
             # Get rec length from settings.
             self.rec_length_s = int(wurb_core.wurb_settings.get_setting("recLengthS"))
+            # Optional latency tracing.
+            tracing = wurb_core.tracing
+            tracing.set_enabled(
+                wurb_core.config.get("pipeline_tracing.enabled", default=False)
+            )
             #
-            self.process_deque = deque()  # Double ended queue.
-            self.process_deque.clear()
             self.process_deque_length = self.rec_length_s * 2
             self.detection_counter_max = self.process_deque_length - 3  # 1.5 s before.
+            # Continuous mode, buffers are streamed to segment files.
+            continuous_mode = self.is_continuous_mode()
+            self.segment_samples = None
+            self.segment_length = self.get_segment_length()
+            # Files waiting for the writer must not be overwritten in the ring.
+            self.writer_pool.startup()
+            ring_files = 2 + self.writer_pool.max_pending_files
+            self.ring_buffer.setup(
+                buffer_size=int(self.sampling_freq_hz / 2),  # 0.5 sec.
+                number_of_buffers=self.process_deque_length * ring_files,
+            )
             #
             first_sound_detected = False
             sound_detected = False
@@ -294,6 +365,22 @@ class WurbRecorder():
 
             ### ??? ###
             sound_detector = wurb_core.wurb_sound_detection.get_detection()
+            # Detection can run in a separate process. Activated in config.
+            run_in_process = wurb_core.config.get(
+                "sound_detection.run_in_process", default=False
+            )
+            if run_in_process and (not continuous_mode):
+                detection_process = wurb_core.SoundDetectionProcess(
+                    logger=self.logger_name
+                )
+                # Buffer size 1 sec, buffers are 0.5 sec.
+                await detection_process.start(
+                    sound_detector, buffer_size=int(self.sampling_freq_hz)
+                )
+            else:
+                # FFT frames reused by the live spectrogram.
+                sound_detector.spectrogram_target = wurb_core.wurb_live_spectrogram
+            live_spectrogram = wurb_core.wurb_live_spectrogram
 
             max_peak_freq_hz = None
             max_peak_dbfs = None
@@ -326,25 +413,45 @@ class WurbRecorder():
                             await self.remove_items_from_queue(self.from_source_queue)
                             await self.from_source_queue.put(False)  # Flush.
                             return
-                        #
+                        # Shared capture buffer, released when copied or skipped.
+                        source_item = None
                         try:
                             # print("REC PROCESS: ", item["adc_time"], item["data"][:5])
                             if item == None:
                                 first_sound_detected == False
                                 sound_detected_counter = 0
-                                self.process_deque.clear()
+                                self.ring_buffer.clear()
                                 await self.to_target_queue.put(None)  # Terminate.
                                 break
                             elif item == False:
                                 first_sound_detected == False
                                 sound_detected_counter = 0
-                                self.process_deque.clear()
+                                self.ring_buffer.clear()
+                                self.segment_samples = None
+                                sound_detector.reset()
+                                if detection_process:
+                                    detection_process.reset()
                                 await self.remove_items_from_queue(self.to_target_queue)
                                 await self.to_target_queue.put(False)  # Flush.
                             else:
+                                source_item = item
                                 # Compare real time and stream time.
                                 adc_time = item["adc_time"]
                                 detector_time = item["detector_time"]
+                                # Metrics.
+                                metrics = wurb_core.metrics
+                                metrics.count("process", "buffers_in")
+                                metrics.queue_depth(
+                                    "process",
+                                    "from_source_queue",
+                                    self.from_source_queue,
+                                )
+                                metrics.set_gauge(
+                                    "process",
+                                    "time_drift_s",
+                                    round(abs(adc_time - detector_time), 3),
+                                )
+                                tracing.add("source_queue", time.time() - detector_time)
                                 # Restart if it differ too much.
                                 if (
                                     abs(adc_time - detector_time)
@@ -369,30 +476,55 @@ class WurbRecorder():
                                     await self.from_source_queue.put(False)  # Flush.
                                     return
 
-                                # Store in list-
-                                new_item = {}
-                                new_item["status"] = "data-Counter-" + str(
-                                    sound_detected_counter
+                                # Store in ring buffer.
+                                buffer_index = self.ring_buffer.add_buffer(
+                                    adc_time, item["data"]
                                 )
-                                new_item["adc_time"] = item["adc_time"]
-                                new_item["data"] = item["data"]
-
-                                self.process_deque.append(new_item)
-                                # Remove oldest items if the list is too long.
-                                while (
-                                    len(self.process_deque) > self.process_deque_length
-                                ):
-                                    self.process_deque.popleft()
+                                if buffer_index is not None:
+                                    # Copied, the ring copy is used below.
+                                    data = self.ring_buffer.get_buffer(buffer_index)
+                                    wurb_utils.release_buffer(source_item)
+                                    source_item = None
+                                else:
+                                    data = item["data"]
 
                                 # Check for sound.
-                                detection_result = sound_detector.check_for_sound(
-                                    (item["adc_time"], item["data"])
-                                )
+                                if continuous_mode:
+                                    await self.send_to_segments(buffer_index)
+                                    live_spectrogram.add_buffer(data, adc_time)
+                                    continue
+                                if buffer_index is None:
+                                    # Ring slot still used by the writer.
+                                    self.dropped_buffers_counter += 1
+                                    metrics.count("process", "dropped_buffers")
+                                    message = (
+                                        "Writer too slow, buffer skipped. "
+                                        + "Skipped buffers: "
+                                        + str(self.dropped_buffers_counter)
+                                    )
+                                    wurb_core.wurb_logger.warning(message)
+                                    continue
+                                trace_start = tracing.start()
+                                if detection_process:
+                                    detection_result = (
+                                        await detection_process.check_for_sound(
+                                            (adc_time, data)
+                                        )
+                                    )
+                                else:
+                                    detection_result = sound_detector.check_for_sound(
+                                        (adc_time, data)
+                                    )
                                 (
                                     sound_detected,
                                     peak_freq_hz,
                                     peak_dbfs,
                                 ) = detection_result
+                                tracing.stop("detection", trace_start)
+                                live_spectrogram.add_buffer(data, adc_time)
+                                metrics.count("detection", "buffers")
+                                if sound_detected:
+                                    metrics.count("detection", "sound_detected")
 
                                 if (not first_sound_detected) and sound_detected:
                                     first_sound_detected = True
@@ -422,32 +554,56 @@ class WurbRecorder():
                                         sound_detected_counter
                                         >= self.detection_counter_max
                                     ) and (
-                                        len(self.process_deque)
+                                        self.ring_buffer.get_unused_length()
                                         >= self.process_deque_length
                                     ):
                                         first_sound_detected = False
                                         sound_detected_counter = 0
-                                        # Send to target.
-                                        for index in range(
-                                            0, self.process_deque_length
-                                        ):
-                                            to_file_item = self.process_deque.popleft()
-                                            #
-                                            if index == 0:
-                                                to_file_item["status"] = "new_file"
-                                                to_file_item[
-                                                    "max_peak_freq_hz"
-                                                ] = max_peak_freq_hz
-                                                to_file_item[
-                                                    "max_peak_dbfs"
-                                                ] = max_peak_dbfs
-                                            if index == (self.process_deque_length - 1):
-                                                to_file_item["status"] = "close_file"
-                                            #
-                                            if not self.to_target_queue.full():
-                                                await self.to_target_queue.put(
-                                                    to_file_item
-                                                )
+                                        # Send to target. Pinned views, not copies.
+                                        (
+                                            file_adc_time,
+                                            file_slices,
+                                            release,
+                                        ) = self.ring_buffer.take_last(
+                                            self.process_deque_length
+                                        )
+                                        tracing.add(
+                                            "ring_buffer", time.time() - file_adc_time
+                                        )
+                                        new_file_item = {
+                                            "status": "new_file",
+                                            "adc_time": file_adc_time,
+                                            "max_peak_freq_hz": max_peak_freq_hz,
+                                            "max_peak_dbfs": max_peak_dbfs,
+                                            "data": file_slices[0],
+                                            "trace_time": tracing.start(),
+                                        }
+                                        close_file_item = {
+                                            "status": "close_file",
+                                            "data": file_slices[1],
+                                            "trace_time": tracing.start(),
+                                            # Written in order, last item.
+                                            "release": release,
+                                        }
+                                        if self.is_target_backpressure():
+                                            # Writer too slow. Report and skip.
+                                            release()
+                                            self.dropped_files_counter += 1
+                                            metrics.count("process", "dropped_files")
+                                            message = (
+                                                "Writer too slow, file skipped. "
+                                                + "Skipped files: "
+                                                + str(self.dropped_files_counter)
+                                            )
+                                            wurb_core.wurb_logger.warning(message)
+                                        else:
+                                            await self.to_target_queue.put(
+                                                new_file_item
+                                            )
+                                            await self.to_target_queue.put(
+                                                close_file_item
+                                            )
+                                            metrics.count("process", "files_out")
 
                                             # await asyncio.sleep(0)
 
@@ -456,12 +612,14 @@ class WurbRecorder():
                             # data = item.get('data', '')
                             # print("DEBUG: Process status:", status, " time:", adc_time, " data: ", len(data))
                         finally:
+                            if source_item is not None:
+                                wurb_utils.release_buffer(source_item)
                             self.from_source_queue.task_done()
                             await asyncio.sleep(0)
 
                     except asyncio.QueueFull:
                         await self.remove_items_from_queue(self.to_target_queue)
-                        self.process_deque.clear()
+                        self.ring_buffer.clear()
                         await self.to_target_queue.put(False)  # Flush.
                 except asyncio.CancelledError:
                     break
@@ -477,49 +635,159 @@ class WurbRecorder():
             message = "Recorder: sound_process_worker(2): " + str(e)
             wurb_core.wurb_logger.error(message)
         finally:
-            pass
+            if detection_process:
+                await detection_process.stop()
+
+    def is_continuous_mode(self):
+        """Record everything to segment files, no detection needed."""
+        rec_mode = wurb_core.wurb_settings.get_setting("recMode")
+        algorithm = wurb_core.wurb_settings.get_setting("detectionAlgorithm")
+        if rec_mode in ["mode-on", "mode-scheduler-on"]:
+            return True
+        if (algorithm == "detection-none") and (rec_mode != "mode-manual"):
+            return True
+        return False
+
+    def get_segment_length(self):
+        """Segment length in samples, from recSegmentMb or recLengthS.
+        Not shorter than 1 sec, since filenames have 1 sec resolution."""
+        segment_mb = float(wurb_core.wurb_settings.get_setting("recSegmentMb") or 0)
+        if segment_mb > 0:
+            segment_length = int(segment_mb * 1000000 / 2)  # 2 bytes per sample.
+        else:
+            segment_length = int(self.rec_length_s * self.sampling_freq_hz)
+        return max(segment_length, int(self.sampling_freq_hz))
+
+    async def send_to_segments(self, buffer_index):
+        """Continuous mode. Buffers are split at segment boundaries, each
+        sample is sent once. The next file is opened by the writer pool
+        while the last one is closed. The ring slot is pinned for each item
+        with data, and released by the writer."""
+        if buffer_index is None:
+            # Ring slot still used by the writer.
+            self.dropped_buffers_counter += 1
+            wurb_core.metrics.count("process", "dropped_buffers")
+            message = (
+                "Writer too slow, buffer skipped. New file started. "
+                + "Skipped buffers: "
+                + str(self.dropped_buffers_counter)
+            )
+            wurb_core.wurb_logger.warning(message)
+            if self.segment_samples is not None:
+                # Close. Files must not contain gaps.
+                await self.to_target_queue.put(
+                    {
+                        "status": "close_file",
+                        "data": self.ring_buffer.data[0:0],
+                        "trace_time": wurb_core.tracing.start(),
+                    }
+                )
+                self.segment_samples = None
+            return
+        data = self.ring_buffer.get_buffer(buffer_index)
+        adc_time = self.ring_buffer.get_adc_time(buffer_index)
+        start = 0
+        while start < len(data):
+            if self.segment_samples is None:
+                await self.to_target_queue.put(
+                    {
+                        "status": "new_file",
+                        "adc_time": adc_time + start / self.sampling_freq_hz,
+                        "data": data[0:0],
+                        "trace_time": wurb_core.tracing.start(),
+                    }
+                )
+                self.segment_samples = 0
+            length = min(len(data) - start, self.segment_length - self.segment_samples)
+            self.segment_samples += length
+            status = "data"
+            if self.segment_samples >= self.segment_length:
+                status = "close_file"
+                self.segment_samples = None
+            await self.to_target_queue.put(
+                {
+                    "status": status,
+                    "data": data[start : start + length],
+                    "trace_time": wurb_core.tracing.start(),
+                    "release": self.ring_buffer.pin(buffer_index, 1),
+                }
+            )
+            start += length
+
+    async def remove_items_from_queue(self, queue):
+        """Drains the queue in place. Pinned ring buffer slots and shared
+        capture buffers in the removed items are released."""
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                if isinstance(item, dict):
+                    release = item.get("release", None)
+                    if release:
+                        release()
+                    wurb_utils.release_buffer(item)
+            finally:
+                queue.task_done()
+
+    def is_target_backpressure(self):
+        """True if the target queue or the file writer can't accept a file."""
+        # Two items are used for each file.
+        max_size = self.to_target_queue.maxsize
+        if (max_size > 0) and (self.to_target_queue.qsize() + 2 > max_size):
+            return True
+        return self.writer_pool.is_backpressure()
 
     async def sound_target_worker(self):
-        """Worker for sound targets. Mainly files or streams."""
-        wave_file_writer = None
+        """Worker for sound targets. Mainly files or streams.
+        File operations are done in the writer pool, not in the event loop."""
+        file_queue = None
         try:
             while True:
                 try:
                     item = await self.to_target_queue.get()
+                    wurb_core.metrics.queue_depth(
+                        "target", "to_target_queue", self.to_target_queue
+                    )
                     try:
                         if item == None:
                             # Terminated by process.
                             break
                         elif item == False:
                             await self.remove_items_from_queue(self.to_target_queue)
-                            if wave_file_writer:
-                                wave_file_writer.close()
+                            if file_queue:
+                                file_queue.put_nowait(None)  # Close.
+                                file_queue = None
                         else:
+                            wurb_core.tracing.stop(
+                                "target_queue", item.get("trace_time", None)
+                            )
                             # New.
                             if item["status"] == "new_file":
-                                if wave_file_writer:
-                                    wave_file_writer.close()
-
-                                wave_file_writer = WaveFileWriter(
-                                    wurb_core.wurb_manager
-                                )
-                                max_peak_freq_hz = item.get("max_peak_freq_hz", None)
-                                max_peak_dbfs = item.get("max_peak_dbfs", None)
-                                wave_file_writer.create(
-                                    item["adc_time"], max_peak_freq_hz, max_peak_dbfs
+                                if file_queue:
+                                    file_queue.put_nowait(None)  # Close.
+                                file_queue = self.writer_pool.open_file(
+                                    item["adc_time"],
+                                    item.get("max_peak_freq_hz", None),
+                                    item.get("max_peak_dbfs", None),
+                                    self.sampling_freq_hz,
                                 )
-                            # Data.
-                            if wave_file_writer:
-                                data_array = item["data"]
-                                wave_file_writer.write(data_array)
+                            # Data. Pinned ring slots are released when written.
+                            release = item.get("release", None)
+                            if file_queue and release:
+                                file_queue.put_nowait((item["data"], release))
+                            elif file_queue:
+                                file_queue.put_nowait(item["data"])
+                            elif release:
+                                release()
                             # File.
                             if item["status"] == "close_file":
-                                if wave_file_writer:
-                                    wave_file_writer.close()
-                                    wave_file_writer = None
+                                if file_queue:
+                                    file_queue.put_nowait(None)  # Close.
+                                    file_queue = None
                     finally:
                         self.to_target_queue.task_done()
-                        await asyncio.sleep(0)
 
                 except asyncio.CancelledError:
                     break
@@ -532,12 +800,15 @@ class WurbRecorder():
             message = "Recorder: sound_target_worker: " + str(e)
             wurb_core.wurb_logger.error(message)
         finally:
-            pass
+            if file_queue:
+                file_queue.put_nowait(None)  # Close.
+            await self.writer_pool.shutdown()
 
 
 class WaveFileWriter:
     """Each file is connected to a separate file writer object
-    to avoid concurrency problems."""
+    to avoid concurrency problems.
+    Files are written as WAV or FLAC, both 16 bits PCM and lossless."""
 
     def __init__(self, logger="DefaultLogger"):
         """ """
@@ -545,21 +816,33 @@ class WaveFileWriter:
         self.logger = logging.getLogger(logger)
         self.rec_target_dir_path = None
         self.wave_file = None
+        self.sound_file = None
+        self.file = None
         # self.size_counter = 0
 
-    def create(self, start_time, max_peak_freq_hz, max_peak_dbfs):
+    def get_rec_format(self):
+        """FLAC needs the soundfile package, else WAV is used."""
+        rec_format = wurb_core.wurb_settings.get_setting("recFormat")
+        if rec_format == "FLAC":
+            if soundfile is not None:
+                return "FLAC"
+            # Logging.
+            message = "FLAC not available, install soundfile. WAV is used."
+            wurb_core.wurb_logger.warning(message)
+        return "WAV"
+
+    def create(self, start_time, max_peak_freq_hz, max_peak_dbfs, sampling_freq_hz):
         """ """
         rec_file_prefix = wurb_core.wurb_settings.get_setting("filenamePrefix")
         rec_type = wurb_core.wurb_settings.get_setting("recType")
-        sampling_freq_hz = self.wurb_recorder.sampling_freq_hz
+        rec_format = self.get_rec_format()
+        rec_sampling_freq_hz = sampling_freq_hz
         if rec_type == "TE":
             sampling_freq_hz = int(sampling_freq_hz / 10.0)
         self.rec_target_dir_path = wurb_core.wurb_rpi.get_wavefile_target_dir_path()
         rec_datetime = self.get_datetime(start_time)
         rec_location = self.get_location()
-        rec_type_str = self.create_rec_type_str(
-            self.wurb_recorder.sampling_freq_hz, rec_type
-        )
+        rec_type_str = self.create_rec_type_str(rec_sampling_freq_hz, rec_type)
 
         # Peak info to filename.
         peak_info_str = ""
@@ -583,17 +866,28 @@ class WaveFileWriter:
         filename += "_"
         filename += rec_type_str
         filename += peak_info_str
-        filename += ".wav"
+        filename += "." + rec_format.lower()
 
         # Create directories.
         if not self.rec_target_dir_path.exists():
             self.rec_target_dir_path.mkdir(parents=True)
         # Open wave file for writing.
         filenamepath = pathlib.Path(self.rec_target_dir_path, filename)
-        self.wave_file = wave.open(str(filenamepath), "wb")
-        self.wave_file.setnchannels(1)  # 1=Mono.
-        self.wave_file.setsampwidth(2)  # 2=16 bits.
-        self.wave_file.setframerate(sampling_freq_hz)
+        self.file = open(filenamepath, "wb")
+        if rec_format == "FLAC":
+            self.sound_file = soundfile.SoundFile(
+                self.file,
+                mode="w",
+                samplerate=sampling_freq_hz,
+                channels=1,  # 1=Mono.
+                subtype="PCM_16",  # 16 bits, same as the int16 buffers.
+                format="FLAC",
+            )
+        else:
+            self.wave_file = wave.open(self.file, "wb")
+            self.wave_file.setnchannels(1)  # 1=Mono.
+            self.wave_file.setsampwidth(2)  # 2=16 bits.
+            self.wave_file.setframerate(sampling_freq_hz)
         # Logging.
         target_path_str = str(self.rec_target_dir_path)
         target_path_str = target_path_str.replace("/media/pi/", "USB:")
@@ -611,6 +905,8 @@ class WaveFileWriter:
         """ """
         if self.wave_file is not None:
             self.wave_file.writeframes(buffer)
+        if self.sound_file is not None:
+            self.sound_file.write(buffer)
             # self.size_counter += len(buffer) / 2  # Count frames.
 
     def close(self):
@@ -618,6 +914,15 @@ class WaveFileWriter:
         if self.wave_file is not None:
             self.wave_file.close()
             self.wave_file = None
+        if self.sound_file is not None:
+            self.sound_file.close()
+            self.sound_file = None
+        if self.file is not None:
+            # Make sure data is on the card before next file.
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
         # Copy settings to target directory.
         try:
             if self.rec_target_dir_path is not None:
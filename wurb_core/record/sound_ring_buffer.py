@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org, https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import logging
+import numpy as np
+
+
+class SoundRingBuffer(object):
+    """Preallocated int16 ring for the pre-trigger/post-trigger window.
+    Buffers are copied into fixed slots and counted by a running index.
+    Slices returned are views into the ring, no copies are made. Slots
+    with views still used by the file writer are pinned, and add_buffer()
+    drops new buffers instead of overwriting them."""
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger_name = logger
+        self.logger = logging.getLogger(logger)
+        self.data = None
+        self.adc_times = None
+        self.pins = None
+        self.pin_generation = 0
+        self.buffer_size = 0
+        self.number_of_buffers = 0
+        self.clear()
+
+    def setup(self, buffer_size, number_of_buffers):
+        """Allocate only if the size is changed."""
+        buffer_size = int(buffer_size)
+        number_of_buffers = int(number_of_buffers)
+        if (buffer_size != self.buffer_size) or (
+            number_of_buffers != self.number_of_buffers
+        ):
+            self.buffer_size = buffer_size
+            self.number_of_buffers = number_of_buffers
+            self.data = np.zeros(buffer_size * number_of_buffers, dtype=np.int16)
+            self.adc_times = np.zeros(number_of_buffers, dtype=np.float64)
+            # Old views are still valid, the old array is kept by the views.
+            self.pins = np.zeros(number_of_buffers, dtype=np.int32)
+        self.clear()
+
+    def clear(self):
+        """Pins are also cleared. Items in the queues are dropped when the
+        ring is cleared, and old release functions are not used."""
+        self.buffer_counter = 0  # Total number of added buffers.
+        self.first_unused = 0  # First buffer not sent to target.
+        if self.pins is not None:
+            self.pins[:] = 0
+        self.pin_generation += 1
+
+    def add_buffer(self, adc_time, data_int16):
+        """Returns the running index of the added buffer, or None if the
+        slot is pinned. Buffers before a dropped one are not used again,
+        to avoid gaps in the taken views."""
+        if len(data_int16) != self.buffer_size:
+            # Buffer size changed by the source. Old content is dropped.
+            self.logger.debug("Ring buffer resized: " + str(len(data_int16)))
+            self.setup(len(data_int16), self.number_of_buffers)
+        slot = self.buffer_counter % self.number_of_buffers
+        if self.pins[slot] > 0:
+            self.first_unused = self.buffer_counter
+            return None
+        start = slot * self.buffer_size
+        self.data[start : start + self.buffer_size] = data_int16
+        self.adc_times[slot] = adc_time
+        self.buffer_counter += 1
+        return self.buffer_counter - 1
+
+    def get_unused_length(self):
+        """Number of buffers not sent to target, limited by the ring size."""
+        return min(self.buffer_counter - self.first_unused, self.number_of_buffers)
+
+    def get_buffer(self, index):
+        """View of one buffer. Valid until overwritten."""
+        start = (index % self.number_of_buffers) * self.buffer_size
+        return self.data[start : start + self.buffer_size]
+
+    def get_adc_time(self, index):
+        """ """
+        return float(self.adc_times[index % self.number_of_buffers])
+
+    def pin(self, first_index, number_of_buffers):
+        """Pinned slots are not overwritten. Returns a function to call when
+        the views are no longer used, only the first call is used."""
+        slots = [
+            (first_index + i) % self.number_of_buffers for i in range(number_of_buffers)
+        ]
+        for slot in slots:
+            self.pins[slot] += 1
+        pin_generation = self.pin_generation
+        released = []
+
+        def release():
+            # Not used if cleared or reallocated since pinned.
+            if released or (pin_generation != self.pin_generation):
+                return
+            released.append(True)
+            for slot in slots:
+                self.pins[slot] -= 1
+
+        return release
+
+    def take_last(self, number_of_buffers):
+        """Marks the last buffers as used and pins them. Returns the adc time
+        of the first buffer, one or two contiguous views, two if wrapped in
+        the ring, and the function to release the pin."""
+        first_index = self.buffer_counter - number_of_buffers
+        self.first_unused = self.buffer_counter
+        release = self.pin(first_index, number_of_buffers)
+        start = (first_index % self.number_of_buffers) * self.buffer_size
+        length = number_of_buffers * self.buffer_size
+        end = start + length
+        if end <= len(self.data):
+            slices = [self.data[start:end], self.data[0:0]]
+        else:
+            slices = [self.data[start:], self.data[0 : end - len(self.data)]]
+        return self.get_adc_time(first_index), slices, release
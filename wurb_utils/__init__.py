@@ -4,12 +4,28 @@
 
 from wurb_utils.logger import Logger
 from wurb_utils.configuration import Configuration
+from wurb_utils.pipeline_metrics import PipelineMetrics
+from wurb_utils.pipeline_tracing import PipelineTracing
 
+from wurb_utils.sound_buffer_ring import SoundBufferRing
+from wurb_utils.sound_buffer_ring import release_buffer
 from wurb_utils.sound_capture import SoundCapture
 from wurb_utils.sound_pitchshifting import SoundPitchshifting
+from wurb_utils.sound_feedback import SoundHeterodyne
+from wurb_utils.sound_feedback import SoundFrequencyDivision
+from wurb_utils.sound_feedback import create_sound_feedback
+from wurb_utils.sound_jitter_buffer import SoundJitterBuffer
 from wurb_utils.sound_playback import SoundPlayback
+from wurb_utils.sound_replay import SoundReplay
+from wurb_utils.sound_resampler import SoundResampler
+from wurb_utils.sound_resampler import SoundDecimator
+from wurb_utils.stream_hub import StreamHub
 
 from wurb_utils.pettersson_m500 import PetterssonM500
 from wurb_utils.pettersson_m500_batmic import PetterssonM500BatMic
 
 from wurb_utils.solartime import SolarTime
+
+# Shared by all stages in the audio pipeline.
+pipeline_metrics = PipelineMetrics(logger="WurbLogger")
+pipeline_tracing = PipelineTracing(logger="WurbLogger")
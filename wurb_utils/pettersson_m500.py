@@ -10,6 +10,7 @@ import numpy
 import array
 import logging
 
+import wurb_utils
 from .pettersson_m500_batmic import PetterssonM500BatMic
 
 
@@ -116,11 +117,16 @@ class PetterssonM500:
                             "data": data_int16_copy,
                         }
                         # Add to queue in main event loop.
+                        metrics = wurb_utils.pipeline_metrics
+                        metrics.count("m500", "buffers_in")
                         try:
                             if not self.data_queue.full():
                                 self.main_loop.call_soon_threadsafe(
                                     self.data_queue.put_nowait, send_dict
                                 )
+                            else:
+                                metrics.count("m500", "dropped_queue_full")
+                                self.logger.debug("M500 capture: Queue full.")
                         except Exception as e:
                             # Logging error.
                             message = "Failed to put buffer on queue (M500): " + str(e)
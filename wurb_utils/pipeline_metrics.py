@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import time
+import logging
+import threading
+
+
+class PipelineMetrics:
+    """
+    Counters and gauges for each stage in the audio pipeline, for example
+    buffers in, out and dropped, queue high-water marks and overflows.
+    Can be called from capture threads and from the event loop.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger = logging.getLogger(logger)
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """ """
+        with self.lock:
+            self.start_time = time.time()
+            self.stages = {}
+
+    def get_stage(self, stage):
+        """Must be called with the lock taken."""
+        stage_dict = self.stages.get(stage, None)
+        if stage_dict is None:
+            stage_dict = {"counters": {}, "gauges": {}, "high_water": {}}
+            self.stages[stage] = stage_dict
+        return stage_dict
+
+    def count(self, stage, name, value=1):
+        """ """
+        with self.lock:
+            counters = self.get_stage(stage)["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    def set_gauge(self, stage, name, value):
+        """Last value and the highest value are kept."""
+        with self.lock:
+            stage_dict = self.get_stage(stage)
+            stage_dict["gauges"][name] = value
+            high_water = stage_dict["high_water"]
+            if value > high_water.get(name, value - 1):
+                high_water[name] = value
+
+    def queue_depth(self, stage, name, data_queue):
+        """Gauge for the number of items in an asyncio or standard queue."""
+        try:
+            self.set_gauge(stage, name, data_queue.qsize())
+        except Exception:
+            pass
+
+    def get_metrics(self):
+        """Copy of all values, ready for JSON."""
+        with self.lock:
+            stages = {}
+            for stage, stage_dict in self.stages.items():
+                stages[stage] = {
+                    "counters": dict(stage_dict["counters"]),
+                    "gauges": dict(stage_dict["gauges"]),
+                    "high_water": dict(stage_dict["high_water"]),
+                }
+            return {
+                "start_time": self.start_time,
+                "uptime_s": round(time.time() - self.start_time, 1),
+                "stages": stages,
+            }
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import time
+import logging
+import threading
+import numpy
+
+
+class PipelineTracing:
+    """
+    Optional latency tracing for stages in the audio pipeline.
+    The last measured times for each stage are kept in a fixed size ring,
+    and percentiles are calculated when asked for. Does nothing when
+    not enabled.
+    """
+
+    def __init__(self, logger="DefaultLogger", window_size=1000):
+        """ """
+        self.logger = logging.getLogger(logger)
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.window_size = window_size
+        self.clear()
+
+    def clear(self):
+        """ """
+        with self.lock:
+            self.stages = {}
+
+    def set_enabled(self, enabled):
+        """ """
+        self.enabled = bool(enabled)
+
+    def start(self):
+        """Monotonic start time, or None if not enabled."""
+        if self.enabled:
+            return time.perf_counter()
+        return None
+
+    def stop(self, stage, start_time):
+        """Adds the time since start() to the stage."""
+        if start_time is not None:
+            self.add(stage, time.perf_counter() - start_time)
+
+    def add(self, stage, seconds):
+        """ """
+        if not self.enabled:
+            return
+        with self.lock:
+            stage_dict = self.stages.get(stage, None)
+            if stage_dict is None:
+                stage_dict = {
+                    "times": numpy.zeros(self.window_size, dtype=numpy.float64),
+                    "counter": 0,
+                    "max": 0.0,
+                }
+                self.stages[stage] = stage_dict
+            index = stage_dict["counter"] % self.window_size
+            stage_dict["times"][index] = seconds
+            stage_dict["counter"] += 1
+            if seconds > stage_dict["max"]:
+                stage_dict["max"] = seconds
+
+    def get_latency(self):
+        """Percentiles in ms for the last measured times, ready for JSON."""
+        result = {}
+        with self.lock:
+            for stage, stage_dict in self.stages.items():
+                length = min(stage_dict["counter"], self.window_size)
+                times_ms = stage_dict["times"][:length] * 1000.0
+                p50, p95, p99 = numpy.percentile(times_ms, [50, 95, 99])
+                result[stage] = {
+                    "count": stage_dict["counter"],
+                    "p50_ms": round(float(p50), 3),
+                    "p95_ms": round(float(p95), 3),
+                    "p99_ms": round(float(p99), 3),
+                    "max_ms": round(stage_dict["max"] * 1000.0, 3),
+                }
+        return {"enabled": self.enabled, "stages": result}
+
+    def log_latency(self):
+        """Summary to the debug log."""
+        for stage, values in self.get_latency()["stages"].items():
+            message = (
+                "Latency "
+                + stage
+                + ": p50: "
+                + str(values["p50_ms"])
+                + " ms, p95: "
+                + str(values["p95_ms"])
+                + " ms, p99: "
+                + str(values["p99_ms"])
+                + " ms, max: "
+                + str(values["max_ms"])
+                + " ms, count: "
+                + str(values["count"])
+            )
+            self.logger.debug(message)
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import logging
+import numpy
+
+
+def release_buffer(data_dict):
+    """Called by consumers when done with a buffer. Buffers not
+    from a SoundBufferRing are ignored."""
+    buffer_ring = data_dict.get("buffer_ring", None)
+    if buffer_ring is not None:
+        buffer_ring.release(data_dict["slot"])
+
+
+class SoundBufferRing:
+    """
+    Preallocated int16 buffers shared by all consumers.
+    The producer fills a free slot, then the same read-only buffer and
+    the same dict are put on all consumer queues. Each consumer calls
+    release_buffer() when done, and the slot is reused when all are done.
+    Lock-free: The producer thread only takes slots with count zero, other
+    changes of counts are done in the event loop thread.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger = logging.getLogger(logger)
+        self.clear()
+
+    def clear(self):
+        """ """
+        self.slots = 0
+        self.buffer_size = 0
+        self.data = None
+        self.ref_counts = []
+        self.data_dicts = []
+        self.next_slot = 0
+
+    def setup(self, slots, buffer_size):
+        """ """
+        self.clear()
+        self.slots = int(slots)
+        self.buffer_size = int(buffer_size)
+        self.data = numpy.zeros((self.slots, self.buffer_size), dtype=numpy.int16)
+        self.ref_counts = [0] * self.slots
+        # One dict per slot, reused.
+        for slot in range(self.slots):
+            read_only = self.data[slot].view()
+            read_only.flags.writeable = False
+            self.data_dicts.append(
+                {
+                    "status": "data",
+                    "data": read_only,
+                    "slot": slot,
+                    "buffer_ring": self,
+                }
+            )
+
+    def get_write_slot(self):
+        """Next free slot, in order. None if all slots are in use.
+        The slot is reserved until published."""
+        for index in range(self.slots):
+            slot = (self.next_slot + index) % self.slots
+            if self.ref_counts[slot] == 0:
+                self.ref_counts[slot] = -1  # Reserved by producer.
+                self.next_slot = (slot + 1) % self.slots
+                return slot
+        return None
+
+    def get_write_buffer(self, slot):
+        """Writable view. Only used by the producer."""
+        return self.data[slot]
+
+    def publish(self, slot, number_of_consumers):
+        """Returns the dict to put on the consumer queues.
+        Called in the event loop thread."""
+        self.ref_counts[slot] = max(number_of_consumers, 0)
+        return self.data_dicts[slot]
+
+    def release(self, slot):
+        """Called in the event loop thread."""
+        if self.ref_counts[slot] > 0:
+            self.ref_counts[slot] -= 1
+
+    def get_free_slots(self):
+        """ """
+        return self.ref_counts.count(0)
+
+
+class SoundSampleRing:
+    """
+    Fixed size int16 sample ring with one producer and one consumer,
+    for example the event loop and a PortAudio callback.
+    Lock-free: The write counter is only changed by the producer and
+    the read counter only by the consumer.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger = logging.getLogger(logger)
+        self.setup(0)
+
+    def setup(self, size):
+        """ """
+        self.size = int(size)
+        self.data = numpy.zeros(self.size, dtype=numpy.int16)
+        self.write_counter = 0
+        self.read_counter = 0
+
+    def get_available(self):
+        """Samples ready to read."""
+        return self.write_counter - self.read_counter
+
+    def get_free(self):
+        """ """
+        return self.size - self.get_available()
+
+    def write(self, data):
+        """Returns the number of samples written, the rest did not fit."""
+        length = min(len(data), self.get_free())
+        start = self.write_counter % self.size if self.size else 0
+        first_part = min(length, self.size - start)
+        self.data[start : start + first_part] = data[:first_part]
+        self.data[: length - first_part] = data[first_part:length]
+        self.write_counter += length
+        return length
+
+    def read_into(self, out_buffer):
+        """Returns the number of samples copied to out_buffer."""
+        length = min(len(out_buffer), self.get_available())
+        start = self.read_counter % self.size if self.size else 0
+        first_part = min(length, self.size - start)
+        out_buffer[:first_part] = self.data[start : start + first_part]
+        out_buffer[first_part:length] = self.data[: length - first_part]
+        self.read_counter += length
+        return length
+
+    def skip(self, length):
+        """Removes samples without reading them. Only used by the consumer."""
+        length = min(length, self.get_available())
+        self.read_counter += length
+        return length
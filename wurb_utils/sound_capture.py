@@ -4,10 +4,22 @@
 # Copyright (c) 2023-present Arnold Andreasson
 # License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
 
+import time
 import asyncio
 import logging
 import numpy
 
+# CloudedBats.
+import wurb_utils
+from wurb_utils.sound_buffer_ring import SoundBufferRing
+
+# Same values as pyaudio.paContinue, pyaudio.paComplete,
+# pyaudio.paInputOverflow and pyaudio.paInputOverflowed.
+PA_CONTINUE = 0
+PA_COMPLETE = 1
+PA_INPUT_OVERFLOW = 2
+PA_INPUT_OVERFLOWED = -9981
+
 
 class SoundCapture:
     """ """
@@ -16,6 +28,8 @@ class SoundCapture:
         """ """
         self.logger = logging.getLogger(logger)
         self.audio = audio
+        # Buffers shared by all queues.
+        self.buffer_ring = SoundBufferRing(logger=logger)
         self.clear()
 
     def clear(self):
@@ -27,6 +41,19 @@ class SoundCapture:
         self.buffer_size = None
         self.main_loop = None
         self.capture_executor = None
+        self.callback_mode = False
+        self.stream = None
+        # Slot in the buffer ring being filled.
+        self.write_slot = None
+        self.write_buffer = None
+        self.write_pos = 0
+        self.reset_stream_time()
+
+    def reset_stream_time(self):
+        """Stream time is counted from the number of captured samples,
+        also samples skipped when no buffer was free."""
+        self.stream_start_s = time.time()
+        self.stream_samples = 0
 
     def get_capture_devices(self, part_of_name=None):
         """ """
@@ -54,22 +81,54 @@ class SoundCapture:
         sampling_freq_hz,
         frames,
         buffer_size,
+        ring_slots=8,
+        callback_mode=False,
     ):
-        """ """
+        """In callback mode PortAudio calls capture_callback() for each
+        period, no executor thread is used."""
         self.device_index = device_index
         self.channels = channels
         self.sampling_freq_hz = sampling_freq_hz
         self.frames = frames
         self.buffer_size = buffer_size
+        self.callback_mode = callback_mode
+        self.buffer_ring.setup(ring_slots, buffer_size)
+        self.reset_stream_time()
 
     def add_out_queue(self, out_queue):
         """ """
         self.out_queue_list.append(out_queue)
 
+    def buffer_to_queues(self, slot, adc_time):
+        """Runs in the event loop. The same buffer is used by all queues,
+        consumers must call release_buffer() when done."""
+        metrics = wurb_utils.pipeline_metrics
+        metrics.count("capture", "buffers_in")
+        data_dict = self.buffer_ring.publish(slot, len(self.out_queue_list))
+        data_dict["adc_time"] = adc_time
+        data_dict["detector_time"] = time.time()
+        for index, data_queue in enumerate(self.out_queue_list):
+            try:
+                metrics.queue_depth("capture", "queue_" + str(index), data_queue)
+                if not data_queue.full():
+                    data_queue.put_nowait(data_dict)
+                else:
+                    self.buffer_ring.release(slot)
+                    metrics.count("capture", "dropped_queue_full")
+                    self.logger.debug("Sound capture: Queue full.")
+            except Exception as e:
+                self.buffer_ring.release(slot)
+                # Logging error.
+                message = "Failed to put captured sound on queue: " + str(e)
+                self.logger.error(message)
+
     async def start(self):
         """ """
-        # Use executor for the IO-blocking part.
         self.main_loop = asyncio.get_event_loop()
+        if self.callback_mode:
+            self.start_callback_capture()
+            return
+        # Use executor for the IO-blocking part.
         self.capture_executor = self.main_loop.run_in_executor(None, self.run_capture)
 
     async def stop(self):
@@ -78,73 +137,144 @@ class SoundCapture:
         if self.capture_executor:
             self.capture_executor.cancel()
             self.capture_executor = None
+        if self.stream:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception as e:
+                self.logger.error("EXCEPTION Sound capture, stop: " + str(e))
+            self.stream = None
+            self.logger.debug("Sound capture ended.")
+
+    def get_input_channels(self):
+        """ """
+        if self.channels.upper() in ["STEREO", "MONO-LEFT", "MONO-RIGHT"]:
+            return 2
+        return 1
+
+    def select_channel(self, in_data_int16):
+        """Convert stereo to mono by using either left or right channel.
+        Views, no copies."""
+        if self.channels.upper() == "MONO-LEFT":
+            return in_data_int16[0::2]
+        if self.channels.upper() == "MONO-RIGHT":
+            return in_data_int16[1::2]
+        return in_data_int16
+
+    def get_samples_per_s(self):
+        """Samples per second in the buffers, after select_channel()."""
+        if self.channels.upper() == "STEREO":
+            return self.sampling_freq_hz * 2
+        return self.sampling_freq_hz
+
+    def write_to_ring(self, in_data_int16):
+        """Copies captured data into the buffer ring. The event loop is
+        called once for each full buffer. Runs in the capture thread."""
+        read_pos = 0
+        while read_pos < len(in_data_int16):
+            if self.write_slot is None:
+                self.write_slot = self.buffer_ring.get_write_slot()
+                if self.write_slot is None:
+                    # All buffers used by slow consumers. Skip data.
+                    self.stream_samples += len(in_data_int16) - read_pos
+                    wurb_utils.pipeline_metrics.count("capture", "dropped_no_buffer")
+                    self.logger.debug("Sound capture: No free buffer.")
+                    return
+                self.write_buffer = self.buffer_ring.get_write_buffer(self.write_slot)
+                self.write_pos = 0
+            length = min(
+                len(in_data_int16) - read_pos, self.buffer_size - self.write_pos
+            )
+            self.write_buffer[self.write_pos : self.write_pos + length] = in_data_int16[
+                read_pos : read_pos + length
+            ]
+            self.write_pos += length
+            read_pos += length
+            self.stream_samples += length
+            if self.write_pos >= self.buffer_size:
+                # Buffer full, put on queues in the event loop. The time
+                # is for the end of the buffer.
+                adc_time = self.stream_start_s + (
+                    self.stream_samples / self.get_samples_per_s()
+                )
+                try:
+                    self.main_loop.call_soon_threadsafe(
+                        self.buffer_to_queues, self.write_slot, adc_time
+                    )
+                except RuntimeError:
+                    # Event loop closed. Terminate.
+                    self.capture_active = False
+                    return
+                self.write_slot = None
+
+    def start_callback_capture(self):
+        """ """
+        self.capture_active = True
+        self.write_slot = None
+        self.reset_stream_time()
+        try:
+            self.stream = self.audio.open(
+                format=self.audio.get_format_from_width(2),
+                channels=self.get_input_channels(),
+                rate=self.sampling_freq_hz,
+                input=True,
+                output=False,
+                input_device_index=self.device_index,
+                frames_per_buffer=self.frames,
+                stream_callback=self.capture_callback,
+            )
+            self.stream.start_stream()
+        except Exception as e:
+            self.capture_active = False
+            self.stream = None
+            self.logger.error("EXCEPTION Sound capture: " + str(e))
+
+    def capture_callback(self, in_data, frame_count, time_info, status):
+        """Called by PortAudio in its own thread."""
+        try:
+            if status & PA_INPUT_OVERFLOW:
+                wurb_utils.pipeline_metrics.count("capture", "input_overflow")
+            in_data_int16 = numpy.frombuffer(in_data, dtype=numpy.int16)
+            self.write_to_ring(self.select_channel(in_data_int16))
+        except Exception as e:
+            self.logger.error("EXCEPTION Sound capture callback: " + str(e))
+        if self.capture_active:
+            return (None, PA_CONTINUE)
+        return (None, PA_COMPLETE)
 
     def run_capture(self):
         """ """
         self.capture_active = True
-        channels = 1
-        if self.channels.upper() in ["STEREO", "MONO-LEFT", "MONO-RIGHT"]:
-            channels = 2
+        self.write_slot = None
+        self.reset_stream_time()
         try:
             # p = pyaudio.PyAudio()
             stream = self.audio.open(
                 format=self.audio.get_format_from_width(2),
-                channels=channels,
+                channels=self.get_input_channels(),
                 rate=self.sampling_freq_hz,
                 input=True,
                 output=False,
                 input_device_index=self.device_index,
                 frames_per_buffer=self.frames,
             )
-            # Empty numpy buffer.
-            in_buffer_int16 = numpy.array([], dtype=numpy.int16)
+            # Captured data is copied directly into the shared buffers.
             while self.capture_active:
-                # Read from capture device.
-                data = stream.read(self.frames, exception_on_overflow=False)
+                # Read from capture device. Overflows are counted as in
+                # callback mode, the period read is lost.
+                try:
+                    data = stream.read(self.frames, exception_on_overflow=True)
+                except IOError as e:
+                    if e.errno != PA_INPUT_OVERFLOWED:
+                        raise
+                    wurb_utils.pipeline_metrics.count("capture", "input_overflow")
+                    self.stream_samples += (
+                        self.frames * self.get_samples_per_s() // self.sampling_freq_hz
+                    )
+                    continue
                 # Convert from string-byte array to int16 array.
                 in_data_int16 = numpy.frombuffer(data, dtype=numpy.int16)
-
-                # print("CAPTURE: Lengt int16: ", len(in_data_int16))
-                # print(in_data_int16[:10])
-                # print(numpy.max(in_data_int16))
-
-                # Convert stereo to mono by using either left or right channel.
-                if self.channels.upper() == "MONO-LEFT":
-                    in_data_int16 = in_data_int16[0::2].copy()
-                if self.channels.upper() == "MONO-RIGHT":
-                    in_data_int16 = in_data_int16[1::2].copy()
-                # Concatenate
-                in_buffer_int16 = numpy.concatenate((in_buffer_int16, in_data_int16))
-                while len(in_buffer_int16) >= self.buffer_size:
-                    # Copy "buffer_size" part and save remaining part.
-                    data_int16 = in_buffer_int16[0 : self.buffer_size]
-                    in_buffer_int16 = in_buffer_int16[self.buffer_size :]
-
-                    # Put data on queues in the queue list.
-                    for data_queue in self.out_queue_list:
-                        # Copy data.
-                        data_int16_copy = data_int16.copy()
-                        # Put together.
-                        data_dict = {
-                            "status": "data",
-                            "data": data_int16_copy,
-                        }
-                        try:
-                            if not data_queue.full():
-                                self.main_loop.call_soon_threadsafe(
-                                    data_queue.put_nowait, data_dict
-                                )
-                            else:
-                                self.logger.debug("Sound capture: Queue full.")
-                        #
-                        except Exception as e:
-                            # Logging error.
-                            message = "Failed to put captured sound on queue: " + str(e)
-                            self.logger.error(message)
-                            if not self.main_loop.is_running():
-                                # Terminate.
-                                self.capture_active = False
-                                break
+                self.write_to_ring(self.select_channel(in_data_int16))
         #
         except asyncio.CancelledError:
             pass
@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import fractions
+import math
+import numpy
+
+# CloudedBats.
+import wurb_utils
+from wurb_utils.sound_pitchshifting import SoundPitchshifting
+
+
+class SoundDecimatingFeedback(SoundPitchshifting):
+    """
+    Base for audio feedback modes calculated at the sampling frequency in,
+    and then decimated to the sampling frequency out. No overlap-add.
+    A CIC decimator takes the sound down to at least twice the sampling
+    frequency out, and the resampler used in pitch shifting does the rest.
+    """
+
+    def clear(self):
+        """ """
+        super().clear()
+        self.decimators = {}
+
+    def calc_params(self):
+        """Overlap-add parameters are not used, only the decimation."""
+        try:
+            factor = self.sampling_freq_in // (2 * self.sampling_freq_out)
+            self.decimators = {}
+            for channel in ["mono", "left", "right"]:
+                decimator = wurb_utils.SoundDecimator(logger=self.logger_name)
+                decimator.setup(factor, order=5)
+                self.decimators[channel] = decimator
+            factor = self.decimators["mono"].factor
+            self.create_resamplers(self.sampling_freq_in / factor)
+            self.logger.debug("Feedback: decimation factor: " + str(factor))
+        except Exception as e:
+            self.logger.error("Exception: Feedback setup: " + str(e))
+
+    def decimate(self, x, channel="mono"):
+        """CIC decimation, then resampled to the sampling frequency out."""
+        return self.resample(self.decimators[channel].resample(x), channel=channel)
+
+    def create_buffers(self):
+        """No overlap-add buffers are used."""
+        pass
+
+    def to_int16(self, buffer):
+        """Set volume, then clip instead of overflow."""
+        buffer = numpy.clip(buffer * (32768.0 * self.volume), -32768.0, 32767.0)
+        return buffer.astype(numpy.int16)
+
+    def to_stereo(self, left, right):
+        """ """
+        stereo_buffer = numpy.empty(len(left) * 2, dtype=numpy.float32)
+        stereo_buffer[::2] = left
+        stereo_buffer[1::2] = right
+        return stereo_buffer
+
+
+class SoundHeterodyne(SoundDecimatingFeedback):
+    """
+    Audio feedback as in a heterodyne bat detector. The sound is mixed
+    with a local oscillator, and the lowpass filter in the resampler
+    keeps the difference frequencies when decimating to the sampling
+    frequency out. Same interface as SoundPitchshifting.
+    """
+
+    def clear(self):
+        """ """
+        super().clear()
+        self.heterodyne_freq_hz = 40000.0
+        # The oscillator is precalculated, one period is lo_period samples.
+        self.lo_cycles = 0
+        self.lo_period = 1
+        self.lo_table = numpy.zeros(0, dtype=numpy.float32)
+        self.lo_offset = 0
+
+    def set_heterodyne_khz(self, heterodyne_khz):
+        """Can be changed while running. The frequency is rounded to get
+        a period of max 1000 samples."""
+        self.heterodyne_freq_hz = float(heterodyne_khz) * 1000.0
+        if self.sampling_freq_in:
+            ratio = fractions.Fraction(
+                self.heterodyne_freq_hz / self.sampling_freq_in
+            ).limit_denominator(1000)
+            self.lo_cycles = ratio.numerator
+            self.lo_period = ratio.denominator
+            self.lo_table = numpy.zeros(0, dtype=numpy.float32)
+            self.lo_offset = 0
+
+    def calc_params(self):
+        """ """
+        super().calc_params()
+        try:
+            self.set_heterodyne_khz(self.heterodyne_freq_hz / 1000.0)
+            self.logger.debug(
+                "Feedback: heterodyne_hz: " + str(self.heterodyne_freq_hz)
+            )
+        except Exception as e:
+            self.logger.error("Exception: Heterodyne setup: " + str(e))
+
+    def get_local_oscillator(self, length):
+        """Next part of the oscillator, continuous between buffers. Scaled
+        for int16 in, and mixing halves the amplitude."""
+        if len(self.lo_table) < length + self.lo_period:
+            steps = numpy.arange(length + self.lo_period)
+            phase = steps * (2.0 * math.pi * self.lo_cycles / self.lo_period)
+            self.lo_table = numpy.cos(phase) * (2.0 / 32768.0)
+            self.lo_table = self.lo_table.astype(numpy.float32)
+        oscillator = self.lo_table[self.lo_offset : self.lo_offset + length]
+        self.lo_offset = (self.lo_offset + length) % self.lo_period
+        return oscillator
+
+    def calc_pithshifting_mono(self, buffer_int16):
+        """ """
+        try:
+            oscillator = self.get_local_oscillator(len(buffer_int16))
+            mixed = buffer_int16 * oscillator
+            return self.to_int16(self.decimate(mixed, channel="mono"))
+        except Exception as e:
+            self.logger.debug("Exception: Heterodyne: mono: " + str(e))
+        return None
+
+    def calc_pithshifting_stereo(self, buffer_int16):
+        """ """
+        try:
+            oscillator = self.get_local_oscillator(len(buffer_int16) // 2)
+            left = self.decimate(buffer_int16[::2] * oscillator, channel="left")
+            right = self.decimate(buffer_int16[1::2] * oscillator, channel="right")
+            return self.to_int16(self.to_stereo(left, right))
+        except Exception as e:
+            self.logger.debug("Exception: Heterodyne: stereo: " + str(e))
+        return None
+
+
+class SoundFrequencyDivision(SoundDecimatingFeedback):
+    """
+    Audio feedback as in a frequency division bat detector. A square wave
+    changes sign after pitch_factor zero crossings, and is multiplied by
+    the rectified sound to keep the amplitude. The lowpass filter in the
+    decimator smooths the amplitude.
+    The sound is filtered by a short FIR filter before the zero crossings
+    are counted, the first difference for DC and low frequencies and a
+    binomial lowpass for noise close to the Nyquist frequency. Cheaper
+    than an IIR bandpass, and about the same noise above the threshold.
+    Same interface as SoundPitchshifting.
+    """
+
+    def clear(self):
+        """ """
+        super().clear()
+        # Levels below are not counted as zero crossings.
+        self.threshold = 10 ** (-50.0 / 20.0)
+        # Filter taps, newest sample first, and the last samples for
+        # each channel.
+        self.highpass_taps = numpy.array([1.0, -1.0], dtype=numpy.float32)
+        self.highpass_history = {}
+        # Last sign and number of zero crossings for each channel.
+        self.division_state = {}
+
+    def set_threshold_dbfs(self, threshold_dbfs):
+        """ """
+        self.threshold = 10 ** (float(threshold_dbfs) / 20.0)
+
+    def calc_params(self):
+        """ """
+        super().calc_params()
+        # Lowpass order 1 at 192 kHz, 3 at 384 kHz and 4 at 500 kHz.
+        lowpass_order = max(1, round(self.sampling_freq_in / 96000) - 1)
+        taps = numpy.array([1.0, -1.0])
+        for _ in range(lowpass_order):
+            taps = numpy.convolve(taps, [1.0, 1.0])
+        # Gain 1.0 in the middle of the filter band.
+        band_middle_hz = math.sqrt(
+            max(self.filter_low_limit_hz, 1) * max(self.filter_high_limit_hz, 1)
+        )
+        band_middle_hz = min(band_middle_hz, self.sampling_freq_in / 4)
+        omega = 2.0 * math.pi * band_middle_hz / self.sampling_freq_in
+        gain = abs(numpy.sum(taps * numpy.exp(-1j * omega * numpy.arange(len(taps)))))
+        self.highpass_taps = numpy.array(taps / gain, dtype=numpy.float32)
+        self.highpass_history = {}
+        self.division_state = {}
+
+    def highpass(self, buffer, channel):
+        """ """
+        taps = self.highpass_taps
+        history = self.highpass_history.get(channel, None)
+        if history is None:
+            history = numpy.zeros(len(taps) - 1, dtype=numpy.float32)
+        work = numpy.concatenate((history, buffer))
+        self.highpass_history[channel] = work[len(buffer) :].copy()
+        # One pass for each tap, the taps are few.
+        length = len(buffer)
+        filtered = work[len(taps) - 1 :] * taps[0]
+        for index in range(1, len(taps)):
+            start = len(taps) - 1 - index
+            filtered += work[start : start + length] * taps[index]
+        return filtered
+
+    def divide(self, buffer, channel):
+        """ """
+        filtered = self.highpass(buffer, channel)
+        last_sign, crossings, square_sign = self.division_state.get(
+            channel, (0, 0, 1.0)
+        )
+        # Sign for samples above the threshold, zero for the others.
+        signs = (filtered > self.threshold).astype(numpy.int8)
+        signs -= filtered < -self.threshold
+        index = numpy.flatnonzero(signs)
+        signs = signs[index]
+        # Zero crossings, where the sign differs from the one before.
+        previous = numpy.empty(len(signs), dtype=numpy.int8)
+        previous[:1] = last_sign
+        previous[1:] = signs[:-1]
+        crossing_index = index[(signs != previous) & (previous != 0)]
+        # The square wave changes sign every pitch_div_factor:th crossing.
+        first = self.pitch_div_factor - crossings - 1
+        change_index = crossing_index[first :: self.pitch_div_factor]
+        lengths = numpy.diff(change_index, prepend=0, append=len(filtered))
+        levels = numpy.ones(len(lengths), dtype=numpy.float32)
+        levels[1::2] = -1.0
+        levels *= square_sign
+        square_wave = numpy.repeat(levels, lengths)
+        crossings = (crossings + len(crossing_index)) % self.pitch_div_factor
+        if len(signs) > 0:
+            last_sign = signs[-1]
+        self.division_state[channel] = (last_sign, crossings, levels[-1])
+        # Rectified sound, about 2/pi of the amplitude after lowpass.
+        divided = numpy.abs(filtered)
+        divided *= square_wave
+        divided *= math.pi / 2.0
+        return self.decimate(divided, channel=channel)
+
+    def calc_pithshifting_mono(self, buffer_int16):
+        """ """
+        try:
+            buffer = buffer_int16 * numpy.float32(1.0 / 32768.0)
+            return self.to_int16(self.divide(buffer, "mono"))
+        except Exception as e:
+            self.logger.debug("Exception: Frequency division: mono: " + str(e))
+        return None
+
+    def calc_pithshifting_stereo(self, buffer_int16):
+        """ """
+        try:
+            scale = numpy.float32(1.0 / 32768.0)
+            left = self.divide(buffer_int16[::2] * scale, "left")
+            right = self.divide(buffer_int16[1::2] * scale, "right")
+            return self.to_int16(self.to_stereo(left, right))
+        except Exception as e:
+            self.logger.debug("Exception: Frequency division: stereo: " + str(e))
+        return None
+
+
+# Audio feedback modes, as used in "sound_pitch_shifting.mode" in the config.
+feedback_modes = {
+    "pitch-shifting": SoundPitchshifting,
+    "heterodyne": SoundHeterodyne,
+    "frequency-division": SoundFrequencyDivision,
+}
+
+
+def create_sound_feedback(mode="pitch-shifting", logger="DefaultLogger"):
+    """Pitch shifting is used if the mode is not known."""
+    feedback_class = feedback_modes.get(mode, SoundPitchshifting)
+    return feedback_class(logger=logger)
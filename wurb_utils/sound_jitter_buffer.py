@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import logging
+import numpy
+
+# CloudedBats.
+import wurb_utils
+from wurb_utils.sound_buffer_ring import SoundSampleRing
+
+
+class SoundJitterBuffer:
+    """
+    Adaptive jitter buffer for playback, on a fixed size int16 ring.
+    Data is added in bursts, for example 0.5 sec from pitch shifting, and
+    read one period at a time by the sound card. The lowest fill level
+    during a window of about 1 sec is compared with a target margin:
+    - Underrun: The margin is increased, and playback waits until the
+      margin is filled again.
+    - No underruns for a long time: The margin is slowly decreased.
+    - Level above or below the margin: Periods are read with up to 1%
+      more or fewer frames, and resampled to the period length.
+    - Far too much data: Skipped down to the margin.
+    One producer and one consumer, same as SoundSampleRing.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger = logging.getLogger(logger)
+        self.ring = SoundSampleRing(logger=logger)
+        self.max_correction = 0.01
+        self.setup(channels=1, sampling_freq_hz=48000, frames=1024)
+
+    def setup(
+        self,
+        channels,
+        sampling_freq_hz,
+        frames,
+        start_margin_frames=None,
+        capacity_frames=None,
+    ):
+        """Capacity is at least 2 sec. Frames is the period size."""
+        self.channels = int(channels)
+        self.sampling_freq_hz = int(sampling_freq_hz)
+        self.frames = int(frames)
+        min_capacity = self.sampling_freq_hz * 2
+        if (capacity_frames is None) or (capacity_frames < min_capacity):
+            capacity_frames = min_capacity
+        self.capacity_frames = int(capacity_frames)
+        self.ring.setup(self.capacity_frames * self.channels)
+        # Margin limits, in frames.
+        self.min_margin = self.frames
+        self.max_margin = self.capacity_frames // 2
+        if start_margin_frames is None:
+            start_margin_frames = self.frames * 2
+        self.margin = min(
+            max(int(start_margin_frames), self.min_margin), self.max_margin
+        )
+        # Window for the lowest level, about 1 sec.
+        self.window_periods = max(1, self.sampling_freq_hz // self.frames)
+        self.decrease_after_windows = 10
+        self.clear()
+
+    def clear(self):
+        """Only when not running."""
+        self.ring.write_counter = 0
+        self.ring.read_counter = 0
+        self.waiting = True
+        self.correction = 0
+        self.window_counter = 0
+        self.window_min = None
+        self.windows_without_underrun = 0
+        self.interp_positions = {}
+        self.work_buffer = None
+        # Statistics.
+        self.underruns = 0
+        self.overruns = 0
+        self.skipped_frames = 0
+        self.corrected_periods = 0
+        self.last_level = 0
+        self.last_low_level = 0
+
+    def get_level(self):
+        """Frames in the ring."""
+        return self.ring.get_available() // self.channels
+
+    def write(self, data):
+        """Called by the producer. The whole chunk is dropped if it does
+        not fit, the consumer will catch up by skipping."""
+        if len(data) > (self.ring.get_free() // self.channels) * self.channels:
+            self.overruns += 1
+            wurb_utils.pipeline_metrics.count("playback", "overrun")
+            return False
+        self.ring.write(data)
+        return True
+
+    def read_into(self, out_buffer):
+        """Called by the consumer, for example a PortAudio callback. The
+        out buffer is always filled, with silence if needed."""
+        frames_out = len(out_buffer) // self.channels
+        level = self.get_level()
+        self.last_level = level
+        if self.waiting:
+            if level < self.margin:
+                out_buffer[:] = 0
+                return 0
+            self.waiting = False
+        self.check_window(level)
+        frames_in = frames_out
+        if self.correction != 0:
+            step = max(1, int(frames_out * self.max_correction))
+            frames_in = frames_out + self.correction * step
+        if level < frames_in:
+            # Underrun. Use what is left, then wait for a larger margin.
+            used = self.ring.read_into(out_buffer[: level * self.channels])
+            out_buffer[used:] = 0
+            self.underruns += 1
+            self.windows_without_underrun = 0
+            self.margin = min(self.margin + frames_out * 2, self.max_margin)
+            self.waiting = True
+            wurb_utils.pipeline_metrics.count("playback", "underrun")
+            return used
+        if frames_in == frames_out:
+            return self.ring.read_into(out_buffer)
+        return self.read_resampled(out_buffer, frames_in, frames_out)
+
+    def read_resampled(self, out_buffer, frames_in, frames_out):
+        """Reads frames_in frames, and stretches or compresses them to
+        frames_out by linear interpolation. Not audible for small changes."""
+        length_in = frames_in * self.channels
+        if (self.work_buffer is None) or (len(self.work_buffer) < length_in):
+            self.work_buffer = numpy.zeros(length_in * 2, dtype=numpy.int16)
+        work = self.work_buffer[:length_in]
+        self.ring.read_into(work)
+        key = (frames_in, frames_out)
+        positions = self.interp_positions.get(key, None)
+        if positions is None:
+            positions = (
+                numpy.linspace(0, frames_in - 1, frames_out),
+                numpy.arange(frames_in),
+            )
+            self.interp_positions[key] = positions
+        for channel in range(self.channels):
+            out_buffer[channel :: self.channels] = numpy.interp(
+                positions[0], positions[1], work[channel :: self.channels]
+            )
+        self.corrected_periods += 1
+        return len(out_buffer)
+
+    def check_window(self, level):
+        """Lowest level in each window, used to adjust the margin and the
+        correction for the next window."""
+        if (self.window_min is None) or (level < self.window_min):
+            self.window_min = level
+        self.window_counter += 1
+        if self.window_counter < self.window_periods:
+            return
+        low_level = self.window_min
+        self.last_low_level = low_level
+        self.window_counter = 0
+        self.window_min = None
+        # Slowly decrease the margin if there are no underruns.
+        self.windows_without_underrun += 1
+        if self.windows_without_underrun >= self.decrease_after_windows:
+            self.windows_without_underrun = 0
+            self.margin = max(self.margin - self.frames // 4, self.min_margin)
+        # Far too much data, skip down to the margin.
+        if low_level > self.margin + self.max_margin:
+            skipped = self.ring.skip((low_level - self.margin) * self.channels)
+            self.skipped_frames += skipped // self.channels
+            wurb_utils.pipeline_metrics.count(
+                "playback", "skipped_frames", skipped // self.channels
+            )
+            low_level = self.margin
+        # Compress if above, stretch if below. Hysteresis one period.
+        if low_level > self.margin + self.frames:
+            self.correction = 1
+        elif low_level < self.margin:
+            self.correction = -1
+        else:
+            self.correction = 0
+        metrics = wurb_utils.pipeline_metrics
+        metrics.set_gauge("playback", "latency_ms", self.frames_to_ms(self.last_level))
+        metrics.set_gauge("playback", "target_ms", self.frames_to_ms(self.margin))
+
+    def frames_to_ms(self, frames):
+        """ """
+        return round(frames * 1000.0 / self.sampling_freq_hz, 1)
+
+    def get_stats(self):
+        """Latency and underrun statistics, ready for JSON."""
+        return {
+            "latency_ms": self.frames_to_ms(self.last_level),
+            "low_latency_ms": self.frames_to_ms(self.last_low_level),
+            "target_ms": self.frames_to_ms(self.margin),
+            "underruns": self.underruns,
+            "overruns": self.overruns,
+            "skipped_frames": self.skipped_frames,
+            "corrected_periods": self.corrected_periods,
+        }
@@ -7,9 +7,12 @@
 import asyncio
 import numpy
 import scipy.signal
-import scipy.interpolate
 import logging
 
+# CloudedBats.
+import wurb_utils
+from wurb_utils.sound_buffer_ring import release_buffer
+
 
 class SoundPitchshifting(object):
     """
@@ -20,6 +23,7 @@ class SoundPitchshifting(object):
 
     def __init__(self, logger="DefaultLogger"):
         """ """
+        self.logger_name = logger
         self.logger = logging.getLogger(logger)
         self.queue = None
         self.clear()
@@ -35,17 +39,29 @@ class SoundPitchshifting(object):
         self.hop_out_length = None
         self.hop_in_length = None
         self.resample_factor = None
+        self.resamplers = {}
+        self.pitchshift_active = False
+        self.pitchshift_executor = None
         self.kaiser_beta = None
         self.window_size = None
         self.filter_order = 10
+        # Filter, designed once and state kept between buffers.
+        self.filter_key = None
+        self.filter_sos = None
+        self.filter_zi = {}
         # Work buffers.
         self.insert_pos = 0
         self.work_in = None
+        self.work_in_length = 0
         self.work_out = None
         self.work_in_left = None
+        self.work_in_left_length = 0
         self.work_out_left = None
         self.work_in_right = None
+        self.work_in_right_length = 0
         self.work_out_right = None
+        # Output positions for overlap-add, one row per window.
+        self.ola_indices = None
 
     def setup(
         self,
@@ -118,15 +134,24 @@ class SoundPitchshifting(object):
             kaiser_beta = int(self.pitch_div_factor * 0.8)
             self.window_size = int(self.hop_in_length * buffer_in_overlap_factor)
             self.window_function = numpy.kaiser(self.window_size, beta=kaiser_beta)
+            # Filter state from old buffers is not valid any more.
+            self.filter_zi = {}
+            # Overlap-add output is at the sampling frequency in divided
+            # by the pitch factor.
+            self.create_resamplers(self.sampling_freq_in / self.pitch_div_factor)
             #
             # Reset work buffers.
             self.insert_pos = 0
             self.work_in = None
+            self.work_in_length = 0
             self.work_out = None
             self.work_in_left = None
+            self.work_in_left_length = 0
             self.work_out_left = None
             self.work_in_right = None
+            self.work_in_right_length = 0
             self.work_out_right = None
+            self.ola_indices = None
 
             # For debug.
             self.logger.debug("Feedback: freq_in: " + str(self.sampling_freq_in))
@@ -164,14 +189,21 @@ class SoundPitchshifting(object):
         """ """
         # Clear queue.
         while not self.queue.empty():
-            self.queue.get_nowait()
+            release_buffer(self.queue.get_nowait())
             self.queue.task_done()
         # Copy data from queue to buffer.
         while self.pitchshift_active:
             try:
                 data_dict = await self.queue.get()
-                if "data" in data_dict:
-                    await self.add_buffer(data_dict["data"])
+                wurb_utils.pipeline_metrics.queue_depth(
+                    "pitchshift", "queue", self.queue
+                )
+                try:
+                    if "data" in data_dict:
+                        await self.add_buffer(data_dict["data"])
+                finally:
+                    # Shared capture buffers must be released.
+                    release_buffer(data_dict)
             except asyncio.CancelledError:
                 break
             except Exception as e:
@@ -184,7 +216,11 @@ class SoundPitchshifting(object):
         if self.channels == "STEREO":
             # Left buffers.
             if self.work_in_left is None:
-                self.work_in_left = numpy.array([], dtype=numpy.float32)
+                # Fixed size, 1 sec. Increased if needed.
+                self.work_in_left = numpy.zeros(
+                    self.sampling_freq_in, dtype=numpy.float32
+                )
+                self.work_in_left_length = 0
                 # 3 sec pitchshifting buffer length.
                 pitchshifting_buffer_length = int(self.sampling_freq_out * 3)
                 self.work_out_left = numpy.zeros(
@@ -193,7 +229,11 @@ class SoundPitchshifting(object):
                 self.insert_pos = 0
             # Right buffers.
             if self.work_in_right is None:
-                self.work_in_right = numpy.array([], dtype=numpy.float32)
+                # Fixed size, 1 sec. Increased if needed.
+                self.work_in_right = numpy.zeros(
+                    self.sampling_freq_in, dtype=numpy.float32
+                )
+                self.work_in_right_length = 0
                 # 3 sec pitchshifting buffer length.
                 pitchshifting_buffer_length = int(self.sampling_freq_out * 3)
                 self.work_out_right = numpy.zeros(
@@ -203,7 +243,9 @@ class SoundPitchshifting(object):
         else:
             # Mono buffers.
             if self.work_in is None:
-                self.work_in = numpy.array([], dtype=numpy.float32)
+                # Fixed size, 1 sec. Increased if needed.
+                self.work_in = numpy.zeros(self.sampling_freq_in, dtype=numpy.float32)
+                self.work_in_length = 0
                 # 3 sec pitchshifting buffer length.
                 pitchshifting_buffer_length = int(self.sampling_freq_out * 3)
                 self.work_out = numpy.zeros(
@@ -240,29 +282,24 @@ class SoundPitchshifting(object):
             right_buffer = buffer[1::2].copy()
 
             # Filter buffer. Butterworth bandpass.
-            filtered_left = self.butterworth_filter(left_buffer)
-            filtered_right = self.butterworth_filter(right_buffer)
+            filtered_left = self.butterworth_filter(left_buffer, channel="left")
+            filtered_right = self.butterworth_filter(right_buffer, channel="right")
 
-            # Concatenate with old buffer.
-            self.work_in_left = numpy.concatenate((self.work_in_left, filtered_left))
-            self.work_in_right = numpy.concatenate((self.work_in_right, filtered_right))
+            # Add to old buffer.
+            self.work_in_left, self.work_in_left_length = self.add_to_work_in(
+                self.work_in_left, self.work_in_left_length, filtered_left
+            )
+            self.work_in_right, self.work_in_right_length = self.add_to_work_in(
+                self.work_in_right, self.work_in_right_length, filtered_right
+            )
 
             # Add overlaps on pitchshifting_buffer. Window function is applied on "part".
-            self.insert_pos = 0
-            while self.work_in_left.size > self.window_size:
-                part_left = self.work_in_left[: self.window_size] * self.window_function
-                part_right = (
-                    self.work_in_right[: self.window_size] * self.window_function
-                )
-                self.work_in_left = self.work_in_left[self.hop_in_length :]
-                self.work_in_right = self.work_in_right[self.hop_in_length :]
-                self.work_out_left[
-                    self.insert_pos : self.insert_pos + self.window_size
-                ] += part_left
-                self.work_out_right[
-                    self.insert_pos : self.insert_pos + self.window_size
-                ] += part_right
-                self.insert_pos += self.hop_out_length
+            self.work_in_left_length, self.insert_pos = self.overlap_add(
+                self.work_in_left, self.work_in_left_length, self.work_out_left
+            )
+            self.work_in_right_length, self.insert_pos = self.overlap_add(
+                self.work_in_right, self.work_in_right_length, self.work_out_right
+            )
 
             # Flush.
             new_part_left = self.work_out_left[: self.insert_pos].copy()
@@ -278,8 +315,8 @@ class SoundPitchshifting(object):
             self.work_out_right[self.window_size :] = 0.0
 
             # Resample.
-            new_part_left_2 = self.resample(new_part_left)
-            new_part_right_2 = self.resample(new_part_right)
+            new_part_left_2 = self.resample(new_part_left, channel="left")
+            new_part_right_2 = self.resample(new_part_right, channel="right")
 
             # Join left and right to stereo.
             left_result = new_part_left_2.reshape(-1, 1)
@@ -316,18 +353,15 @@ class SoundPitchshifting(object):
             # Filter buffer. Butterworth bandpass.
             filtered = self.butterworth_filter(buffer)
 
-            # Concatenate with old buffer.
-            self.work_in = numpy.concatenate((self.work_in, filtered))
+            # Add to old buffer.
+            self.work_in, self.work_in_length = self.add_to_work_in(
+                self.work_in, self.work_in_length, filtered
+            )
 
             # Add overlaps on pitchshifting_buffer. Window function is applied on "part".
-            self.insert_pos = 0
-            while self.work_in.size > self.window_size:
-                part = self.work_in[: self.window_size] * self.window_function
-                self.work_in = self.work_in[self.hop_in_length :]
-                self.work_out[
-                    self.insert_pos : self.insert_pos + self.window_size
-                ] += part
-                self.insert_pos += self.hop_out_length
+            self.work_in_length, self.insert_pos = self.overlap_add(
+                self.work_in, self.work_in_length, self.work_out
+            )
 
             # Flush.
             new_part = self.work_out[: self.insert_pos].copy()
@@ -353,6 +387,49 @@ class SoundPitchshifting(object):
 
         return None
 
+    def add_to_work_in(self, work_in, length, data):
+        """Appends data after the used part. A larger buffer is only
+        allocated if the data does not fit."""
+        new_length = length + len(data)
+        if new_length > len(work_in):
+            new_work_in = numpy.zeros(new_length * 2, dtype=numpy.float32)
+            new_work_in[:length] = work_in[:length]
+            work_in = new_work_in
+        work_in[length:new_length] = data
+        return work_in, new_length
+
+    def get_ola_indices(self, number_of_windows):
+        """Output positions for each sample in the windows, as a flat view."""
+        if (self.ola_indices is None) or (len(self.ola_indices) < number_of_windows):
+            starts = numpy.arange(number_of_windows) * self.hop_out_length
+            self.ola_indices = starts[:, None] + numpy.arange(self.window_size)
+        return self.ola_indices[:number_of_windows].reshape(-1)
+
+    def overlap_add(self, work_in, length, work_out):
+        """Windows with hop_in_length in, added with hop_out_length in
+        work_out. Returns the length left in work_in and the insert
+        position in work_out."""
+        if length <= self.window_size:
+            return length, 0
+        number_of_windows = (length - self.window_size - 1) // self.hop_in_length + 1
+        # All windows as rows in a strided view, no copy.
+        windows = numpy.lib.stride_tricks.sliding_window_view(
+            work_in[:length], self.window_size
+        )[:: self.hop_in_length][:number_of_windows]
+        parts = windows * self.window_function
+        insert_pos = number_of_windows * self.hop_out_length
+        out_length = insert_pos - self.hop_out_length + self.window_size
+        work_out[:out_length] += numpy.bincount(
+            self.get_ola_indices(number_of_windows),
+            weights=parts.reshape(-1),
+            minlength=out_length,
+        )
+        # Move the unused part to the beginning.
+        used = number_of_windows * self.hop_in_length
+        new_length = length - used
+        work_in[:new_length] = work_in[used:length]
+        return new_length, insert_pos
+
     def buffer_to_queues(self, buffer_int16):
         """ """
         try:
@@ -372,7 +449,9 @@ class SoundPitchshifting(object):
                     #     )
                     if not data_queue.full():
                         data_queue.put_nowait(data_dict)
+                        wurb_utils.pipeline_metrics.count("pitchshift", "buffers_out")
                     else:
+                        wurb_utils.pipeline_metrics.count("pitchshift", "dropped")
                         self.logger.debug("Sound capture: Queue full.")
                 #
                 except Exception as e:
@@ -388,35 +467,63 @@ class SoundPitchshifting(object):
                 "Exception: WurbPitchShifting: buffer_to_queues: " + str(e)
             )
 
-    def butterworth_filter(self, buffer):
-        # Filter buffer. Butterworth bandpass.
-        filtered = buffer
-        try:
-            low_limit_hz = self.filter_low_limit_hz
-            high_limit_hz = self.filter_high_limit_hz
-            if (high_limit_hz + 100) >= (self.sampling_freq_in / 2):
-                high_limit_hz = self.sampling_freq_in / 2 - 100
-            if low_limit_hz < 0 or (low_limit_hz + 100 >= high_limit_hz):
-                low_limit_hz = 100
-            sos = scipy.signal.butter(
+    def get_filter_sos(self):
+        """Butterworth bandpass, only designed again when parameters change."""
+        low_limit_hz = self.filter_low_limit_hz
+        high_limit_hz = self.filter_high_limit_hz
+        if (high_limit_hz + 100) >= (self.sampling_freq_in / 2):
+            high_limit_hz = self.sampling_freq_in / 2 - 100
+        if low_limit_hz < 0 or (low_limit_hz + 100 >= high_limit_hz):
+            low_limit_hz = 100
+        filter_key = (
+            self.filter_order,
+            low_limit_hz,
+            high_limit_hz,
+            self.sampling_freq_in,
+        )
+        if filter_key != self.filter_key:
+            self.filter_sos = scipy.signal.butter(
                 self.filter_order,
                 [low_limit_hz, high_limit_hz],
                 btype="bandpass",
                 fs=self.sampling_freq_in,
                 output="sos",
             )
-            filtered = scipy.signal.sosfilt(sos, buffer)
+            self.filter_key = filter_key
+            self.filter_zi = {}
+        return self.filter_sos
+
+    def butterworth_filter(self, buffer, channel="mono"):
+        # Filter buffer. Butterworth bandpass.
+        filtered = buffer
+        try:
+            sos = self.get_filter_sos()
+            # Continue from the state at the end of the last buffer.
+            zi = self.filter_zi.get(channel, None)
+            if zi is None:
+                zi = numpy.zeros((sos.shape[0], 2))
+            filtered, self.filter_zi[channel] = scipy.signal.sosfilt(sos, buffer, zi=zi)
         except Exception as e:
             pass
             self.logger.debug("EXCEPTION: Butterworth: " + str(e))
 
         return filtered
 
-    def resample(self, x, kind="linear"):
+    def create_resamplers(self, resample_freq_in, taps_per_phase=16):
+        """One resampler for each channel, to the sampling frequency out."""
+        self.resamplers = {}
+        for channel in ["mono", "left", "right"]:
+            resampler = wurb_utils.SoundResampler(logger=self.logger_name)
+            resampler.setup(
+                resample_freq_in,
+                self.sampling_freq_out,
+                taps_per_phase=taps_per_phase,
+            )
+            self.resamplers[channel] = resampler
+
+    def resample(self, x, channel="mono"):
         """Resample to 48000 Hz, in most cases, to match output devices."""
         if x.size > 0:
-            n = int(numpy.ceil(x.size / self.resample_factor))
-            f = scipy.interpolate.interp1d(numpy.linspace(0, 1, x.size), x, kind)
-            return f(numpy.linspace(0, 1, n))
+            return self.resamplers[channel].resample(x)
         else:
             return x
@@ -8,6 +8,17 @@ import asyncio
 import logging
 import numpy
 
+# CloudedBats.
+import wurb_utils
+from wurb_utils.sound_buffer_ring import release_buffer
+from wurb_utils.sound_jitter_buffer import SoundJitterBuffer
+
+# Same values as pyaudio.paContinue, pyaudio.paComplete
+# and pyaudio.paOutputUnderflow.
+PA_CONTINUE = 0
+PA_COMPLETE = 1
+PA_OUTPUT_UNDERFLOW = 4
+
 
 class SoundPlayback:
     """ """
@@ -17,6 +28,8 @@ class SoundPlayback:
         self.logger = logging.getLogger(logger)
         self.audio = audio
         self.queue = None
+        # Used by both the callback and the blocking mode.
+        self.jitter_buffer = SoundJitterBuffer(logger=logger)
         self.clear()
 
     def clear(self):
@@ -30,7 +43,9 @@ class SoundPlayback:
         self.playback_active = False
         self.playback_queue_active = False
         self.playback_executor = None
-        self.buffer_int16 = None
+        self.callback_mode = False
+        self.stream = None
+        self.callback_buffer = None
 
     def get_playback_devices(self, part_of_name=None):
         """ """
@@ -60,14 +75,25 @@ class SoundPlayback:
         buffer_size,
         buffer_max_size,
         in_queue_length=10,
+        callback_mode=False,
     ):
-        """ """
+        """In callback mode PortAudio calls playback_callback() for each
+        period, no executor thread is used."""
         self.device_index = device_index
         self.channels = channels
         self.sampling_freq_hz = sampling_freq_hz
         self.frames = frames
         self.buffer_size = buffer_size
         self.buffer_max_size = buffer_max_size
+        self.callback_mode = callback_mode
+        # Buffer size is the start latency, in frames.
+        self.jitter_buffer.setup(
+            channels=self.get_output_channels(),
+            sampling_freq_hz=sampling_freq_hz,
+            frames=frames,
+            start_margin_frames=buffer_size,
+            capacity_frames=buffer_max_size // self.get_output_channels(),
+        )
         # Setup queue for data in.
         self.queue = asyncio.Queue(maxsize=in_queue_length)
 
@@ -77,21 +103,29 @@ class SoundPlayback:
 
     async def start(self):
         """ """
-        # Use executor for the IO-blocking part.
-        main_loop = asyncio.get_event_loop()
-        self.playback_executor = main_loop.run_in_executor(None, self.run_playback)
+        if self.callback_mode:
+            self.start_callback_playback()
+        else:
+            # Use executor for the IO-blocking part.
+            main_loop = asyncio.get_event_loop()
+            self.playback_executor = main_loop.run_in_executor(None, self.run_playback)
         await asyncio.sleep(0.1)
         # Clear queue.
         while not self.queue.empty():
-            self.queue.get_nowait()
+            release_buffer(self.queue.get_nowait())
             self.queue.task_done()
         # Copy data from queue to buffer.
         self.playback_queue_active = True
         while self.playback_queue_active:
             try:
                 data_dict = await self.queue.get()
-                if "data" in data_dict:
-                    self.add_data(data_dict["data"])
+                wurb_utils.pipeline_metrics.queue_depth("playback", "queue", self.queue)
+                try:
+                    if "data" in data_dict:
+                        self.add_data(data_dict["data"])
+                finally:
+                    # Shared capture buffers must be released.
+                    release_buffer(data_dict)
             except asyncio.CancelledError:
                 break
             except Exception as e:
@@ -106,24 +140,70 @@ class SoundPlayback:
         if self.playback_executor:
             self.playback_executor.cancel()
             self.playback_executor = None
+        if self.stream:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception as e:
+                self.logger.error("EXCEPTION PLAYBACK, stop: " + str(e))
+            self.stream = None
+            self.logger.debug("PLAYBACK ENDED.")
+
+    def get_output_channels(self):
+        """ """
+        if self.channels.upper() in ["STEREO", "MONO-LEFT", "MONO-RIGHT"]:
+            return 2
+        return 1
+
+    def start_callback_playback(self):
+        """ """
+        self.playback_active = True
+        try:
+            self.stream = self.audio.open(
+                format=self.audio.get_format_from_width(2),
+                channels=self.get_output_channels(),
+                rate=self.sampling_freq_hz,
+                input=False,
+                output=True,
+                output_device_index=self.device_index,
+                frames_per_buffer=self.frames,
+                stream_callback=self.playback_callback,
+            )
+            self.stream.start_stream()
+        except Exception as e:
+            self.playback_active = False
+            self.stream = None
+            self.logger.error("EXCEPTION PLAYBACK-2: " + str(e))
+
+    def playback_callback(self, in_data, frame_count, time_info, status):
+        """Called by PortAudio in its own thread. Silence if not enough
+        data is available."""
+        length = frame_count * self.get_output_channels()
+        if (self.callback_buffer is None) or (len(self.callback_buffer) != length):
+            self.callback_buffer = numpy.zeros(length, dtype=numpy.int16)
+        self.jitter_buffer.read_into(self.callback_buffer)
+        if status & PA_OUTPUT_UNDERFLOW:
+            wurb_utils.pipeline_metrics.count("playback", "output_underflow")
+        if self.playback_active:
+            return (self.callback_buffer.tobytes(), PA_CONTINUE)
+        return (self.callback_buffer.tobytes(), PA_COMPLETE)
 
     def add_data(self, data):
         """ """
-        # self.logger.debug("DEBUG DATA ADDED. Length: " + str(len(data)))
-        if self.buffer_int16 is None:
-            self.buffer_int16 = numpy.array([], dtype=numpy.int16)
         # Avoid to long delay.
-        if len(self.buffer_int16) <= self.buffer_max_size:
-            self.buffer_int16 = numpy.concatenate((self.buffer_int16, data))
-        else:
-            self.logger.debug("SKIP. Len: " + str(self.buffer_int16.size))
+        if not self.jitter_buffer.write(data):
+            wurb_utils.pipeline_metrics.count("playback", "dropped")
+            self.logger.debug("SKIP. Len: " + str(len(data)))
+
+    def get_stats(self):
+        """Latency and underruns, from the jitter buffer."""
+        return self.jitter_buffer.get_stats()
 
     def run_playback(self):
         """ """
         self.playback_active = True
-        channels = 1
-        if self.channels.upper() in ["STEREO", "MONO-LEFT", "MONO-RIGHT"]:
-            channels = 2
+        channels = self.get_output_channels()
+        stream = None
         try:
             # p = pyaudio.PyAudio()
             stream = self.audio.open(
@@ -135,27 +215,12 @@ class SoundPlayback:
                 output_device_index=self.device_index,
                 frames_per_buffer=self.frames,
             )
-            # To be used when no data in buffer.
-            silent_buffer = numpy.zeros((self.frames, 1), dtype=numpy.float16)
+            # Reused for each period. Silence if no data.
+            buffer_int16 = numpy.zeros(self.frames * channels, dtype=numpy.int16)
             # Loop over the IO blocking part.
             while self.playback_active:
                 try:
-                    # Use silent buffer as default.
-                    buffer_int16 = silent_buffer
-                    #
-                    if (self.buffer_int16 is not None) and (
-                        self.buffer_int16.size >= self.frames
-                    ):
-                        # Copy part to be used.
-                        buffer_int16 = self.buffer_int16[: self.frames]
-                        # Remove used part.
-                        self.buffer_int16 = self.buffer_int16[self.frames :]
-
-                    #     self.logger.debug("SOUND. Len: " + str(self.buffer_int16.size))
-                    # else:
-                    #     if self.buffer_int16 is not None:
-                    #         self.logger.debug("SILENCE. Len: " + str(self.buffer_int16.size))
-
+                    self.jitter_buffer.read_into(buffer_int16)
                     # Convert to byte buffer and write.
                     buffer_bytes = buffer_int16.tobytes()
                     stream.write(buffer_bytes, exception_on_underflow=False)
@@ -171,6 +236,7 @@ class SoundPlayback:
             self.logger.error("EXCEPTION PLAYBACK-2: " + str(e))
         finally:
             self.playback_active = False
-            stream.close()
+            if stream:
+                stream.close()
             # p.terminate()
             self.logger.debug("PLAYBACK ENDED.")
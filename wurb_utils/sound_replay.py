@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import asyncio
+import logging
+import pathlib
+import time
+import wave
+import numpy
+import scipy.signal
+
+# CloudedBats.
+import wurb_utils
+
+
+def create_synthetic_buffer(
+    sampling_freq_hz, buffer_size, buffer_index, rng, noise_level=0.002
+):
+    """Noise, and FM bat calls from 60 to 40 kHz every 100 ms during
+    2 sec passes every 10 sec. Frequencies are scaled down if needed
+    for low sampling frequencies."""
+    buffer = rng.normal(0.0, noise_level, buffer_size)
+    buffer_start_s = buffer_index * buffer_size / sampling_freq_hz
+    if (buffer_start_s % 10.0) < 2.0:
+        scale = min(1.0, sampling_freq_hz / 2 / 70000)
+        call_length = int(sampling_freq_hz * 0.005)
+        call_time = numpy.arange(call_length) / sampling_freq_hz
+        call = scipy.signal.chirp(
+            call_time, f0=60000 * scale, t1=call_time[-1], f1=40000 * scale
+        )
+        call *= scipy.signal.windows.hann(call_length)
+        call_interval = int(sampling_freq_hz * 0.1)
+        for start in range(0, buffer_size - call_length, call_interval):
+            buffer[start : start + call_length] += call * rng.uniform(0.02, 0.2)
+    return numpy.array(numpy.clip(buffer, -1.0, 1.0) * 32767, dtype=numpy.int16)
+
+
+class SoundReplay:
+    """
+    Capture source for tests and benchmarks without a microphone.
+    Replays WAV files, or generates synthetic bat calls and noise, and
+    emits the same dicts as PetterssonM500. Pacing is "realtime" or
+    "fast", as fast as the consumer takes the buffers.
+    """
+
+    def __init__(
+        self,
+        data_queue=None,
+        direct_target=None,
+        source="synthetic",
+        pacing="realtime",
+        logger="DefaultLogger",
+    ):
+        """Source is "synthetic", a WAV file or a directory with WAV files."""
+        self.data_queue = data_queue
+        self.direct_target = direct_target
+        self.source = source
+        self.pacing = pacing
+        self.logger = logging.getLogger(logger)
+        self.device_name = "Sound replay"
+        self.sampling_freq_hz = 384000
+        self.buffer_size = None
+        self.max_buffers = None
+        self.loop_files = False
+        self.capture_active = False
+        self.main_loop = None
+
+    def get_device_name(self):
+        """ """
+        return self.device_name
+
+    def get_sampling_freq_hz(self):
+        """From the first file, or the default for synthetic sound."""
+        file_list = self.get_file_list()
+        if file_list:
+            with wave.open(str(file_list[0]), "rb") as wave_file:
+                return self.get_file_sampling_freq_hz(file_list[0], wave_file)
+        return self.sampling_freq_hz
+
+    def get_file_sampling_freq_hz(self, file_path, wave_file):
+        """Sampling frequency when recorded. Time expanded files, "TE384"
+        in the filename, are stored at 1/10 rate. Only 16 bits files are
+        supported."""
+        if wave_file.getsampwidth() != 2:
+            message = "Only 16 bits WAV files can be replayed: "
+            raise ValueError(message + pathlib.Path(file_path).name)
+        sampling_freq_hz = wave_file.getframerate()
+        if "_TE" in pathlib.Path(file_path).name:
+            sampling_freq_hz *= 10
+        return sampling_freq_hz
+
+    def read_wave_file(self, file_path):
+        """Returns sampling frequency and int16 data, left channel if stereo."""
+        with wave.open(str(file_path), "rb") as wave_file:
+            sampling_freq_hz = self.get_file_sampling_freq_hz(file_path, wave_file)
+            channels = wave_file.getnchannels()
+            data = wave_file.readframes(wave_file.getnframes())
+        data_int16 = numpy.frombuffer(data, dtype=numpy.int16)
+        if channels > 1:
+            # Left channel.
+            data_int16 = data_int16[::channels]
+        return sampling_freq_hz, data_int16
+
+    def is_capture_active(self):
+        """ """
+        return self.capture_active
+
+    def get_file_list(self):
+        """ """
+        if self.source in [None, "", "synthetic"]:
+            return []
+        source_path = pathlib.Path(self.source)
+        if source_path.is_dir():
+            return sorted(source_path.glob("*.wav"))
+        return [source_path]
+
+    async def initiate_capture(
+        self, card_index, sampling_freq, buffer_size, max_buffers=None
+    ):
+        """Max buffers, if not None, stops the replay after that number."""
+        self.main_loop = asyncio.get_running_loop()
+        self.sampling_freq_hz = int(sampling_freq)
+        self.buffer_size = int(buffer_size)
+        self.max_buffers = max_buffers
+
+    async def start_capture_in_executor(self):
+        """Same name as for the microphones. No executor is needed."""
+        if self.is_capture_active():
+            self.logger.debug("ERROR: CAPTURE already running: ")
+            return
+        await self.run_replay()
+
+    async def stop_capture(self):
+        """ """
+        self.capture_active = False
+
+    def iterate_buffers(self):
+        """Yields int16 buffers of buffer_size samples."""
+        file_list = self.get_file_list()
+        if not file_list:
+            rng = numpy.random.default_rng(0)
+            buffer_index = 0
+            while True:
+                yield create_synthetic_buffer(
+                    self.sampling_freq_hz, self.buffer_size, buffer_index, rng
+                )
+                buffer_index += 1
+        while True:
+            leftover = numpy.array([], dtype=numpy.int16)
+            for file_path in file_list:
+                _sampling_freq_hz, data_int16 = self.read_wave_file(file_path)
+                data_int16 = numpy.concatenate((leftover, data_int16))
+                start = 0
+                while start + self.buffer_size <= len(data_int16):
+                    yield data_int16[start : start + self.buffer_size].copy()
+                    start += self.buffer_size
+                leftover = data_int16[start:]
+            if not self.loop_files:
+                return
+
+    async def run_replay(self):
+        """ """
+        self.capture_active = True
+        metrics = wurb_utils.pipeline_metrics
+        buffer_length_s = self.buffer_size / self.sampling_freq_hz
+        start_time = time.time()
+        buffer_counter = 0
+        try:
+            for data_int16 in self.iterate_buffers():
+                if not self.capture_active:
+                    break
+                if (self.max_buffers is not None) and (
+                    buffer_counter >= self.max_buffers
+                ):
+                    break
+                adc_time = start_time + buffer_counter * buffer_length_s
+                buffer_counter += 1
+                if self.pacing == "realtime":
+                    # Wait until the buffer would have been captured.
+                    delay = adc_time + buffer_length_s - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    detector_time = time.time()
+                else:
+                    # Not related to real time, avoids time drift restarts.
+                    detector_time = adc_time
+                send_dict = {
+                    "status": "data",
+                    "adc_time": adc_time,
+                    "detector_time": detector_time,
+                    "data": data_int16,
+                }
+                metrics.count("replay", "buffers_in")
+                if self.data_queue:
+                    if self.pacing == "realtime":
+                        # Same as a microphone, skip if full.
+                        if not self.data_queue.full():
+                            self.data_queue.put_nowait(send_dict)
+                        else:
+                            metrics.count("replay", "dropped_queue_full")
+                            self.logger.debug("Sound replay: Queue full.")
+                    else:
+                        await self.data_queue.put(send_dict)
+                if self.direct_target:
+                    try:
+                        if self.direct_target.is_active():
+                            self.direct_target.add_data(data_int16)
+                    except Exception as e:
+                        # Logging error.
+                        message = "Failed to add data to direct_target: " + str(e)
+                        self.logger.debug(message)
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Logging error.
+            message = "Sound replay: " + str(e)
+            self.logger.error(message)
+        finally:
+            self.capture_active = False
+            self.logger.debug("Sound replay ended.")
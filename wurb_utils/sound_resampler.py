@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import fractions
+import logging
+import numpy
+import scipy.signal
+
+
+class SoundResampler:
+    """
+    Streaming rational resampler, up by "up" and down by "down", with a
+    polyphase lowpass FIR filter for anti-aliasing. The last input samples
+    and the output position are kept between chunks, so chunks of any size
+    give the same result as one long signal.
+    Filter banks are calculated once for each rate pair and shared.
+    """
+
+    # Polyphase filter banks, key: (up, down, taps_per_phase).
+    filter_banks = {}
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger = logging.getLogger(logger)
+        self.up = 1
+        self.down = 1
+        self.taps_per_phase = 0
+        self.poly_filter = None
+        self.clear()
+
+    def clear(self):
+        """Clears the stream state, the filter is kept."""
+        self.history = numpy.zeros(max(self.taps_per_phase - 1, 0), numpy.float32)
+        self.work_buffer = numpy.zeros(0, dtype=numpy.float32)
+        self.next_position = 0
+
+    def setup(
+        self, sampling_freq_in, sampling_freq_out, taps_per_phase=16, max_factor=200
+    ):
+        """The ratio is approximated if up or down would be above max_factor,
+        for example for 48000 / (250000 / 30)."""
+        ratio = fractions.Fraction(float(sampling_freq_out) / float(sampling_freq_in))
+        # Both up and down limited to max_factor.
+        max_denominator = max(1, int(max_factor / max(float(ratio), 1.0)))
+        ratio = ratio.limit_denominator(max_denominator)
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        self.taps_per_phase = int(taps_per_phase)
+        self.poly_filter = self.get_filter_bank(self.up, self.down, self.taps_per_phase)
+        self.clear()
+
+    @classmethod
+    def get_filter_bank(cls, up, down, taps_per_phase):
+        """Rows are phases, columns are taps for input samples, oldest first."""
+        key = (up, down, taps_per_phase)
+        poly_filter = cls.filter_banks.get(key, None)
+        if poly_filter is None:
+            # Cutoff at the lowest Nyquist frequency, relative to the upsampled.
+            cutoff = 1.0 / max(up, down)
+            fir = scipy.signal.firwin(
+                taps_per_phase * up, cutoff * 0.95, window=("kaiser", 6.0)
+            )
+            fir = fir * up
+            poly_filter = fir.reshape(taps_per_phase, up).T[:, ::-1]
+            poly_filter = numpy.ascontiguousarray(poly_filter, dtype=numpy.float32)
+            poly_filter.flags.writeable = False
+            cls.filter_banks[key] = poly_filter
+        return poly_filter
+
+    def get_output_length(self, input_length):
+        """Number of samples resample() will return for the next chunk."""
+        end_position = input_length * self.up
+        if self.next_position >= end_position:
+            return 0
+        return -(-(end_position - self.next_position) // self.down)
+
+    def resample(self, x):
+        """Returns the resampled chunk as float32."""
+        input_length = len(x)
+        history_length = len(self.history)
+        # History and new data in one buffer, only allocated when larger.
+        total_length = history_length + input_length
+        if len(self.work_buffer) < total_length:
+            self.work_buffer = numpy.zeros(total_length * 2, dtype=numpy.float32)
+        work = self.work_buffer[:total_length]
+        work[:history_length] = self.history
+        work[history_length:] = x
+        output_length = self.get_output_length(input_length)
+        result = numpy.zeros(output_length, dtype=numpy.float32)
+        # Input samples for each output sample, as rows in a strided view.
+        windows = numpy.lib.stride_tricks.sliding_window_view(work, self.taps_per_phase)
+        # Every up:th output sample has the same phase, and the input
+        # moves down samples between them. One matrix product per phase.
+        for first in range(min(self.up, output_length)):
+            # Position in the upsampled stream, relative to the chunk start.
+            position = self.next_position + first * self.down
+            phase = position % self.up
+            start = position // self.up + history_length - self.taps_per_phase + 1
+            length = len(range(first, output_length, self.up))
+            rows = windows[start : start + (length - 1) * self.down + 1 : self.down]
+            result[first :: self.up] = rows @ self.poly_filter[phase]
+        # Keep state for the next chunk.
+        self.next_position += output_length * self.down - input_length * self.up
+        self.history = work[total_length - history_length :].copy()
+        return result
+
+
+class SoundDecimator:
+    """
+    Streaming decimation by an integer factor with a CIC filter, a moving
+    sum of "factor" samples repeated "order" times. Calculated as a short
+    FIR filter on blocks of "factor" samples, one matrix product for each
+    order, and the rest of a chunk is kept for the next one.
+    The passband droop and the attenuation close to the output Nyquist
+    frequency are handled by a SoundResampler after the decimator.
+    """
+
+    def __init__(self, logger="DefaultLogger"):
+        """ """
+        self.logger = logging.getLogger(logger)
+        self.factor = 1
+        self.order = 1
+        self.block_filter = numpy.ones((1, 1), dtype=numpy.float32)
+        self.clear()
+
+    def clear(self):
+        """Clears the stream state, the filter is kept."""
+        history_length = (self.order - 1) * self.factor
+        self.history = numpy.zeros(history_length, dtype=numpy.float32)
+
+    def setup(self, factor, order=5):
+        """ """
+        self.factor = max(1, int(factor))
+        self.order = max(1, int(order))
+        fir = numpy.ones(1)
+        for _ in range(self.order):
+            fir = numpy.convolve(fir, numpy.ones(self.factor))
+        fir /= self.factor**self.order
+        # Padded to whole blocks. Rows are blocks, oldest first.
+        block_fir = numpy.zeros(self.order * self.factor)
+        block_fir[: len(fir)] = fir
+        block_filter = block_fir[::-1].reshape(self.order, self.factor)
+        self.block_filter = numpy.ascontiguousarray(block_filter, dtype=numpy.float32)
+        self.clear()
+
+    def resample(self, x):
+        """Returns the decimated chunk as float32."""
+        if self.factor == 1:
+            return numpy.asarray(x, dtype=numpy.float32)
+        work = numpy.concatenate((self.history, numpy.asarray(x, numpy.float32)))
+        number_of_blocks = len(work) // self.factor
+        output_length = max(0, number_of_blocks - self.order + 1)
+        blocks = work[: number_of_blocks * self.factor].reshape(-1, self.factor)
+        result = blocks[:output_length] @ self.block_filter[0]
+        for index in range(1, self.order):
+            result += blocks[index : index + output_length] @ self.block_filter[index]
+        # Keep the blocks used by the next output, and samples not used.
+        self.history = work[output_length * self.factor :].copy()
+        return result
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Main project: https://github.com/cloudedbats
+# Copyright (c) 2023-present Arnold Andreasson
+# License: MIT License (see LICENSE or http://opensource.org/licenses/mit).
+
+import asyncio
+import logging
+
+# CloudedBats.
+import wurb_utils
+
+
+class StreamHub:
+    """
+    Fan-out of messages to many clients, for example WebSockets.
+    Messages are prepared once by the producer and the same object is put
+    on all client queues. Each client has a bounded queue, and for slow
+    clients the oldest message is dropped instead of waiting.
+    Used in the event loop thread only.
+    """
+
+    def __init__(self, name, client_queue_length=10, logger="DefaultLogger"):
+        """The name is used as stage in pipeline metrics."""
+        self.name = name
+        self.client_queue_length = client_queue_length
+        self.logger = logging.getLogger(logger)
+        self.client_queues = []
+        # Called when the first client is added and the last is removed.
+        self.on_first_client = None
+        self.on_no_clients = None
+
+    def get_number_of_clients(self):
+        """ """
+        return len(self.client_queues)
+
+    def has_clients(self):
+        """ """
+        return len(self.client_queues) > 0
+
+    def subscribe(self):
+        """Returns the queue for the new client."""
+        client_queue = asyncio.Queue(maxsize=self.client_queue_length)
+        self.client_queues.append(client_queue)
+        wurb_utils.pipeline_metrics.set_gauge(
+            self.name, "clients", len(self.client_queues)
+        )
+        if (len(self.client_queues) == 1) and self.on_first_client:
+            self.on_first_client()
+        return client_queue
+
+    def unsubscribe(self, client_queue):
+        """ """
+        if client_queue in self.client_queues:
+            self.client_queues.remove(client_queue)
+        wurb_utils.pipeline_metrics.set_gauge(
+            self.name, "clients", len(self.client_queues)
+        )
+        if (len(self.client_queues) == 0) and self.on_no_clients:
+            self.on_no_clients()
+
+    def publish(self, message):
+        """Same message to all clients, never blocks."""
+        metrics = wurb_utils.pipeline_metrics
+        for client_queue in self.client_queues:
+            if client_queue.full():
+                # Slow client, drop the oldest message.
+                try:
+                    client_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+                metrics.count(self.name, "dropped")
+            client_queue.put_nowait(message)
+        metrics.count(self.name, "messages_out", len(self.client_queues))